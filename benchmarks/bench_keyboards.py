@@ -0,0 +1,63 @@
+# benchmarks/bench_keyboards.py
+"""
+Микробенчмарк фабрик клавиатур: время и память на вызов
+без кэша (исходная фабрика) и с кэшем.
+
+Запуск из корня проекта:
+    python benchmarks/bench_keyboards.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import keyboards  # noqa: E402
+
+CALLS = 20000
+ORDER_IDS = 500  # разных заказов в параметризованных клавиатурах
+
+CASES = [
+    ("create_main_menu", lambda f, i: f()),
+    ("create_admin_menu", lambda f, i: f()),
+    ("create_promo_keyboard", lambda f, i: f()),
+    ("create_docs_questions_keyboard", lambda f, i: f()),
+    ("create_rating_keyboard", lambda f, i: f(i % ORDER_IDS)),
+    ("create_admin_order_actions_keyboard", lambda f, i: f(i % ORDER_IDS)),
+]
+
+
+def measure(factory, call) -> tuple:
+    """Время (мкс) и выделенная память (байт) на один вызов"""
+    started_at = time.perf_counter()
+    for i in range(CALLS):
+        call(factory, i)
+    per_call_us = (time.perf_counter() - started_at) / CALLS * 1e6
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    snapshot_calls = 1000
+    keep = [call(factory, i) for i in range(snapshot_calls)]
+    allocated = (tracemalloc.get_traced_memory()[0] - before) / snapshot_calls
+    tracemalloc.stop()
+    del keep
+    return per_call_us, allocated
+
+
+def main():
+    print(f"{'фабрика':<38}{'без кэша':>20}{'с кэшем':>20}{'ускорение':>12}")
+    for name, call in CASES:
+        cached = getattr(keyboards, name)
+        raw_us, raw_bytes = measure(cached.__wrapped__, call)
+        cached.cache_clear()
+        cached_us, cached_bytes = measure(cached, call)
+        print(f"{name:<38}"
+              f"{raw_us:>9.2f} мкс {raw_bytes:>6.0f} Б"
+              f"{cached_us:>9.2f} мкс {cached_bytes:>6.0f} Б"
+              f"{raw_us / cached_us:>11.0f}x")
+    print(keyboards.get_keyboard_cache_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/replay_payments.py
+"""
+Повторная доставка одного платежа: один и тот же successful_payment
+(тот же provider_payment_id) подается REPLAYS раз из WORKERS потоков,
+у каждого потока свое соединение с общей временной БД.
+
+Проверяется, что платеж записан один раз, заказ оплачен, реферальный
+бонус начислен один раз, а все остальные доставки посчитаны как повторы.
+
+Запуск из корня проекта:
+    python benchmarks/replay_payments.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Глобальный db создается при импорте в текущем каталоге - уводим его во временный
+os.environ.setdefault("BOT_TOKEN", "0:replay")
+os.environ.setdefault("ADMIN_ID", "1")
+WORKDIR = tempfile.mkdtemp(prefix="replay_payments_")
+os.chdir(WORKDIR)
+
+import logging  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+from database import Database  # noqa: E402
+
+REPLAYS = 1000
+WORKERS = 16
+PRICE = 490
+PAYLOAD = "order_replay"
+CHARGE_ID = "provider_charge_replay"
+DB_PATH = os.path.join(WORKDIR, "replay.db")
+
+_local = threading.local()
+
+
+def connection() -> Database:
+    """Свое соединение на поток: повторы конкурируют за запись в БД, а не за объект Python"""
+    database = getattr(_local, 'database', None)
+    if database is None:
+        database = _local.database = Database(DB_PATH, backup_dir=os.path.join(WORKDIR, "backups"))
+    return database
+
+
+def prepare() -> int:
+    database = Database(DB_PATH, backup_dir=os.path.join(WORKDIR, "backups"))
+    cursor = database.conn.cursor()
+    cursor.execute('''
+        INSERT INTO orders (user_id, username, service_type, price, status, payment_status, referrer_id)
+        VALUES (2, 'replay', 'replay', ?, 'pending', 'pending', 3)
+    ''', (PRICE,))
+    order_id = cursor.lastrowid
+    cursor.execute("INSERT INTO referrals (referrer_id, referred_id, status) VALUES (3, 2, 'pending')")
+    database.conn.commit()
+    database.set_invoice_payload(order_id, PAYLOAD)
+    database.conn.close()
+    return order_id
+
+
+def deliver(_) -> tuple:
+    return connection().process_payment(PAYLOAD, CHARGE_ID, PRICE * 100)
+
+
+def main():
+    order_id = prepare()
+    pool = ThreadPoolExecutor(max_workers=WORKERS)
+    # Соединения открываются до замера, чтобы считать только зачисление платежей
+    list(pool.map(lambda _: connection(), range(WORKERS * 4)))
+
+    started_at = time.perf_counter()
+    results = list(pool.map(deliver, range(REPLAYS)))
+    elapsed = time.perf_counter() - started_at
+    pool.shutdown()
+
+    check = Database(DB_PATH, backup_dir=os.path.join(WORKDIR, "backups"))
+    cursor = check.conn.cursor()
+    payments = cursor.execute('SELECT COUNT(*) FROM payments WHERE provider_payment_id = ?',
+                              (CHARGE_ID,)).fetchone()[0]
+    status, payment_status = cursor.execute('SELECT status, payment_status FROM orders WHERE id = ?',
+                                            (order_id,)).fetchone()
+    referrals = cursor.execute("SELECT COUNT(*), SUM(referrer_bonus) FROM referrals WHERE status = 'completed'"
+                               ).fetchone()
+
+    applied = sum(1 for success, _, duplicate in results if success and not duplicate)
+    duplicates = sum(1 for success, _, duplicate in results if success and duplicate)
+    failed = sum(1 for success, _, _ in results if not success)
+
+    print(f"доставок: {REPLAYS} из {WORKERS} потоков за {elapsed * 1000:.0f} мс "
+          f"({elapsed / REPLAYS * 1e6:.0f} мкс на доставку)")
+    print(f"зачислено: {applied}, повторов: {duplicates}, ошибок: {failed}")
+    print(f"строк payments: {payments}, заказ: {status}/{payment_status}, "
+          f"рефералов начислено: {referrals[0]} на {referrals[1]}₽")
+
+    ok = applied == 1 and duplicates == REPLAYS - 1 and payments == 1 and status == 'paid' and referrals[0] == 1
+    print("OK" if ok else "ОШИБКА: платеж зачислен не ровно один раз")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,9 +2,14 @@
 import asyncio
 import logging
 import os
+import signal
 import sys
+import time
 from pathlib import Path
 
+# Отсчет времени запуска - до тяжелых импортов
+_started_at = time.perf_counter()
+
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
@@ -21,20 +26,36 @@ logs_dir = Path(__file__).parent / "logs"
 backup_dir.mkdir(exist_ok=True)
 logs_dir.mkdir(exist_ok=True)
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(logs_dir / "bot.log", encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
+# Настройка логирования: запись в файл и консоль в фоновом потоке
+from utils.logger import setup_logging, stop_logging
+
+setup_logging(
+    logs_dir,
+    level=config.LOG_LEVEL,
+    max_bytes=config.LOG_MAX_BYTES,
+    backup_count=config.LOG_BACKUP_COUNT,
+    sample_every=config.LOG_SAMPLE_EVERY
 )
 
 logger = logging.getLogger(__name__)
 
 # Инициализация базы данных
 from database import db
+from utils.sender import message_sender
+from utils.broadcast import broadcast_manager
+from utils.notifier import admin_notifier
+from utils.startup import StartupOrchestrator
+from utils.bot_identity import bot_identity
+from utils.metrics import metrics, start_metrics_server
+from utils.shutdown import shutdown_coordinator
+from utils.catalog import rebuild_catalog
+from utils.templates import templates
+from utils.sla import sla_queue
+from utils.invoices import invoice_validator, expire_stale_invoices
+from utils.operators import operator_registry
+from utils.outbox import outbox_dispatcher
+from utils.sweeper import sweeper
+from models.enums import AdminEventType, ShutdownStage
 
 # Инициализация бота с настройками по умолчанию
 # В aiogram 3.x DefaultBotProperties может не быть во всех версиях
@@ -45,12 +66,50 @@ bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage, name="main_dispatcher")
 
+# Обновления одного пользователя - по очереди, разных пользователей - параллельно
+from middlewares import UserOrderingMiddleware, HandlerMetricsMiddleware, ThrottlingMiddleware
+
+update_ordering = UserOrderingMiddleware(
+    max_concurrency=config.MAX_CONCURRENT_UPDATES,
+    max_queue_per_user=config.USER_QUEUE_SIZE
+)
+dp.update.outer_middleware(update_ordering)
+dp["update_ordering"] = update_ordering
+
+# Антифлуд - до остальных inner-middleware, чтобы отброшенные обновления ничего не стоили
+throttling = ThrottlingMiddleware(
+    rate=config.THROTTLE_RATE,
+    burst=config.THROTTLE_BURST,
+    admin_rate=config.ADMIN_THROTTLE_RATE,
+    admin_burst=config.ADMIN_THROTTLE_BURST,
+    is_admin=operator_registry.is_operator,
+    warn=config.THROTTLE_WARN
+)
+dp.message.middleware(throttling)
+dp.callback_query.middleware(throttling)
+dp["throttling"] = throttling
+
+# Время и количество вызовов каждого обработчика
+handler_metrics = HandlerMetricsMiddleware(metrics)
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+dp.pre_checkout_query.middleware(handler_metrics)
+metrics_runner = None
+
+# Фоновые задачи обслуживания БД (регистрируются после apply_runtime_config ниже)
+CLARIFY_SWEEP_JOB = "Окна уточнений"
+INVOICE_SWEEP_JOB = "Просроченные счета"
+
+# Время до начала приема обновлений: критические шаги - фазами, остальное - после старта поллинга
+startup = StartupOrchestrator(started_at=_started_at)
+startup.mark("Импорт и БД")
+
 
 async def include_routers():
     """Регистрация всех роутеров"""
     try:
         # Импортируем роутеры
-        from handlers.common import router as common_router
+        from handlers.common import router as common_router, fallback_router
         from handlers.user import router as user_router
         from handlers.payment import router as payment_router
         from handlers.admin import router as admin_router
@@ -60,6 +119,9 @@ async def include_routers():
         dp.include_router(user_router)
         dp.include_router(payment_router)
         dp.include_router(admin_router)
+        # Неизвестные команды и любой текст - последними, чтобы не перехватывать
+        # FSM-шаги и команды других роутеров
+        dp.include_router(fallback_router)
 
         logger.info("Все роутеры успешно зарегистрированы")
         return True
@@ -104,74 +166,244 @@ async def on_startup():
     logger.info(f"Админ ID: {config.ADMIN_ID}")
     logger.info("=" * 50)
 
-    # Проверяем токен
+    # Проверка токена, регистрация роутеров и сброс вебхука не зависят друг от друга
+    await startup.run_phase(
+        "Авторизация и роутеры",
+        check_token(),
+        include_routers(),
+        bot.delete_webhook(drop_pending_updates=True)
+    )
+
+    # Запускаем планировщик исходящих сообщений
+    message_sender.configure(
+        global_rate=config.SEND_GLOBAL_RATE,
+        per_chat_rate=config.SEND_PER_CHAT_RATE,
+        workers=config.SEND_WORKERS
+    )
+    message_sender.start(bot)
+    # Ответы, записанные в outbox до остановки, досылаются сразу
+    outbox_dispatcher.start()
+    broadcast_manager.rate = config.BROADCAST_RATE
+    admin_notifier.configure(config.ADMIN_ID, window=config.ADMIN_DIGEST_WINDOW_SECONDS)
+
+    # Прайс-лист читается из БД один раз до приема заказов
+    rebuild_catalog()
+
+    # Очередь SLA загружается один раз, дальше обновляется по событиям БД;
+    # истекшие аренды заказов операторами снимаются в фоне
+    sla_queue.attach(db)
+    invoice_validator.attach(db)
+    operator_registry.reload()
+    operator_registry.start()
+    sweeper.start()
+
+    # Все шаблоны сообщений уже скомпилированы при импорте роутеров - проверяем, что они рендерятся
+    if templates.check():
+        admin_notifier.notify(AdminEventType.ERROR, "Ошибки в шаблонах сообщений, подробности в логе")
+
+    # kill -HUP <pid> перечитывает .env/config.json (на Windows сигнала нет)
+    if hasattr(signal, 'SIGHUP'):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_config_on_signal)
+        except NotImplementedError:
+            pass
+
+    # Некритичные задачи выполняются уже после начала приема обновлений
+    startup.defer("Команды меню", setup_bot_commands)
+    startup.defer("Бэкап БД", backup_on_startup)
+    startup.defer("Уведомление админа", notify_admin_started)
+    startup.defer("Продолжение рассылки", resume_broadcast)
+    startup.defer("Планы запросов фильтров", check_filter_plans)
+    startup.defer("Очистка связей сообщений", prune_message_links)
+    if config.METRICS_PORT:
+        startup.defer("Эндпоинт метрик", start_metrics)
+
+
+async def check_token():
+    """Проверка токена (заодно кэширует данные бота для поллинга и ссылок)"""
     try:
-        bot_info = await bot.get_me()
+        bot_info = await bot_identity.refresh(bot)
         logger.info(f"Бот авторизован как: @{bot_info.username} (ID: {bot_info.id})")
     except Exception as e:
         logger.error(f"Ошибка авторизации бота: {e}")
         raise
 
-    # Настраиваем команды
-    await setup_bot_commands()
 
-    # Создаем резервную копию БД
-    try:
-        if db.backup():
-            logger.info("Резервная копия БД создана при запуске")
-    except Exception as e:
-        logger.warning(f"Не удалось создать бэкап при запуске: {e}")
+async def backup_on_startup():
+    """Резервная копия БД без блокировки цикла событий"""
+    if await asyncio.to_thread(db.backup):
+        logger.info("Резервная копия БД создана при запуске")
 
-    # Отправляем уведомление админу
-    try:
-        await bot.send_message(
-            chat_id=config.ADMIN_ID,
-            text=f"✅ <b>Бот запущен!</b>\n\n"
-                 f"Время: {asyncio.get_event_loop().time()}\n"
-                 f"Статус: Работает\n"
-                 f"Режим оплаты: {'🟡 ТЕСТОВЫЙ' if config.PAYMENT_TEST_MODE else '🟢 РЕАЛЬНЫЙ'}",
-            parse_mode=ParseMode.HTML
-        )
-    except Exception as e:
-        logger.warning(f"Не удалось уведомить админа о запуске: {e}")
+
+async def check_filter_plans():
+    """Все сочетания фильтров заказов должны выполняться по индексам"""
+    unindexed = db.check_filter_plans()
+    if unindexed:
+        admin_notifier.notify(AdminEventType.ERROR, f"Фильтров заказов без индекса: {len(unindexed)}, подробности в логе")
+
+
+async def prune_message_links():
+    """Связи сообщений с заказами нужны, пока на них могут ответить"""
+    removed = db.prune_message_links(days=90)
+    if removed:
+        logger.info(f"Удалено устаревших связей сообщений с заказами: {removed}")
+
+
+async def notify_admin_started():
+    """Уведомление админа о запуске (попадет в ближайшую сводку)"""
+    admin_notifier.notify(
+        AdminEventType.SYSTEM,
+        f"✅ Бот запущен, режим оплаты: {'🟡 ТЕСТОВЫЙ' if config.PAYMENT_TEST_MODE else '🟢 РЕАЛЬНЫЙ'}"
+    )
+
+
+async def resume_broadcast():
+    """Продолжение рассылки, прерванной предыдущей остановкой"""
+    broadcast_manager.resume_unfinished()
+
+
+async def start_metrics():
+    """HTTP-эндпоинт метрик для Prometheus"""
+    global metrics_runner
+    metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+
+
+@dp.startup()
+async def on_polling_started():
+    """Поллинг запускается: фиксируем время готовности и запускаем отложенные задачи"""
+    startup.mark_ready()
+    startup.start_deferred()
 
 
 async def on_shutdown():
     """Действия при остановке бота"""
     logger.info("Остановка бота...")
+    await shutdown_coordinator.run()
+
+
+async def stop_intake(remaining: float):
+    """Прекращаем прием обновлений и фоновые задачи, порождающие новую работу"""
+    update_ordering.stop_accepting()
+    await startup.stop()
+    # Рассылка приостанавливается и продолжится при следующем запуске
+    await broadcast_manager.stop()
+    await operator_registry.stop()
+    await sweeper.stop()
+
+
+async def drain_handlers(remaining: float):
+    """Ждем обработчики, которые уже выполняются или стоят в очередях пользователей"""
+    processed_before = update_ordering.processed
+    await update_ordering.wait_idle(remaining)
+    return update_ordering.processed - processed_before, update_ordering.busy
+
+
+async def flush_admin_notifications(remaining: float):
+    """Сообщаем об остановке вместе с накопленными событиями"""
+    admin_notifier.notify(AdminEventType.SYSTEM, "🛑 Бот остановлен")
+    await admin_notifier.close()
+
+
+async def stop_outbox(remaining: float):
+    """Дожидаемся текущей пачки outbox; недоставленное уйдет после перезапуска"""
+    delivered_before = outbox_dispatcher.delivered
+    await outbox_dispatcher.stop(timeout=min(remaining, 5.0))
+    return outbox_dispatcher.delivered - delivered_before, db.get_outbox_stats().get('pending', 0)
+
+
+async def flush_outbound_messages(remaining: float):
+    """Дожидаемся отправки очереди исходящих сообщений"""
+    finished_before = message_sender.sent + message_sender.failed
+    abandoned = await message_sender.close(timeout=remaining)
+    return message_sender.sent + message_sender.failed - finished_before, abandoned
 
-    # Закрываем соединение с БД
-    try:
-        db.conn.close()
-        logger.info("Соединение с БД закрыто")
-    except Exception as e:
-        logger.error(f"Ошибка закрытия БД: {e}")
 
-    # Отправляем уведомление админу
+async def close_fsm_storage(remaining: float):
+    await dp.storage.close()
+
+
+async def close_metrics_server(remaining: float):
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+async def close_database(remaining: float):
+    db.close()
+
+
+async def close_bot_session(remaining: float):
+    await bot.session.close()
+
+
+async def close_logging(remaining: float):
+    stop_logging()
+
+
+def apply_runtime_config(cfg):
+    """Применение перезагруженных лимитов к уже работающим компонентам"""
+    message_sender.configure(global_rate=cfg.SEND_GLOBAL_RATE, per_chat_rate=cfg.SEND_PER_CHAT_RATE)
+    broadcast_manager.rate = cfg.BROADCAST_RATE
+    admin_notifier.window = cfg.ADMIN_DIGEST_WINDOW_SECONDS
+    update_ordering.max_queue_per_user = cfg.USER_QUEUE_SIZE
+    throttling.configure(
+        rate=cfg.THROTTLE_RATE,
+        burst=cfg.THROTTLE_BURST,
+        admin_rate=cfg.ADMIN_THROTTLE_RATE,
+        admin_burst=cfg.ADMIN_THROTTLE_BURST,
+        warn=cfg.THROTTLE_WARN
+    )
+    shutdown_coordinator.deadline = cfg.SHUTDOWN_TIMEOUT_SECONDS
+    sla_queue.configure(
+        order_hours=cfg.SLA_ORDER_HOURS,
+        clarification_hours=cfg.SLA_CLARIFICATION_HOURS,
+        new_docs_hours=cfg.SLA_NEW_DOCS_HOURS
+    )
+    operator_registry.configure(
+        lease_minutes=cfg.ORDER_CLAIM_MINUTES,
+        sweep_interval=cfg.ORDER_CLAIM_SWEEP_SECONDS
+    )
+    invoice_validator.ttl = cfg.INVOICE_CACHE_SECONDS
+    sweeper.configure(CLARIFY_SWEEP_JOB, interval=cfg.CLARIFY_SWEEP_SECONDS)
+    sweeper.configure(INVOICE_SWEEP_JOB, interval=cfg.INVOICE_SWEEP_SECONDS)
+
+
+def reload_config_on_signal():
+    """Перезагрузка конфигурации по SIGHUP"""
     try:
-        await bot.send_message(
-            chat_id=config.ADMIN_ID,
-            text="🛑 <b>Бот остановлен</b>",
-            parse_mode=ParseMode.HTML
-        )
+        changes, restart_required = config.reload()
+        if restart_required:
+            logger.warning(f"Параметры применятся только после перезапуска: {', '.join(restart_required)}")
     except Exception as e:
-        logger.warning(f"Не удалось уведомить админа об остановке: {e}")
+        logger.error(f"Ошибка перезагрузки конфигурации: {e}")
+
+
+config.subscribe(apply_runtime_config)
+sweeper.add_job(CLARIFY_SWEEP_JOB, db.close_expired_clarify_windows, interval=config.CLARIFY_SWEEP_SECONDS)
+sweeper.add_job(INVOICE_SWEEP_JOB, expire_stale_invoices, interval=config.INVOICE_SWEEP_SECONDS)
+shutdown_coordinator.deadline = config.SHUTDOWN_TIMEOUT_SECONDS
+shutdown_coordinator.add_step("Прием обновлений", stop_intake, ShutdownStage.STOP_INTAKE)
+shutdown_coordinator.add_step("Обработчики", drain_handlers, ShutdownStage.DRAIN)
+shutdown_coordinator.add_step("Уведомления админа", flush_admin_notifications, ShutdownStage.FLUSH)
+shutdown_coordinator.add_step("Outbox ответов", stop_outbox, ShutdownStage.FLUSH)
+shutdown_coordinator.add_step("Исходящие сообщения", flush_outbound_messages, ShutdownStage.FLUSH)
+shutdown_coordinator.add_step("FSM-хранилище", close_fsm_storage, ShutdownStage.CLOSE)
+shutdown_coordinator.add_step("Эндпоинт метрик", close_metrics_server, ShutdownStage.CLOSE)
+shutdown_coordinator.add_step("База данных", close_database, ShutdownStage.CLOSE)
+shutdown_coordinator.add_step("Сессия бота", close_bot_session, ShutdownStage.CLOSE)
+# Логирование останавливается последним, чтобы записать итог остановки
+shutdown_coordinator.add_step("Логирование", close_logging, ShutdownStage.CLOSE)
 
 
 async def main():
     """Главная функция запуска бота"""
     try:
-        # Действия при запуске
+        # Действия при запуске (включая регистрацию роутеров)
         await on_startup()
 
-        # Регистрация роутеров
-        await include_routers()
-
         logger.info("Бот готов к работе. Ожидание сообщений...")
 
-        # Запуск поллинга
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        # Запуск поллинга (сессия закрывается при остановке - после отправки очереди сообщений)
+        await dp.start_polling(bot, close_bot_session=False)
 
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске: {e}", exc_info=True)
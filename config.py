@@ -1,11 +1,19 @@
 # config.py - поместите этот файл в C:\Users\АДМИН\ProjectRazMedBot\
+import json
+import logging
 import os
-from typing import Optional
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from pydantic import BaseModel, validator
-from dotenv import load_dotenv
+from dotenv import dotenv_values
 
-# Загружаем переменные окружения из .env файла
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent
+ENV_FILE = BASE_DIR / ".env"
+# Необязательный JSON-файл с настройками (приоритет выше .env)
+CONFIG_FILE = Path(os.getenv("CONFIG_FILE", BASE_DIR / "config.json"))
 
 
 class BotConfig(BaseModel):
@@ -23,6 +31,7 @@ class BotConfig(BaseModel):
     PROVIDER_TOKEN: Optional[str] = None
     PAYMENT_TEST_MODE: bool = True
     TEST_PAYMENT_PRICE: int = 1
+    INVOICE_CACHE_SECONDS: int = 600  # сколько выставленный счет проверяется без запроса к БД
 
     # Пути и база данных
     DATABASE_URL: str = "sqlite:///orders.db"
@@ -35,6 +44,16 @@ class BotConfig(BaseModel):
 
     # Настройки уточнений
     CLARIFICATION_TIME_LIMIT_HOURS: int = 24
+    CLARIFY_SWEEP_SECONDS: int = 300  # как часто закрываются истекшие окна уточнений
+
+    # Сроки ответа (SLA) по открытым заказам, в часах
+    SLA_ORDER_HOURS: float = 24  # обещание "до 24 часов" от создания заказа
+    SLA_CLARIFICATION_HOURS: float = 4  # ответ на уточняющий вопрос
+    SLA_NEW_DOCS_HOURS: float = 48  # напоминание по заказам, ждущим новых документов
+
+    # Операторы: аренда взятого заказа и период проверки истекших аренд
+    ORDER_CLAIM_MINUTES: int = 30
+    ORDER_CLAIM_SWEEP_SECONDS: int = 60
 
     # Реферальная система
     REFERRER_BONUS_PERCENT: int = 10  # 10% приглашающему
@@ -42,10 +61,46 @@ class BotConfig(BaseModel):
 
     # Дополнительные настройки
     LOG_LEVEL: str = "INFO"
+    LOG_MAX_BYTES: int = 10 * 1024 * 1024  # ротация bot.log по размеру, старые файлы сжимаются
+    LOG_BACKUP_COUNT: int = 10
+    LOG_SAMPLE_EVERY: int = 1  # писать каждое N-е массовое INFO-сообщение (1 - все)
     DATABASE_BACKUP_COUNT: int = 10
-    PAYMENT_TIMEOUT_MINUTES: int = 15
+    PAYMENT_TIMEOUT_MINUTES: int = 15  # неоплаченный счет старше этого срока отменяется
+    INVOICE_SWEEP_SECONDS: int = 60  # как часто отменяются просроченные счета
+    NOTIFY_EXPIRED_INVOICES: bool = True  # сообщать пользователю об отмене неоплаченного заказа
     DEFAULT_SERVICE_PRICE: int = 490
 
+    # Параллельная обработка обновлений
+    MAX_CONCURRENT_UPDATES: int = 32  # общий лимит одновременно обрабатываемых обновлений
+    USER_QUEUE_SIZE: int = 10  # максимум ожидающих обновлений одного пользователя
+
+    # Лимиты исходящих сообщений (ограничения Telegram)
+    SEND_GLOBAL_RATE: float = 30  # сообщений в секунду на бота
+    SEND_PER_CHAT_RATE: float = 1  # сообщений в секунду в один чат
+    SEND_WORKERS: int = 8
+    BROADCAST_RATE: float = 20  # рассылки не занимают весь общий лимит
+
+    # Уведомления администратора
+    ADMIN_DIGEST_WINDOW_SECONDS: int = 60  # окно накопления событий в одну сводку
+
+    # Антифлуд: запросов в секунду и запас на всплеск, на пользователя и класс обработчика
+    THROTTLE_RATE: float = 1.0
+    THROTTLE_BURST: int = 5
+    ADMIN_THROTTLE_RATE: float = 10.0
+    ADMIN_THROTTLE_BURST: int = 30
+    THROTTLE_WARN: bool = True  # False - отбрасывать молча, без ответа "слишком часто"
+
+    # Остановка: сколько всего ждать завершения обработчиков и отправки очереди
+    SHUTDOWN_TIMEOUT_SECONDS: float = 25
+
+    # Метрики (Prometheus), доступны только локально; 0 - эндпоинт отключен
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9100
+
+    class Config:
+        # Снимок настроек неизменяем: перезагрузка создает новый объект
+        frozen = True
+
     @validator('BOT_TOKEN')
     def validate_token(cls, v):
         if not v:
@@ -59,13 +114,116 @@ class BotConfig(BaseModel):
         return v
 
 
+# Параметры, которые применяются только при запуске (пересоздание бота, БД, воркеров)
+RESTART_REQUIRED_FIELDS = {
+    'BOT_TOKEN', 'ADMIN_ID', 'DATABASE_URL', 'BACKUP_DIR', 'SEND_WORKERS',
+    'MAX_CONCURRENT_UPDATES', 'METRICS_HOST', 'METRICS_PORT',
+    'LOG_LEVEL', 'LOG_MAX_BYTES', 'LOG_BACKUP_COUNT', 'LOG_SAMPLE_EVERY',
+}
+
+
+def load_config() -> BotConfig:
+    """
+    Чтение настроек. Приоритет источников: config.json > переменные окружения > .env > значения по умолчанию
+    (как у load_dotenv: окружение процесса, например контейнера, не перекрывается .env)
+    """
+    values: Dict[str, Any] = {}
+    if ENV_FILE.exists():
+        for name, value in dotenv_values(ENV_FILE).items():
+            if name in BotConfig.__fields__ and value is not None:
+                values[name] = value
+
+    for name in BotConfig.__fields__:
+        if name in os.environ:
+            values[name] = os.environ[name]
+
+    if CONFIG_FILE.exists():
+        with open(CONFIG_FILE, encoding='utf-8') as config_file:
+            values.update({name: value for name, value in json.load(config_file).items()
+                           if name in BotConfig.__fields__})
+
+    # Словари и списки из .env/окружения задаются в JSON
+    for name, field in BotConfig.__fields__.items():
+        value = values.get(name)
+        if isinstance(value, str) and field.outer_type_ is not str and value.strip()[:1] in ('{', '['):
+            values[name] = json.loads(value)
+
+    values.setdefault('BOT_TOKEN', "")
+    values.setdefault('ADMIN_ID', 0)
+    return BotConfig(**values)
+
+
+class ConfigProxy:
+    """
+    Текущая конфигурация бота.
+
+    Атрибуты читаются из актуального неизменяемого снимка (config.MAX_DOCUMENTS).
+    Обработчик, которому нужно несколько согласованных значений, берет
+    снимок один раз: cfg = config.snapshot(). Перезагрузка подменяет снимок
+    целиком одной операцией, поэтому уже выполняющиеся обработчики
+    продолжают работать со своим снимком.
+    """
+
+    def __init__(self, snapshot: BotConfig):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_subscribers', [])
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._snapshot, name)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError("Конфигурация неизменяема, используйте config.reload()")
+
+    def snapshot(self) -> BotConfig:
+        """Текущий неизменяемый снимок настроек"""
+        return self._snapshot
+
+    def subscribe(self, callback: Callable[[BotConfig], None]):
+        """Вызывать callback(новый_снимок) после каждой успешной перезагрузки"""
+        self._subscribers.append(callback)
+
+    def reload(self) -> Tuple[Dict[str, Tuple[Any, Any]], List[str]]:
+        """
+        Перечитать настройки и атомарно подменить снимок.
+
+        Возвращает (примененные изменения {параметр: (было, стало)},
+        параметры, требующие перезапуска). При ошибке чтения или валидации
+        текущий снимок не меняется и исключение пробрасывается.
+        """
+        with self._lock:
+            old = self._snapshot
+            loaded = load_config()
+
+            changes, restart_required = {}, []
+            values = old.dict()
+            for name, value in loaded.dict().items():
+                if value == values[name]:
+                    continue
+                if name in RESTART_REQUIRED_FIELDS:
+                    restart_required.append(name)
+                    continue
+                changes[name] = (values[name], value)
+                values[name] = value
+
+            if not changes:
+                return changes, restart_required
+
+            new = BotConfig(**values)
+            object.__setattr__(self, '_snapshot', new)
+
+        logger.info("Конфигурация перезагружена: %s", ", ".join(changes))
+        for callback in self._subscribers:
+            try:
+                callback(new)
+            except Exception as e:
+                logger.error(f"Ошибка применения новой конфигурации: {e}")
+        return changes, restart_required
+
+
 # Создаем глобальный объект конфигурации
 try:
-    config = BotConfig(
-        BOT_TOKEN=os.getenv("BOT_TOKEN", ""),
-        ADMIN_ID=int(os.getenv("ADMIN_ID", 0)),
-        PROVIDER_TOKEN=os.getenv("PROVIDER_TOKEN")
-    )
+    config = ConfigProxy(load_config())
 
     # Проверяем основные параметры
     if not config.BOT_TOKEN:
@@ -79,4 +237,4 @@ try:
 except Exception as e:
     print(f"❌ Ошибка загрузки конфигурации: {e}")
     print("Проверьте файл .env или установите переменные окружения")
-    raise
\ No newline at end of file
+    raise
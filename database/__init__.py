@@ -1,4 +1,5 @@
 # database/__init__.py
 from .database import Database, db
+from .filters import OrderFilter
 
-__all__ = ['Database', 'db']
\ No newline at end of file
+__all__ = ['Database', 'db', 'OrderFilter']
\ No newline at end of file
@@ -1,25 +1,132 @@
 # database.py
 import sqlite3
 import os
-import shutil
+import time
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import logging
-
-from models.enums import OrderStatus, PaymentStatus, DiscountType
+import re
+from collections import OrderedDict
+
+from models.enums import (
+    OrderStatus, PaymentStatus, DiscountType, MessagePriority, MessageLinkKind, UserRole,
+    OPEN_ORDER_STATUSES, WORK_ORDER_STATUSES
+)
+from config import config
+from database.filters import OrderFilter
+from utils.catalog import DEFAULT_SERVICES
+from utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Максимум пользователей в кэше реферальной статистики
+REFERRER_STATS_CACHE_SIZE = 10000
+
+# Токенизатор полнотекстового поиска: регистр и диакритика не учитываются; ё для unicode61 -
+# отдельная буква, поэтому в индекс и запрос текст попадает с заменой ё -> е (см. _search_values)
+SEARCH_TOKENIZER = "unicode61 remove_diacritics 2"
+
+# Окончания, отбрасываемые из слов запроса перед поиском по префиксу (простейший стемминг)
+SEARCH_ENDINGS = (
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иях', 'ах', 'ях', 'ов', 'ев',
+    'ой', 'ей', 'ый', 'ий', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'
+)
+
+# Индексируемые колонки: таблица -> колонки (индекс {table}_fts)
+SEARCH_COLUMNS = {
+    'orders': ('questions', 'username', 'service_type'),
+    'clarifications': ('message_text',),
+}
+
+# Маркеры совпадений в сниппетах (заменяются на разметку при выводе)
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+
+def _search_values(row: str, columns: Tuple[str, ...]) -> str:
+    """
+    Значения колонок для индекса: unicode61 не приравнивает ё к е,
+    поэтому в индекс попадает текст с заменой ё -> е
+    """
+    return ", ".join(f"replace(replace({row}.{column}, 'ё', 'е'), 'Ё', 'Е')" for column in columns)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор с учетом времени запросов в метриках"""
+
+    def execute(self, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            metrics.observe_db(time.perf_counter() - started_at)
+
+    def executemany(self, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            metrics.observe_db(time.perf_counter() - started_at)
+
+    def fetchone(self):
+        started_at = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.observe_db(time.perf_counter() - started_at, call=False)
+
+    def fetchall(self):
+        started_at = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.observe_db(time.perf_counter() - started_at, call=False)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, создающее курсоры с учетом времени"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        started_at = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.observe_db(time.perf_counter() - started_at)
+
 
 class Database:
     def __init__(self, db_name: str = 'orders.db', backup_dir: str = 'backups'):
         self.db_name = db_name
         self.backup_dir = backup_dir
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn = sqlite3.connect(db_name, check_same_thread=False, factory=TimedConnection)
+        # WAL: чтение не блокируется записью, при остановке журнал сбрасывается в основной файл
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # Кэш реферальной статистики: user_id -> сводка (сбрасывается при изменении рефералов)
+        self._referrer_stats_cache: OrderedDict = OrderedDict()
+        self.fts_enabled = False
+        # Повторно доставленные платежи (тот же provider_payment_id), отсеченные process_payment
+        self.duplicate_payments = 0
+        # Подписчики на изменение статуса заказа: callback(order_id, status)
+        self._order_listeners: List[Callable[[int, str], None]] = []
         self.create_tables()
         self.create_backup_dir()
 
+    def subscribe_order_changes(self, listener: Callable[[int, str], None]):
+        """Подписка на изменения статусов заказов (вызывается после фиксации транзакции)"""
+        self._order_listeners.append(listener)
+
+    def _notify_order_change(self, order_id: int, status: str):
+        for listener in self._order_listeners:
+            try:
+                listener(order_id, getattr(status, 'value', status))
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменения заказа #{order_id}: {e}")
+
     def create_backup_dir(self):
         """Создание директории для бэкапов"""
         os.makedirs(self.backup_dir, exist_ok=True)
@@ -29,7 +136,16 @@ class Database:
         try:
             backup_name = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
             backup_path = os.path.join(self.backup_dir, backup_name)
-            shutil.copy2(self.db_name, backup_path)
+
+            # Копия через backup API учитывает данные из WAL-журнала (в отличие от копирования файла).
+            # Отдельное соединение - бэкап может выполняться в другом потоке
+            source = sqlite3.connect(self.db_name)
+            target = sqlite3.connect(backup_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
 
             # Удаляем старые бэкапы
             backups = sorted([f for f in os.listdir(self.backup_dir)
@@ -44,6 +160,15 @@ class Database:
             logger.error(f"Ошибка создания бэкапа: {e}")
             return False
 
+    def close(self):
+        """Закрытие БД: фиксация изменений и перенос WAL-журнала в основной файл"""
+        try:
+            self.conn.commit()
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            self.conn.close()
+        logger.info("Соединение с БД закрыто")
+
     def create_tables(self):
         """Создание таблиц базы данных"""
         cursor = self.conn.cursor()
@@ -196,6 +321,92 @@ class Database:
             )
         ''')
 
+        # Таблица рассылок
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                status TEXT DEFAULT 'draft',
+                created_by INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                last_user_id INTEGER DEFAULT 0,
+                total_recipients INTEGER DEFAULT 0,
+                sent_count INTEGER DEFAULT 0,
+                failed_count INTEGER DEFAULT 0,
+                blocked_count INTEGER DEFAULT 0
+            )
+        ''')
+
+        # Пользователи, заблокировавшие бота
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blocked_users (
+                user_id INTEGER PRIMARY KEY,
+                blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Прайс-лист услуг
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS services (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                category TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                needs_demographics BOOLEAN DEFAULT FALSE,
+                active BOOLEAN DEFAULT TRUE,
+                sort_order INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Операторы, обрабатывающие заказы (кроме ADMIN_ID из конфигурации)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS operators (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                role TEXT DEFAULT 'operator',
+                active BOOLEAN DEFAULT TRUE,
+                added_by INTEGER,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Сообщения бота, привязанные к заказу: ответ (reply) на них адресуется заказу
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_links (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                order_id INTEGER NOT NULL,
+                clarification_id INTEGER,
+                kind TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (chat_id, message_id)
+            ) WITHOUT ROWID
+        ''')
+
+        # Исходящие сообщения, записанные вместе с изменением заказа (outbox)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE NOT NULL,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                priority INTEGER DEFAULT 2,
+                order_id INTEGER,
+                receipt_chat_id INTEGER,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT,
+                message_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                FOREIGN KEY (order_id) REFERENCES orders (id)
+            )
+        ''')
+
         # Индексы для ускорения запросов
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)')
@@ -207,10 +418,39 @@ class Database:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_promo_codes_code ON promo_codes(code)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer_id ON referrals(referrer_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referred_id ON referrals(referred_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_agreements_user_id ON user_agreements(user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at) WHERE status = 'pending'")
+        # Поиск заказа по счету (pre_checkout_query, successful_payment); заказы без счета в индекс не попадают
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_invoice_payload ON orders(invoice_payload) '
+                       'WHERE invoice_payload IS NOT NULL')
+        # Индексы фильтров админки (OrderFilter): каждый неявно заканчивается id - ключом страниц
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_payment_status ON orders(payment_status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_service_type ON orders(service_type)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_rating ON orders(rating) WHERE rating IS NOT NULL')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_promo_code ON orders(promo_code) WHERE promo_code > ''")
 
         self.conn.commit()
         self.add_missing_columns()
+        # Колонки захвата и окна уточнений добавляются миграцией, поэтому индексы создаются после нее
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_claimed_until ON orders(claimed_until) '
+                       'WHERE claimed_by IS NOT NULL')
+        # Только открытые окна уточнений: закрытые свипером окна из индекса выпадают
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_clarify_open ON orders(can_clarify_until_ts) "
+                       "WHERE status = 'completed' AND can_clarify_until_ts IS NOT NULL")
+        self.migrate_clarify_deadlines()
+        # Неоплаченные счета по времени выставления (секунды эпохи): оплаченные и отмененные выпадают
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_invoice_pending ON orders(invoice_created_at) "
+                       "WHERE payment_status = 'pending' AND invoice_created_at IS NOT NULL")
+        self.migrate_invoice_created_at()
+        # Один платеж провайдера - одна строка: повторная доставка successful_payment отсекается индексом
+        self.migrate_duplicate_payments()
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_provider_payment_id '
+                       'ON payments(provider_payment_id) WHERE provider_payment_id IS NOT NULL')
+        self.conn.commit()
         self.initialize_default_templates()
+        self.initialize_default_services()
+        self.create_search_index()
 
     def add_missing_columns(self):
         """Добавляем отсутствующие колонки"""
@@ -233,7 +473,11 @@ class Database:
             ('discount_type', 'TEXT'),
             ('promo_code', 'TEXT'),
             ('referrer_id', 'INTEGER'),
-            ('needs_demographics', 'BOOLEAN DEFAULT TRUE')
+            ('needs_demographics', 'BOOLEAN DEFAULT TRUE'),
+            ('claimed_by', 'INTEGER'),
+            ('claimed_until', 'TIMESTAMP'),
+            ('can_clarify_until_ts', 'INTEGER'),
+            ('invoice_created_at', 'INTEGER')
         ]
 
         for column_name, column_type in required_columns_orders:
@@ -244,6 +488,76 @@ class Database:
                 except Exception as e:
                     logger.error(f"Ошибка добавления колонки {column_name} в orders: {e}")
 
+        # Колонки таблицы payments
+        cursor.execute("PRAGMA table_info(payments)")
+        existing_columns_payments = [column[1] for column in cursor.fetchall()]
+
+        required_columns_payments = [
+            ('duplicate_of', 'INTEGER')
+        ]
+
+        for column_name, column_type in required_columns_payments:
+            if column_name not in existing_columns_payments:
+                try:
+                    cursor.execute(f'ALTER TABLE payments ADD COLUMN {column_name} {column_type}')
+                    logger.info(f"Добавлена колонка {column_name} в таблицу payments")
+                except Exception as e:
+                    logger.error(f"Ошибка добавления колонки {column_name} в payments: {e}")
+
+        self.conn.commit()
+
+    def create_search_index(self):
+        """
+        Полнотекстовый индекс FTS5 по заказам (вопросы, username, услуга)
+        и уточнениям. Индексы хранят только токены (external content)
+        и поддерживаются триггерами. Без FTS5 поиск работает через LIKE.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'orders_fts'")
+        existed = cursor.fetchone() is not None
+
+        try:
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+                    questions, username, service_type,
+                    content='orders', content_rowid='id',
+                    tokenize='{SEARCH_TOKENIZER}', prefix='2 3'
+                )
+            ''')
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS clarifications_fts USING fts5(
+                    message_text,
+                    content='clarifications', content_rowid='id',
+                    tokenize='{SEARCH_TOKENIZER}', prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            self.fts_enabled = False
+            logger.warning(f"FTS5 недоступен, поиск будет работать через LIKE: {e}")
+            return
+
+        # Триггеры срабатывают только на изменение индексируемых колонок
+        for table, columns in SEARCH_COLUMNS.items():
+            names = ", ".join(columns)
+            old_values, new_values = _search_values('old', columns), _search_values('new', columns)
+            cursor.executescript(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {table}_fts(rowid, {names}) VALUES (new.id, {new_values});
+                END;
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {table}_fts({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values});
+                END;
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {names} ON {table} BEGIN
+                    INSERT INTO {table}_fts({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values});
+                    INSERT INTO {table}_fts(rowid, {names}) VALUES (new.id, {new_values});
+                END;
+            ''')
+        self.fts_enabled = True
+
+        if not existed:
+            # Индекс только что создан - заполняем его уже существующими данными
+            self.rebuild_search_index()
+            logger.info("Создан полнотекстовый индекс заказов и уточнений")
         self.conn.commit()
 
     def initialize_default_templates(self):
@@ -324,7 +638,8 @@ class Database:
         self.conn.commit()
 
         order_id = cursor.lastrowid
-        logger.info(f"Создан предоплаченный заказ #{order_id} для @{username} ({service_type} - {price}₽)")
+        logger.info("Создан предоплаченный заказ #%s для @%s (%s - %s₽)", order_id, username, service_type, price)
+        self._notify_order_change(order_id, OrderStatus.PAID)
         return order_id
 
     def update_order_details(self, order_id: int, age: int = None, sex: str = None,
@@ -361,37 +676,205 @@ class Database:
             query = f"UPDATE orders SET {', '.join(updates)} WHERE id = ?"
             cursor.execute(query, params)
             self.conn.commit()
-            logger.info(f"Детали обновлены для заказа #{order_id}")
+            logger.info("Детали обновлены для заказа #%s", order_id, extra={'sampled': True})
 
     def update_order_status(self, order_id: int, status: str,
                             admin_id: int = None, details: str = "") -> bool:
         try:
             cursor = self.conn.cursor()
-
-            if status == OrderStatus.COMPLETED:
-                # Устанавливаем время для уточнений (24 часа)
-                clarify_until = datetime.now() + timedelta(hours=24)  # Исправим позже, когда будет config
-                cursor.execute('''
-                    UPDATE orders 
-                    SET status = ?, answered_at = CURRENT_TIMESTAMP, 
-                        admin_id = ?, updated_at = CURRENT_TIMESTAMP,
-                        can_clarify_until = ?
-                    WHERE id = ?
-                ''', (status, admin_id, clarify_until, order_id))
-            else:
-                cursor.execute('''
-                    UPDATE orders 
-                    SET status = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (status, order_id))
+            self._set_order_status(cursor, order_id, status, admin_id)
 
             self.conn.commit()
-            logger.info(f"Статус заказа #{order_id} изменен на {status}")
+            logger.info("Статус заказа #%s изменен на %s", order_id, status, extra={'sampled': True})
+            self._notify_order_change(order_id, status)
             return True
         except Exception as e:
             logger.error(f"Ошибка обновления статуса заказа #{order_id}: {e}")
             return False
 
+    @staticmethod
+    def _set_order_status(cursor, order_id: int, status: str, admin_id: int = None,
+                          lease_holder: int = None) -> bool:
+        """
+        UPDATE статуса заказа без фиксации транзакции. С lease_holder заказ
+        закрывается, только если он не в работе у другого оператора.
+        Возвращает, изменена ли строка.
+        """
+        if status == OrderStatus.COMPLETED:
+            # Окно уточнений - в секундах эпохи, проверяется прямо в запросе
+            clarify_until = int(time.time() + config.CLARIFICATION_TIME_LIMIT_HOURS * 3600)
+            lease_condition = ""
+            params = [status, admin_id, clarify_until, order_id]
+            if lease_holder is not None:
+                lease_condition = "AND (claimed_by IS NULL OR claimed_by = ? OR claimed_until <= CURRENT_TIMESTAMP)"
+                params.append(lease_holder)
+            cursor.execute(f'''
+                UPDATE orders 
+                SET status = ?, answered_at = CURRENT_TIMESTAMP, 
+                    admin_id = ?, updated_at = CURRENT_TIMESTAMP,
+                    can_clarify_until_ts = ?, claimed_by = NULL, claimed_until = NULL
+                WHERE id = ? {lease_condition}
+            ''', params)
+        elif status not in WORK_ORDER_STATUSES:
+            # Закрытый заказ освобождается от оператора
+            cursor.execute('''
+                UPDATE orders 
+                SET status = ?, updated_at = CURRENT_TIMESTAMP,
+                    claimed_by = NULL, claimed_until = NULL
+                WHERE id = ?
+            ''', (status, order_id))
+        else:
+            cursor.execute('''
+                UPDATE orders 
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, order_id))
+        return cursor.rowcount > 0
+
+    def complete_order_with_answer(self, order_id: int, admin_id: int, answer_text: str,
+                                   chat_id: int, message_text: str, idempotency_key: str,
+                                   receipt_chat_id: int = None,
+                                   override_claim: bool = False) -> Tuple[Optional[int], bool]:
+        """
+        Ответ администратора одной транзакцией: статус "выполнен", запись
+        ответа в уточнениях и сообщение пользователю в outbox.
+        Повтор с тем же idempotency_key ничего не меняет. Заказ, взятый в
+        работу другим оператором (аренда не истекла), не закрывается,
+        если не задан override_claim.
+        Возвращает (id записи outbox, создана ли она сейчас);
+        (None, False) - заказ в работе у другого оператора.
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute('SELECT id FROM outbox WHERE idempotency_key = ?', (idempotency_key,))
+            existing = cursor.fetchone()
+            if existing:
+                return existing[0], False
+
+            if not self._set_order_status(cursor, order_id, OrderStatus.COMPLETED, admin_id,
+                                          lease_holder=None if override_claim else admin_id):
+                self.conn.rollback()
+                return None, False
+            cursor.execute('''
+                INSERT INTO clarifications (order_id, user_id, message_text, is_from_user, sent_at)
+                VALUES (?, ?, ?, FALSE, CURRENT_TIMESTAMP)
+            ''', (order_id, admin_id, answer_text))
+            outbox_id = self._enqueue_outbox(cursor, idempotency_key, chat_id, message_text,
+                                             MessagePriority.ANSWER, order_id, receipt_chat_id)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        logger.info("Ответ на заказ #%s записан в outbox #%s", order_id, outbox_id)
+        self._notify_order_change(order_id, OrderStatus.COMPLETED)
+        return outbox_id, True
+
+    def reopen_undelivered_answer(self, order_id: int) -> bool:
+        """
+        Ответ так и не доставлен: вернуть выполненный заказ в работу
+        ("в обработке"), чтобы он снова попал в очередь операторов
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE orders
+            SET status = ?, answered_at = NULL, can_clarify_until_ts = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = ?
+        ''', (OrderStatus.PROCESSING.value, order_id, OrderStatus.COMPLETED.value))
+        self.conn.commit()
+        if cursor.rowcount == 0:
+            return False
+        logger.warning("Заказ #%s возвращен в работу: ответ не доставлен", order_id)
+        self._notify_order_change(order_id, OrderStatus.PROCESSING)
+        return True
+
+    # ========== OUTBOX ==========
+
+    @staticmethod
+    def _enqueue_outbox(cursor, idempotency_key: str, chat_id: int, text: str,
+                        priority: int, order_id: int = None, receipt_chat_id: int = None) -> int:
+        cursor.execute('''
+            INSERT INTO outbox (idempotency_key, chat_id, text, priority, order_id, receipt_chat_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (idempotency_key, chat_id, text, int(priority), order_id, receipt_chat_id))
+        return cursor.lastrowid
+
+    def get_due_outbox(self, limit: int = 20) -> List[tuple]:
+        """
+        Забрать сообщения outbox, которым пора отправляться, и пометить их
+        'sending': (id, chat_id, text, priority, order_id, receipt_chat_id, attempts)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE outbox SET status = 'sending', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox INDEXED BY idx_outbox_due
+                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY next_attempt_at LIMIT ?
+            )
+            RETURNING id, chat_id, text, priority, order_id, receipt_chat_id, attempts
+        ''', (limit,))
+        rows = [tuple(row) for row in cursor.fetchall()]
+        self.conn.commit()
+        return sorted(rows, key=lambda row: (row[3], row[0]))
+
+    def get_next_outbox_delay(self) -> Optional[float]:
+        """Секунд до ближайшей отложенной отправки (None - outbox пуст)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT (julianday(MIN(next_attempt_at)) - julianday('now')) * 86400
+            FROM outbox INDEXED BY idx_outbox_due WHERE status = 'pending'
+        ''')
+        delay = cursor.fetchone()[0]
+        return max(delay, 0.0) if delay is not None else None
+
+    def mark_outbox_sent(self, outbox_id: int, message_id: int = None):
+        """Сообщение доставлено; ответ пользователя на него будет адресован заказу"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE outbox SET status = 'sent', message_id = ?, sent_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE id = ?
+        ''', (message_id, outbox_id))
+        if message_id is not None:
+            cursor.execute('''
+                INSERT OR REPLACE INTO message_links (chat_id, message_id, order_id, kind)
+                SELECT chat_id, ?, order_id, ? FROM outbox WHERE id = ? AND order_id IS NOT NULL
+            ''', (message_id, MessageLinkKind.ANSWER.value, outbox_id))
+        self.conn.commit()
+
+    def retry_outbox_later(self, outbox_id: int, delay_seconds: float, error: str):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE outbox SET status = 'pending', last_error = ?,
+                next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+        ''', (error[:500], f'+{int(delay_seconds)} seconds', outbox_id))
+        self.conn.commit()
+
+    def mark_outbox_failed(self, outbox_id: int, error: str):
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?",
+                       (error[:500], outbox_id))
+        self.conn.commit()
+
+    def reset_outbox_inflight(self) -> int:
+        """
+        После перезапуска вернуть в очередь сообщения, отправка которых
+        прервалась ('sending'). Доставка - "хотя бы один раз": сообщение,
+        ушедшее прямо перед падением, может прийти повторно.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+        self.conn.commit()
+        return cursor.rowcount
+
+    def get_outbox_stats(self) -> Dict[str, int]:
+        """Количество сообщений outbox по статусам"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+        return dict(cursor.fetchall())
+
     def mark_order_needs_new_docs(self, order_id: int, reason: str, admin_id: int) -> bool:
         """Пометить заказ как нуждающийся в новых документах"""
         try:
@@ -411,7 +894,8 @@ class Database:
             ''', (order_id, admin_id, f"Админ запросил новые документы: {reason}"))
 
             self.conn.commit()
-            logger.info(f"Заказ #{order_id} помечен как нуждающийся в новых документах")
+            logger.info("Заказ #%s помечен как нуждающийся в новых документах", order_id)
+            self._notify_order_change(order_id, OrderStatus.NEEDS_NEW_DOCS)
             return True
         except Exception as e:
             logger.error(f"Ошибка при отметке заказа #{order_id}: {e}")
@@ -421,7 +905,9 @@ class Database:
         """Проверка, может ли пользователь задать уточняющий вопрос"""
         cursor = self.conn.cursor()
         cursor.execute('''
-            SELECT status, can_clarify_until, user_id
+            SELECT status, can_clarify_until_ts, user_id,
+                   status = 'needs_new_docs'
+                   OR (status = 'completed' AND can_clarify_until_ts > CAST(strftime('%s', 'now') AS INTEGER))
             FROM orders 
             WHERE id = ?
         ''', (order_id,))
@@ -430,47 +916,161 @@ class Database:
         if not order:
             return False, "Заказ не найден"
 
-        status, can_clarify_until, order_user_id = order
+        status, can_clarify_until_ts, order_user_id, allowed = order
 
         if order_user_id != user_id:
             return False, "Это не ваш заказ"
 
+        if allowed:
+            return True, ""
+
         if status not in [OrderStatus.COMPLETED, OrderStatus.NEEDS_NEW_DOCS]:
             return False, "Заказ еще не завершен"
 
-        if status == OrderStatus.NEEDS_NEW_DOCS:
-            return True, ""  # Для заказов с нужными документами - всегда можно
-
-        if not can_clarify_until:
+        if not can_clarify_until_ts:
             return False, "Время для уточнений истекло"
 
-        now = datetime.now()
+        time_str = datetime.fromtimestamp(can_clarify_until_ts).strftime('%d.%m.%Y %H:%M')
+        return False, f"Время для уточнений истекло. Вы могли задавать вопросы до {time_str}"
 
-        try:
-            # Пробуем разные форматы даты
-            if isinstance(can_clarify_until, str):
-                # Пробуем с миллисекундами
-                try:
-                    clarify_time = datetime.strptime(can_clarify_until, '%Y-%m-%d %H:%M:%S.%f')
-                except ValueError:
-                    # Пробуем без миллисекунд
-                    try:
-                        clarify_time = datetime.strptime(can_clarify_until, '%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        # Если вообще не парсится, считаем что время истекло
-                        return False, "Ошибка формата времени"
-            else:
-                clarify_time = can_clarify_until
-        except Exception as e:
-            logger.error(f"Ошибка парсинга времени уточнений: {e}")
-            return False, "Ошибка проверки времени"
+    def migrate_clarify_deadlines(self) -> int:
+        """
+        Перенос старых сроков уточнений (текст, локальное время) в секунды эпохи.
+        Старая колонка очищается в том же UPDATE, поэтому перенос выполняется
+        один раз; уже истекшие окна не переносятся (закрытое окно - NULL)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE orders
+            SET can_clarify_until_ts = CASE
+                    WHEN can_clarify_until_ts IS NOT NULL THEN can_clarify_until_ts
+                    WHEN CAST(strftime('%s', can_clarify_until, 'utc') AS INTEGER) > CAST(strftime('%s', 'now') AS INTEGER)
+                        THEN CAST(strftime('%s', can_clarify_until, 'utc') AS INTEGER)
+                END,
+                can_clarify_until = NULL
+            WHERE can_clarify_until IS NOT NULL
+        ''')
+        if cursor.rowcount:
+            logger.info("Сроки уточнений переведены в секунды эпохи: %s заказов", cursor.rowcount)
+        return cursor.rowcount
 
-        if now > clarify_time:
-            # Форматируем время для пользователя
-            time_str = clarify_time.strftime('%d.%m.%Y %H:%M')
-            return False, f"Время для уточнений истекло. Вы могли задавать вопросы до {time_str}"
+    def migrate_invoice_created_at(self) -> int:
+        """Срок выставления для счетов, созданных до появления invoice_created_at (по updated_at)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE orders
+            SET invoice_created_at = CAST(strftime('%s', updated_at) AS INTEGER)
+            WHERE invoice_payload IS NOT NULL AND invoice_created_at IS NULL
+              AND payment_status = 'pending' AND strftime('%s', updated_at) IS NOT NULL
+        ''')
+        if cursor.rowcount:
+            logger.info("Время выставления счета заполнено для %s заказов", cursor.rowcount)
+        return cursor.rowcount
+
+    def expire_stale_invoices(self, timeout_seconds: int, batch_size: int = 500,
+                              now: int = None) -> List[Tuple[int, int]]:
+        """
+        Отменить одной транзакцией пачку заказов, не оплаченных за timeout_seconds
+        после выставления счета, и вернуть их промокоды и реферальные скидки.
+        Строки выбираются по частичному индексу неоплаченных счетов и из него
+        выпадают. invoice_payload сохраняется: платеж, успевший пройти до
+        отмены, найдет свой заказ и будет записан к возврату (см.
+        process_payment). Возвращает [(order_id, user_id)].
+        """
+        cursor = self.conn.cursor()
+        deadline = int(now if now is not None else time.time()) - timeout_seconds
+        try:
+            cursor.execute('''
+                UPDATE orders
+                SET status = 'cancelled', payment_status = 'cancelled',
+                    invoice_created_at = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM orders INDEXED BY idx_orders_invoice_pending
+                    WHERE payment_status = 'pending' AND invoice_created_at IS NOT NULL
+                      AND invoice_created_at <= ?
+                    LIMIT ?
+                )
+                RETURNING id, user_id
+            ''', (deadline, batch_size))
+            expired = cursor.fetchall()
+            if expired:
+                order_ids = [order_id for order_id, _ in expired]
+                placeholders = ', '.join('?' * len(order_ids))
+
+                # Использование промокода снимается, ограниченный промокод получает попытку обратно
+                cursor.execute(f'''
+                    DELETE FROM used_promo_codes WHERE order_id IN ({placeholders})
+                    RETURNING promo_code
+                ''', order_ids)
+                for (promo_code,) in cursor.fetchall():
+                    cursor.execute('''
+                        UPDATE promo_codes SET uses_left = uses_left + 1
+                        WHERE code = ? AND uses_left >= 0
+                    ''', (promo_code,))
+
+                # Реферальная скидка остается за приглашенным до следующего заказа
+                cursor.execute(f'''
+                    UPDATE referrals SET order_id = NULL, referred_discount = 0
+                    WHERE status = 'pending' AND order_id IN ({placeholders})
+                ''', order_ids)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        for order_id, _ in expired:
+            self._notify_order_change(order_id, OrderStatus.CANCELLED)
+        return expired
+
+    def migrate_duplicate_payments(self) -> int:
+        """
+        Разовая миграция перед созданием уникального индекса платежей:
+        повторные записи одного платежа провайдера не удаляются, а
+        помечаются - status 'duplicate', duplicate_of = id первой записи,
+        provider_payment_id переносится только в первую. Когда индекс уже
+        есть, повторов в таблице быть не может и миграция не выполняется.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_payments_provider_payment_id'")
+        if cursor.fetchone() is not None:
+            return 0
 
-        return True, ""
+        cursor.execute('''
+            UPDATE payments
+            SET duplicate_of = (
+                    SELECT MIN(original.id) FROM payments AS original
+                    WHERE original.provider_payment_id = payments.provider_payment_id
+                ),
+                status = ?, provider_payment_id = NULL
+            WHERE provider_payment_id IS NOT NULL
+              AND id NOT IN (
+                  SELECT MIN(id) FROM payments
+                  WHERE provider_payment_id IS NOT NULL
+                  GROUP BY provider_payment_id
+              )
+        ''', (PaymentStatus.DUPLICATE.value,))
+        if cursor.rowcount:
+            logger.warning("Помечены повторные записи платежей (status = 'duplicate'): %s", cursor.rowcount)
+        return cursor.rowcount
+
+    def close_expired_clarify_windows(self, batch_size: int = 500, now: int = None) -> int:
+        """
+        Закрыть истекшие окна уточнений одной пачкой (не больше batch_size).
+        Строки выбираются по частичному индексу открытых окон, после
+        закрытия они из него выпадают. Возвращает число закрытых окон.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE orders SET can_clarify_until_ts = NULL, can_clarify_until = NULL
+            WHERE id IN (
+                SELECT id FROM orders INDEXED BY idx_orders_clarify_open
+                WHERE status = 'completed' AND can_clarify_until_ts IS NOT NULL
+                  AND can_clarify_until_ts <= ?
+                LIMIT ?
+            )
+        ''', (int(now if now is not None else time.time()), batch_size))
+        self.conn.commit()
+        return cursor.rowcount
 
     def add_clarification(self, order_id: int, user_id: int, message_text: str,
                           message_type: str = "text", file_id: str = None,
@@ -501,56 +1101,147 @@ class Database:
         clarification_id = cursor.lastrowid
         self.conn.commit()
 
+        if is_from_user and not is_admin_request:
+            self._notify_order_change(order_id, OrderStatus.AWAITING_CLARIFICATION)
+
         action = "вопрос" if is_from_user else "ответ"
-        logger.info(f"Добавлено уточнение #{clarification_id} ({action}) для заказа #{order_id}")
+        logger.info("Добавлено уточнение #%s (%s) для заказа #%s", clarification_id, action, order_id,
+                    extra={'sampled': True})
         return clarification_id
 
     def get_clarifications(self, order_id: int, limit: int = 50) -> List[tuple]:
         """Получение истории уточнений для заказа"""
+        return self.get_clarifications_since(order_id, 0, limit)
+
+    def get_clarifications_since(self, order_id: int, after_id: int = 0, limit: int = 50) -> List[tuple]:
+        """
+        Уточнения заказа после уже показанного after_id. id растет в порядке
+        добавления, а индекс по order_id неявно заканчивается id, поэтому
+        выборка идет диапазоном по индексу без сортировки.
+        """
         cursor = self.conn.cursor()
         cursor.execute('''
-            SELECT * FROM clarifications 
-            WHERE order_id = ? 
-            ORDER BY sent_at ASC
+            SELECT * FROM clarifications INDEXED BY idx_clarifications_order_id
+            WHERE order_id = ? AND id > ?
+            ORDER BY id ASC
             LIMIT ?
-        ''', (order_id, limit))
+        ''', (order_id, after_id, limit))
         return cursor.fetchall()
 
+    def get_last_clarification_id(self, order_id: int) -> int:
+        """id последнего уточнения заказа (0 - уточнений нет)"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT MAX(id) FROM clarifications WHERE order_id = ?', (order_id,))
+        return cursor.fetchone()[0] or 0
+
+    # ========== СВЯЗИ СООБЩЕНИЙ С ЗАКАЗАМИ ==========
+
+    def link_message(self, chat_id: int, message_id: int, order_id: int, kind: str,
+                     clarification_id: int = None):
+        """Запомнить, к какому заказу относится отправленное ботом сообщение"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO message_links (chat_id, message_id, order_id, clarification_id, kind)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (chat_id, message_id, order_id, clarification_id, getattr(kind, 'value', kind)))
+        self.conn.commit()
+
+    def resolve_message_link(self, chat_id: int, message_id: int) -> Optional[Tuple[int, Optional[int], str]]:
+        """Заказ по сообщению бота (поиск по первичному ключу): (order_id, clarification_id, kind)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT order_id, clarification_id, kind FROM message_links
+            WHERE chat_id = ? AND message_id = ?
+        ''', (chat_id, message_id))
+        return cursor.fetchone()
+
+    def prune_message_links(self, days: int = 90) -> int:
+        """Удалить связи старше days дней (ответить на такие сообщения уже нельзя по сроку)"""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM message_links WHERE created_at < datetime('now', ?)", (f'-{int(days)} days',))
+        self.conn.commit()
+        return cursor.rowcount
+
     def set_invoice_payload(self, order_id: int, invoice_payload: str) -> bool:
         try:
             cursor = self.conn.cursor()
             cursor.execute('''
                 UPDATE orders 
-                SET invoice_payload = ?, updated_at = CURRENT_TIMESTAMP
+                SET invoice_payload = ?, invoice_created_at = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
-            ''', (invoice_payload, order_id))
+            ''', (invoice_payload, int(time.time()), order_id))
             self.conn.commit()
             return True
         except Exception as e:
             logger.error(f"Ошибка установки invoice_payload для заказа #{order_id}: {e}")
             return False
 
+    def get_invoice_order(self, invoice_payload: str) -> Optional[Tuple[int, int, int, str, str]]:
+        """Заказ по счету: (id, user_id, price, status, payment_status) или None"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, user_id, price, status, payment_status
+            FROM orders INDEXED BY idx_orders_invoice_payload
+            WHERE invoice_payload = ?
+        ''', (invoice_payload,))
+        return cursor.fetchone()
+
     def process_payment(self, invoice_payload: str, provider_payment_id: str,
-                        amount: int) -> Tuple[bool, Optional[int]]:
+                        amount: int) -> Tuple[bool, Optional[int], bool]:
+        """
+        Зачисление платежа: (успех, order_id, повтор).
+
+        Первой выполняется вставка в payments: уникальный индекс по
+        provider_payment_id отсекает повторную доставку того же платежа
+        (например, successful_payment после перезапуска), и тогда заказ
+        и реферальный бонус не трогаются - возвращается повтор=True.
+        Платеж за отмененный заказ (счет просрочен, промокод и реферальная
+        скидка уже возвращены) заказ не восстанавливает: он записывается
+        со статусом refund_required, возвращается (False, order_id, False).
+        """
         try:
             cursor = self.conn.cursor()
 
             # Находим заказ по invoice_payload
-            cursor.execute('SELECT id, user_id, price FROM orders WHERE invoice_payload = ?',
-                           (invoice_payload,))
+            cursor.execute('''
+                SELECT id, user_id, price, referrer_id, status
+                FROM orders INDEXED BY idx_orders_invoice_payload
+                WHERE invoice_payload = ?
+            ''', (invoice_payload,))
             order = cursor.fetchone()
 
             if not order:
                 logger.error(f"Заказ с invoice_payload {invoice_payload} не найден")
-                return False, None
+                return False, None, False
 
-            order_id, user_id, expected_price = order
+            order_id, user_id, expected_price, referrer_id, status = order
+            cancelled = status == OrderStatus.CANCELLED.value
+
+            # Записываем платеж; повтор того же provider_payment_id игнорируется индексом
+            cursor.execute('''
+                INSERT OR IGNORE INTO payments (order_id, amount, status, provider_payment_id,
+                                                invoice_payload, payment_date)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (order_id, amount, PaymentStatus.REFUND_REQUIRED if cancelled else PaymentStatus.SUCCESS,
+                  provider_payment_id, invoice_payload))
+            if cursor.rowcount == 0:
+                self.conn.commit()
+                self.duplicate_payments += 1
+                logger.warning("Повторная доставка платежа %s для заказа #%s проигнорирована",
+                               provider_payment_id, order_id)
+                return True, order_id, True
+
+            if cancelled:
+                self.conn.commit()
+                logger.error("Оплачен отмененный заказ #%s (платеж %s): требуется возврат",
+                             order_id, provider_payment_id)
+                return False, order_id, False
 
             # Проверяем сумму (делим на 100, так как в копейках)
             expected_amount = expected_price * 100
             if abs(amount - expected_amount) > 1:  # Допускаем небольшую погрешность
-                logger.warning(f"Несоответствие суммы для заказа #{order_id}: "
-                               f"ожидалось {expected_amount}, получено {amount}")
+                logger.warning("Несоответствие суммы для заказа #%s: ожидалось %s, получено %s",
+                               order_id, expected_amount, amount)
 
             # Обновляем статус заказа
             cursor.execute('''
@@ -559,23 +1250,17 @@ class Database:
                 WHERE id = ?
             ''', (order_id,))
 
-            # Записываем платеж
-            cursor.execute('''
-                INSERT INTO payments (order_id, amount, status, provider_payment_id, 
-                                    invoice_payload, payment_date)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (order_id, amount, PaymentStatus.SUCCESS,
-                  provider_payment_id, invoice_payload))
-
             # Если есть реферер, начисляем бонус
-            cursor.execute('SELECT referrer_id FROM orders WHERE id = ?', (order_id,))
-            referrer_result = cursor.fetchone()
-            if referrer_result and referrer_result[0]:
-                referrer_id = referrer_result[0]
+            referral_row = None
+            if referrer_id:
                 # Временно используем 10% (исправим позже с config)
                 bonus_amount = (amount / 100) * 0.1
 
                 # Обновляем реферальную запись
+                cursor.execute('''
+                    SELECT referrer_id FROM referrals WHERE referred_id = ? AND status = 'pending'
+                ''', (user_id,))
+                referral_row = cursor.fetchone()
                 cursor.execute('''
                     UPDATE referrals 
                     SET order_id = ?, referrer_bonus = ?, status = 'completed',
@@ -583,17 +1268,21 @@ class Database:
                     WHERE referred_id = ? AND status = 'pending'
                 ''', (order_id, bonus_amount, user_id))
 
-                logger.info(f"Начислен бонус {bonus_amount}₽ рефереру {referrer_id} за заказ #{order_id}")
+                logger.info("Начислен бонус %s₽ рефереру %s за заказ #%s", bonus_amount, referrer_id, order_id)
 
             self.conn.commit()
 
-            logger.info(f"Платеж для заказа #{order_id} обработан успешно")
-            return True, order_id
+            if referrer_id:
+                self.invalidate_referrer_stats(referrer_id, referral_row[0] if referral_row else None)
+
+            logger.info("Платеж для заказа #%s обработан успешно", order_id)
+            self._notify_order_change(order_id, OrderStatus.PAID)
+            return True, order_id, False
 
         except Exception as e:
             logger.error(f"Ошибка обработки платежа: {e}")
             self.conn.rollback()
-            return False, None
+            return False, None, False
 
     def get_order_by_id(self, order_id: int) -> Optional[tuple]:
         cursor = self.conn.cursor()
@@ -622,15 +1311,346 @@ class Database:
 
     def get_pending_orders(self, limit: int = 20) -> List[tuple]:
         """Получение ожидающих заказов (для админа)"""
+        return self.find_orders(OrderFilter().status(*OPEN_ORDER_STATUSES).oldest_first(), limit=limit)
+
+    def get_sla_orders(self, statuses: Tuple[str, ...]) -> List[tuple]:
+        """
+        Открытые заказы для очереди SLA:
+        (id, status, created_at, last_clarification_at, updated_at, claimed_by).
+        claimed_by заполнен, только пока аренда оператора не истекла.
+        """
+        statuses = tuple(getattr(status, 'value', status) for status in statuses)
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT id, status, created_at, last_clarification_at, updated_at,
+                   CASE WHEN claimed_until > CURRENT_TIMESTAMP THEN claimed_by END
+            FROM orders INDEXED BY idx_orders_status
+            WHERE status IN ({', '.join('?' * len(statuses))})
+        ''', statuses)
+        return cursor.fetchall()
+
+    def get_sla_order(self, order_id: int) -> Optional[tuple]:
+        """Один заказ в формате get_sla_orders"""
         cursor = self.conn.cursor()
         cursor.execute('''
-            SELECT * FROM orders 
-            WHERE status IN ('pending', 'processing', 'awaiting_clarification', 'needs_new_docs')
-            ORDER BY created_at ASC 
-            LIMIT ?
-        ''', (limit,))
+            SELECT id, status, created_at, last_clarification_at, updated_at,
+                   CASE WHEN claimed_until > CURRENT_TIMESTAMP THEN claimed_by END
+            FROM orders WHERE id = ?
+        ''', (order_id,))
+        return cursor.fetchone()
+
+    def get_order_operators(self, order_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """(оператор, держащий заказ сейчас, или None; ответивший администратор)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT CASE WHEN claimed_until > CURRENT_TIMESTAMP THEN claimed_by END, admin_id
+            FROM orders WHERE id = ?
+        ''', (order_id,))
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    # ========== ОПЕРАТОРЫ ==========
+
+    def add_operator(self, user_id: int, username: str = None,
+                     role: str = UserRole.OPERATOR, added_by: int = None) -> bool:
+        """Добавить оператора (или вернуть отключенного)"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT INTO operators (user_id, username, role, active, added_by)
+                VALUES (?, ?, ?, TRUE, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, username),
+                    role = excluded.role, active = TRUE
+            ''', (user_id, username, getattr(role, 'value', role), added_by))
+            self.conn.commit()
+            logger.info("Оператор %s добавлен (%s)", user_id, getattr(role, 'value', role))
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка добавления оператора {user_id}: {e}")
+            return False
+
+    def set_operator_active(self, user_id: int, active: bool) -> bool:
+        """Включить/отключить оператора"""
+        cursor = self.conn.cursor()
+        cursor.execute('UPDATE operators SET active = ? WHERE user_id = ?', (active, user_id))
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def release_operator_claims(self, operator_id: int) -> List[Tuple[int, str]]:
+        """Снять с оператора все его заказы: [(id, status)]"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE orders SET claimed_by = NULL, claimed_until = NULL
+            WHERE id IN (
+                SELECT id FROM orders INDEXED BY idx_orders_claimed_until WHERE claimed_by = ?
+            )
+            RETURNING id, status
+        ''', (operator_id,))
+        rows = [tuple(row) for row in cursor.fetchall()]
+        self.conn.commit()
+        return rows
+
+    def get_operators(self, active_only: bool = True) -> List[tuple]:
+        """Операторы: (user_id, username, role, active, added_at)"""
+        cursor = self.conn.cursor()
+        where = "WHERE active = TRUE" if active_only else ""
+        cursor.execute(f'SELECT user_id, username, role, active, added_at FROM operators {where} ORDER BY added_at')
         return cursor.fetchall()
 
+    def claim_order(self, order_id: int, operator_id: int, lease_seconds: int) -> bool:
+        """
+        Взять конкретный заказ в работу. Одно условное UPDATE: заказ
+        достается оператору, только если он свободен, аренда истекла
+        или он уже его (тогда аренда продлевается).
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            UPDATE orders
+            SET claimed_by = ?, claimed_until = datetime('now', ?)
+            WHERE id = ?
+              AND status IN ({', '.join('?' * len(WORK_ORDER_STATUSES))})
+              AND (claimed_by IS NULL OR claimed_by = ? OR claimed_until <= CURRENT_TIMESTAMP)
+        ''', (operator_id, f'+{int(lease_seconds)} seconds', order_id, *WORK_ORDER_STATUSES, operator_id))
+        self.conn.commit()
+        return cursor.rowcount == 1
+
+    def claim_next_order(self, operator_id: int, lease_seconds: int) -> Optional[Tuple[int, str]]:
+        """
+        Взять следующий свободный заказ одним UPDATE ... RETURNING:
+        сначала вопросы по заказам, затем самые старые. Возвращает (id, status).
+        """
+        placeholders = ', '.join('?' * len(WORK_ORDER_STATUSES))
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            UPDATE orders
+            SET claimed_by = ?, claimed_until = datetime('now', ?)
+            WHERE id = (
+                SELECT id FROM orders INDEXED BY idx_orders_status
+                WHERE status IN ({placeholders})
+                  AND (claimed_by IS NULL OR claimed_until <= CURRENT_TIMESTAMP)
+                ORDER BY status = 'awaiting_clarification' DESC, created_at, id
+                LIMIT 1
+            )
+              AND (claimed_by IS NULL OR claimed_until <= CURRENT_TIMESTAMP)
+            RETURNING id, status
+        ''', (operator_id, f'+{int(lease_seconds)} seconds', *WORK_ORDER_STATUSES))
+        row = cursor.fetchone()
+        self.conn.commit()
+        return tuple(row) if row else None
+
+    def release_order_claim(self, order_id: int, operator_id: int = None) -> Optional[str]:
+        """Снять заказ с оператора (любого, если operator_id не указан). Возвращает статус заказа"""
+        cursor = self.conn.cursor()
+        if operator_id is None:
+            cursor.execute('''
+                UPDATE orders SET claimed_by = NULL, claimed_until = NULL
+                WHERE id = ? AND claimed_by IS NOT NULL
+                RETURNING status
+            ''', (order_id,))
+        else:
+            cursor.execute('''
+                UPDATE orders SET claimed_by = NULL, claimed_until = NULL
+                WHERE id = ? AND claimed_by = ?
+                RETURNING status
+            ''', (order_id, operator_id))
+        row = cursor.fetchone()
+        self.conn.commit()
+        return row[0] if row else None
+
+    def release_expired_claims(self) -> List[Tuple[int, str]]:
+        """Вернуть в очередь заказы с истекшей арендой: [(id, status)]"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE orders SET claimed_by = NULL, claimed_until = NULL
+            WHERE id IN (
+                SELECT id FROM orders INDEXED BY idx_orders_claimed_until
+                WHERE claimed_by IS NOT NULL AND claimed_until <= CURRENT_TIMESTAMP
+            )
+            RETURNING id, status
+        ''')
+        rows = [tuple(row) for row in cursor.fetchall()]
+        self.conn.commit()
+        return rows
+
+    def get_operator_stats(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Производительность операторов за период: выполнено, среднее время ответа, в работе сейчас"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT admin_id, COUNT(*),
+                   AVG((julianday(answered_at) - julianday(created_at)) * 24),
+                   SUM(CASE WHEN answered_at >= datetime('now', '-1 day') THEN 1 ELSE 0 END)
+            FROM orders INDEXED BY idx_orders_status
+            WHERE status = 'completed' AND admin_id IS NOT NULL
+              AND answered_at >= datetime('now', ?)
+            GROUP BY admin_id
+        ''', (f'-{int(days)} days',))
+        completed = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        cursor.execute('''
+            SELECT claimed_by, COUNT(*) FROM orders INDEXED BY idx_orders_claimed_until
+            WHERE claimed_by IS NOT NULL AND claimed_until > CURRENT_TIMESTAMP
+            GROUP BY claimed_by
+        ''')
+        claimed = dict(cursor.fetchall())
+
+        stats = []
+        for operator_id in set(completed) | set(claimed):
+            done, avg_hours, last_day = completed.get(operator_id, (0, None, 0))
+            stats.append({
+                'operator_id': operator_id,
+                'completed': done,
+                'completed_last_day': last_day or 0,
+                'avg_answer_hours': avg_hours,
+                'claimed': claimed.get(operator_id, 0),
+            })
+        stats.sort(key=lambda item: item['completed'], reverse=True)
+        return stats
+
+    def find_orders(self, order_filter: OrderFilter, after_id: int = None, limit: int = 20) -> List[tuple]:
+        """Страница заказов по фильтру (after_id - id последнего заказа предыдущей страницы)"""
+        sql, params = order_filter.build(after_id, limit)
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def count_orders(self, order_filter: OrderFilter) -> int:
+        """Количество заказов по фильтру"""
+        conditions, params = order_filter.where()
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM orders {where}', params)
+        return cursor.fetchone()[0]
+
+    def check_filter_plans(self) -> List[str]:
+        """
+        Проверка, что каждое сочетание условий OrderFilter выполняется
+        через свой индекс. Возвращает описания фильтров, для которых это не так.
+        """
+        unindexed = []
+        cursor = self.conn.cursor()
+        for order_filter in OrderFilter.all_combinations():
+            index = order_filter.driving_index
+            if index is None:
+                continue  # без условий - просмотр по первичному ключу до LIMIT
+            sql, params = order_filter.build(after_id=1000, limit=20)
+            try:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                details = [row[-1] for row in cursor.fetchall()]
+            except sqlite3.OperationalError as e:
+                # INDEXED BY с неподходящим индексом - ошибка "no query solution"
+                details = [str(e)]
+            if not any(f"INDEX {index}" in detail for detail in details):
+                unindexed.append(f"{order_filter.describe()}: {'; '.join(details)}")
+
+        for description in unindexed:
+            logger.warning(f"Фильтр заказов без индекса: {description}")
+        return unindexed
+
+    @staticmethod
+    def build_search_query(text: str) -> Optional[str]:
+        """
+        Запрос FTS5 из пользовательского текста: каждое слово ищется
+        по префиксу, у длинных слов отбрасывается окончание
+        ("ферритином" -> "ферритин*"). Все слова должны встретиться.
+        """
+        terms = []
+        for word in re.findall(r'\w+', text.lower().replace('ё', 'е')):
+            for ending in SEARCH_ENDINGS:
+                if word.endswith(ending) and len(word) - len(ending) >= 4:
+                    word = word[:-len(ending)]
+                    break
+            terms.append(f'"{word}"*')
+        return " ".join(terms) if terms else None
+
+    def search_orders(self, text: str, limit: int = 10, offset: int = 0) -> Tuple[int, List[tuple]]:
+        """
+        Поиск заказов по вопросам, username, услуге и тексту уточнений.
+        Возвращает (всего найдено, страница), строки страницы:
+        (id, user_id, username, service_type, status, created_at, сниппет).
+        Результаты упорядочены по релевантности (bm25).
+        """
+        if not self.fts_enabled:
+            return self._search_orders_like(text, limit, offset)
+
+        query = self.build_search_query(text)
+        if not query:
+            return 0, []
+
+        hits = f'''
+            SELECT rowid AS order_id, bm25(orders_fts, 1.0, 2.0, 0.5) AS score,
+                   snippet(orders_fts, -1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 12) AS snippet
+            FROM orders_fts WHERE orders_fts MATCH ?
+            UNION ALL
+            SELECT c.order_id, bm25(clarifications_fts),
+                   snippet(clarifications_fts, 0, '{SNIPPET_START}', '{SNIPPET_END}', '…', 12)
+            FROM clarifications_fts
+            JOIN clarifications c ON c.id = clarifications_fts.rowid
+            WHERE clarifications_fts MATCH ?
+        '''
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f'SELECT COUNT(DISTINCT order_id) FROM ({hits})', (query, query))
+            total = cursor.fetchone()[0]
+            # snippet берется из строки с лучшей (минимальной) оценкой bm25
+            cursor.execute(f'''
+                SELECT o.id, o.user_id, o.username, o.service_type, o.status, o.created_at,
+                       h.snippet, MIN(h.score) AS best
+                FROM ({hits}) h
+                JOIN orders o ON o.id = h.order_id
+                GROUP BY o.id
+                ORDER BY best, o.id DESC
+                LIMIT ? OFFSET ?
+            ''', (query, query, limit, offset))
+            return total, [row[:7] for row in cursor.fetchall()]
+        except sqlite3.OperationalError as e:
+            logger.error(f"Ошибка полнотекстового поиска '{text}': {e}")
+            return 0, []
+
+    def _search_orders_like(self, text: str, limit: int, offset: int) -> Tuple[int, List[tuple]]:
+        """Поиск без FTS5: подстрока в полях заказа или уточнениях (полный просмотр таблиц)"""
+        pattern = f"%{text.strip()}%"
+        where = '''
+            FROM orders o
+            WHERE o.questions LIKE :p OR o.username LIKE :p OR o.service_type LIKE :p
+               OR o.id IN (SELECT order_id FROM clarifications WHERE message_text LIKE :p)
+        '''
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT COUNT(*) {where}', {'p': pattern})
+        total = cursor.fetchone()[0]
+        cursor.execute(f'''
+            SELECT o.id, o.user_id, o.username, o.service_type, o.status, o.created_at,
+                   substr(COALESCE(o.questions, ''), 1, 100)
+            {where}
+            ORDER BY o.id DESC
+            LIMIT :limit OFFSET :offset
+        ''', {'p': pattern, 'limit': limit, 'offset': offset})
+        return total, cursor.fetchall()
+
+    def rebuild_search_index(self) -> Dict[str, int]:
+        """
+        Перестроить полнотекстовый индекс одной транзакцией: очистка и
+        заполнение не разделяются, поэтому триггеры других записей не
+        попадают на наполовину собранный индекс. Встроенный 'rebuild'
+        FTS5 не подходит - в индекс пишется текст с заменой ё -> е.
+        Возвращает число проиндексированных строк по таблицам.
+        """
+        cursor = self.conn.cursor()
+        counts = {}
+        try:
+            for table, columns in SEARCH_COLUMNS.items():
+                cursor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('delete-all')")
+                cursor.execute(f'''
+                    INSERT INTO {table}_fts(rowid, {", ".join(columns)})
+                    SELECT id, {_search_values(table, columns)} FROM {table}
+                ''')
+                counts[table] = cursor.rowcount
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return counts
+
     def save_rating(self, order_id: int, rating: int) -> bool:
         """Сохранение оценки заказа"""
         try:
@@ -650,7 +1670,7 @@ class Database:
             ''', (rating, order_id))
 
             self.conn.commit()
-            logger.info(f"Оценка {rating} сохранена для заказа #{order_id}")
+            logger.info("Оценка %s сохранена для заказа #%s", rating, order_id)
             return True
         except Exception as e:
             logger.error(f"Ошибка сохранения оценки для заказа #{order_id}: {e}")
@@ -733,7 +1753,7 @@ class Database:
 
         self.conn.commit()
 
-        logger.info(f"Промокод {code} применен к заказу #{order_id}, скидка: {discount_amount}₽")
+        logger.info("Промокод %s применен к заказу #%s, скидка: %s₽", code, order_id, discount_amount)
         return discount_amount, int(final_price), ""
 
     def get_all_promo_codes(self) -> List[tuple]:
@@ -772,7 +1792,8 @@ class Database:
             self.conn.commit()
 
             if cursor.rowcount > 0:
-                logger.info(f"Создана реферальная связь: {referrer_id} → {referred_id}")
+                self.invalidate_referrer_stats(referrer_id)
+                logger.info("Создана реферальная связь: %s → %s", referrer_id, referred_id)
                 return True
             return False
         except Exception as e:
@@ -780,50 +1801,28 @@ class Database:
             return False
 
     def get_referrer_stats(self, user_id: int) -> Dict[str, Any]:
-        """Статистика по рефералам пользователя"""
+        """Статистика по рефералам пользователя (из кэша, если есть)"""
+        stats = self._referrer_stats_cache.get(user_id)
+        if stats is not None:
+            self._referrer_stats_cache.move_to_end(user_id)
+            return dict(stats)
+
         try:
             cursor = self.conn.cursor()
-
-            # Проверяем существование таблицы referrals
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='referrals'")
-            if not cursor.fetchone():
-                # Таблица не существует
-                return {
-                    'total_referred': 0,
-                    'completed_referred': 0,
-                    'total_bonus': 0.0
-                }
-
-            # Количество приглашенных
             cursor.execute('''
-                SELECT COUNT(*) FROM referrals 
+                SELECT COUNT(*),
+                       COALESCE(SUM(status = 'completed'), 0),
+                       COALESCE(SUM(CASE WHEN status = 'completed' THEN referrer_bonus END), 0)
+                FROM referrals
                 WHERE referrer_id = ?
             ''', (user_id,))
-            result = cursor.fetchone()
-            total_referred = result[0] if result else 0
+            total_referred, completed_referred, total_bonus = cursor.fetchone()
 
-            # Количество завершенных заказов
-            cursor.execute('''
-                SELECT COUNT(*) FROM referrals 
-                WHERE referrer_id = ? AND status = 'completed'
-            ''', (user_id,))
-            result = cursor.fetchone()
-            completed_referred = result[0] if result else 0
-
-            # Общая сумма бонусов
-            cursor.execute('''
-                SELECT COALESCE(SUM(referrer_bonus), 0) FROM referrals 
-                WHERE referrer_id = ? AND status = 'completed'
-            ''', (user_id,))
-            result = cursor.fetchone()
-            total_bonus = float(result[0]) if result and result[0] else 0.0
-
-            return {
+            stats = {
                 'total_referred': total_referred,
                 'completed_referred': completed_referred,
-                'total_bonus': total_bonus
+                'total_bonus': float(total_bonus or 0)
             }
-
         except Exception as e:
             logger.error(f"Ошибка в get_referrer_stats: {e}")
             return {
@@ -832,6 +1831,16 @@ class Database:
                 'total_bonus': 0.0
             }
 
+        self._referrer_stats_cache[user_id] = stats
+        if len(self._referrer_stats_cache) > REFERRER_STATS_CACHE_SIZE:
+            self._referrer_stats_cache.popitem(last=False)
+        return dict(stats)
+
+    def invalidate_referrer_stats(self, *user_ids: Optional[int]):
+        """Сброс кэша реферальной статистики"""
+        for user_id in user_ids:
+            self._referrer_stats_cache.pop(user_id, None)
+
     def check_referral_discount(self, user_id: int) -> Tuple[bool, float]:
         """Проверка, имеет ли пользователь право на реферальную скидку"""
         cursor = self.conn.cursor()
@@ -877,7 +1886,7 @@ class Database:
 
         self.conn.commit()
 
-        logger.info(f"Реферальная скидка {discount_amount}₽ применена для пользователя {user_id}")
+        logger.info("Реферальная скидка %s₽ применена для пользователя %s", discount_amount, user_id)
         return discount_amount, int(final_price), referrer_id
 
     def get_all_referrals_stats(self) -> Dict[str, Any]:
@@ -915,6 +1924,18 @@ class Database:
             'top_referrers': top_referrers
         }
 
+    def initialize_default_services(self):
+        """Заполнение прайс-листа услугами по умолчанию (существующие цены не меняются)"""
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT OR IGNORE INTO services (name, price, needs_demographics, category, sort_order)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(name, price, needs_demographics, category, sort_order)
+              for sort_order, (name, price, needs_demographics, category) in enumerate(DEFAULT_SERVICES)])
+        self.conn.commit()
+        if cursor.rowcount > 0:
+            logger.info(f"Добавлено услуг в прайс-лист: {cursor.rowcount}")
+
     def get_quick_templates(self) -> List[tuple]:
         """Получение всех шаблонов"""
         cursor = self.conn.cursor()
@@ -985,6 +2006,185 @@ class Database:
             logger.error(f"Ошибка удаления шаблона: {e}")
             return False
 
+    def get_services(self, active_only: bool = False) -> List[tuple]:
+        """Прайс-лист: (id, name, category, price, needs_demographics, active, sort_order)"""
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT id, name, category, price, needs_demographics, active, sort_order
+            FROM services
+            {'WHERE active = 1' if active_only else ''}
+            ORDER BY sort_order, id
+        ''')
+        return cursor.fetchall()
+
+    def get_service(self, service_id: int) -> Optional[tuple]:
+        """Услуга по ID"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, name, category, price, needs_demographics, active, sort_order
+            FROM services WHERE id = ?
+        ''', (service_id,))
+        return cursor.fetchone()
+
+    def update_service_price(self, service_id: int, price: int) -> bool:
+        """Изменение цены услуги"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE services SET price = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (price, service_id))
+            self.conn.commit()
+            if cursor.rowcount:
+                logger.info(f"Цена услуги ID {service_id} изменена на {price}₽")
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка изменения цены услуги: {e}")
+            return False
+
+    def set_service_active(self, service_id: int, active: bool) -> bool:
+        """Показать или скрыть услугу в прайс-листе"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE services SET active = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (active, service_id))
+            self.conn.commit()
+            if cursor.rowcount:
+                logger.info(f"Услуга ID {service_id} {'включена' if active else 'скрыта'}")
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка изменения видимости услуги: {e}")
+            return False
+
+    def create_broadcast(self, text: str, created_by: int) -> Optional[int]:
+        """Создание черновика рассылки"""
+        try:
+            cursor = self.conn.cursor()
+            total = self.count_broadcast_recipients()
+            cursor.execute('''
+                INSERT INTO broadcasts (text, status, created_by, total_recipients)
+                VALUES (?, 'draft', ?, ?)
+            ''', (text, created_by, total))
+            self.conn.commit()
+            broadcast_id = cursor.lastrowid
+            logger.info(f"Создана рассылка #{broadcast_id} на {total} получателей")
+            return broadcast_id
+        except Exception as e:
+            logger.error(f"Ошибка создания рассылки: {e}")
+            return None
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        """Получение рассылки по ID"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, text, status, created_by, last_user_id, total_recipients,
+                   sent_count, failed_count, blocked_count, started_at, finished_at
+            FROM broadcasts WHERE id = ?
+        ''', (broadcast_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        keys = ('id', 'text', 'status', 'created_by', 'last_user_id', 'total_recipients',
+                'sent_count', 'failed_count', 'blocked_count', 'started_at', 'finished_at')
+        return dict(zip(keys, row))
+
+    def get_unfinished_broadcasts(self) -> List[int]:
+        """ID рассылок, прерванных остановкой бота"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+
+    def count_broadcast_recipients(self) -> int:
+        """Количество уникальных получателей рассылки"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT user_id FROM orders
+                UNION
+                SELECT user_id FROM user_agreements
+            )
+            WHERE user_id NOT IN (SELECT user_id FROM blocked_users)
+        ''')
+        return cursor.fetchone()[0]
+
+    def iter_broadcast_recipients(self, after_user_id: int = 0, batch_size: int = 500):
+        """Потоковая выборка получателей пачками по возрастанию user_id.
+
+        Курсор - последний обработанный user_id, поэтому выборку можно продолжить
+        с любого места без чтения всех пользователей в память.
+        """
+        cursor = self.conn.cursor()
+        last_user_id = after_user_id
+        while True:
+            # ORDER BY/LIMIT на уровне UNION - SQLite сливает два упорядоченных
+            # обхода индексов и останавливается после batch_size строк
+            cursor.execute('''
+                SELECT user_id FROM orders
+                WHERE user_id > ? AND user_id NOT IN (SELECT user_id FROM blocked_users)
+                UNION
+                SELECT user_id FROM user_agreements
+                WHERE user_id > ? AND user_id NOT IN (SELECT user_id FROM blocked_users)
+                ORDER BY 1
+                LIMIT ?
+            ''', (last_user_id, last_user_id, batch_size))
+            batch = [row[0] for row in cursor.fetchall()]
+            if not batch:
+                return
+            yield batch
+            last_user_id = batch[-1]
+
+    def start_broadcast(self, broadcast_id: int) -> bool:
+        """Перевод рассылки в статус выполнения"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE broadcasts
+            SET status = 'running', started_at = COALESCE(started_at, CURRENT_TIMESTAMP)
+            WHERE id = ? AND status IN ('draft', 'running', 'paused')
+        ''', (broadcast_id,))
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def update_broadcast_progress(self, broadcast_id: int, last_user_id: int,
+                                  sent: int, failed: int, blocked: int):
+        """Сохранение прогресса рассылки после пачки"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE broadcasts
+            SET last_user_id = ?, sent_count = sent_count + ?,
+                failed_count = failed_count + ?, blocked_count = blocked_count + ?
+            WHERE id = ?
+        ''', (last_user_id, sent, failed, blocked, broadcast_id))
+        self.conn.commit()
+
+    def finish_broadcast(self, broadcast_id: int, status: str = 'completed'):
+        """Завершение рассылки (completed / cancelled / paused)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE broadcasts
+            SET status = ?, finished_at = CASE WHEN ? = 'paused' THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE id = ?
+        ''', (status, status, broadcast_id))
+        self.conn.commit()
+        logger.info(f"Рассылка #{broadcast_id} переведена в статус {status}")
+
+    def mark_users_blocked(self, user_ids: List[int]):
+        """Пометить пользователей, заблокировавших бота"""
+        if not user_ids:
+            return
+        cursor = self.conn.cursor()
+        cursor.executemany('INSERT OR IGNORE INTO blocked_users (user_id) VALUES (?)',
+                           [(user_id,) for user_id in user_ids])
+        self.conn.commit()
+
+    def unblock_user(self, user_id: int) -> bool:
+        """Пользователь разблокировал бота - снова включаем его в рассылки"""
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM blocked_users WHERE user_id = ?', (user_id,))
+        self.conn.commit()
+        return cursor.rowcount > 0
+
     def get_statistics(self, days: int = 30) -> Dict[str, Any]:
         cursor = self.conn.cursor()
 
@@ -0,0 +1,162 @@
+# database/filters.py
+from datetime import datetime
+from itertools import combinations
+from typing import Any, Iterator, List, Optional, Tuple
+
+
+# Индексы фильтров в порядке предпочтения (самые избирательные условия первыми)
+FILTER_INDEXES = (
+    ('user_id', 'idx_orders_user_id'),
+    ('has_promo', 'idx_orders_promo_code'),
+    ('min_rating', 'idx_orders_rating'),
+    ('service_type', 'idx_orders_service_type'),
+    ('created_from', 'idx_orders_created_at'),
+    ('created_to', 'idx_orders_created_at'),
+    ('payment_status', 'idx_orders_payment_status'),
+    ('statuses', 'idx_orders_status'),
+)
+
+
+class OrderFilter:
+    """
+    Построитель выборки заказов для админки.
+
+    Условия комбинируются цепочкой вызовов и превращаются в
+    параметризованный SQL. Страницы листаются по ключу (id последнего
+    показанного заказа), а не через OFFSET. Выборка всегда идет по
+    индексу самого избирательного условия (INDEXED BY): без статистики
+    планировщик SQLite предпочитает просмотр первичного ключа в порядке
+    ORDER BY id, что для редких условий означает чтение всей таблицы.
+    Индекс SQLite неявно заканчивается rowid, поэтому для равенства
+    "поле = ? AND id < ?" страница выбирается прямо из индекса.
+    """
+
+    def __init__(self):
+        self.statuses: Optional[Tuple[str, ...]] = None
+        self.payment_status: Optional[str] = None
+        self.service_type: Optional[str] = None
+        self.created_from: Optional[str] = None
+        self.created_to: Optional[str] = None
+        self.min_rating: Optional[int] = None
+        self.has_promo: Optional[bool] = None
+        self.user_id: Optional[int] = None
+        self.newest_first = True
+
+    def status(self, *statuses: str) -> 'OrderFilter':
+        self.statuses = tuple(getattr(status, 'value', status) for status in statuses)
+        return self
+
+    def payment(self, payment_status: str) -> 'OrderFilter':
+        self.payment_status = getattr(payment_status, 'value', payment_status)
+        return self
+
+    def service(self, service_type: str) -> 'OrderFilter':
+        self.service_type = service_type
+        return self
+
+    def created_between(self, start: datetime = None, end: datetime = None) -> 'OrderFilter':
+        """Диапазон даты создания [start, end) в UTC, как хранится created_at"""
+        self.created_from = start.strftime('%Y-%m-%d %H:%M:%S') if start else None
+        self.created_to = end.strftime('%Y-%m-%d %H:%M:%S') if end else None
+        return self
+
+    def rating_at_least(self, rating: int) -> 'OrderFilter':
+        self.min_rating = rating
+        return self
+
+    def with_promo(self, has_promo: bool = True) -> 'OrderFilter':
+        self.has_promo = has_promo
+        return self
+
+    def for_user(self, user_id: int) -> 'OrderFilter':
+        self.user_id = user_id
+        return self
+
+    def oldest_first(self) -> 'OrderFilter':
+        self.newest_first = False
+        return self
+
+    def where(self) -> Tuple[List[str], List[Any]]:
+        """Условия WHERE и их параметры"""
+        conditions, params = [], []
+        if self.statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(self.statuses))})")
+            params.extend(self.statuses)
+        if self.payment_status is not None:
+            conditions.append("payment_status = ?")
+            params.append(self.payment_status)
+        if self.service_type is not None:
+            conditions.append("service_type = ?")
+            params.append(self.service_type)
+        if self.created_from is not None:
+            conditions.append("created_at >= ?")
+            params.append(self.created_from)
+        if self.created_to is not None:
+            conditions.append("created_at < ?")
+            params.append(self.created_to)
+        if self.min_rating is not None:
+            conditions.append("rating >= ?")
+            params.append(self.min_rating)
+        if self.has_promo is True:
+            conditions.append("promo_code > ''")
+        elif self.has_promo is False:
+            conditions.append("(promo_code IS NULL OR promo_code = '')")
+        if self.user_id:
+            conditions.append("user_id = ?")
+            params.append(self.user_id)
+        return conditions, params
+
+    @property
+    def driving_index(self) -> Optional[str]:
+        """Индекс, по которому выбираются строки (None - просмотр по первичному ключу)"""
+        for attribute, index in FILTER_INDEXES:
+            value = getattr(self, attribute)
+            if attribute == 'has_promo':
+                if value is True:
+                    return index
+            elif value:
+                return index
+        return None
+
+    def build(self, after_id: int = None, limit: int = 20, columns: str = "*") -> Tuple[str, List[Any]]:
+        """SQL страницы: заказы после after_id в порядке фильтра"""
+        conditions, params = self.where()
+        if after_id is not None:
+            conditions.append("id < ?" if self.newest_first else "id > ?")
+            params.append(after_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        index = self.driving_index
+        indexed_by = f"INDEXED BY {index}" if index else ""
+        order = "DESC" if self.newest_first else "ASC"
+        params.append(limit)
+        return f"SELECT {columns} FROM orders {indexed_by} {where} ORDER BY id {order} LIMIT ?", params
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.where()[0]
+
+    @classmethod
+    def all_combinations(cls) -> Iterator['OrderFilter']:
+        """Все сочетания условий (с пробными значениями) для проверки планов запросов"""
+        setters = [
+            lambda f: f.status('pending', 'processing'),
+            lambda f: f.payment('success'),
+            lambda f: f.service('УЗИ'),
+            lambda f: f.created_between(datetime(2024, 1, 1), datetime(2024, 2, 1)),
+            lambda f: f.rating_at_least(4),
+            lambda f: f.with_promo(),
+            lambda f: f.for_user(1),
+        ]
+        for size in range(len(setters) + 1):
+            for chosen in combinations(setters, size):
+                for newest_first in (True, False):
+                    order_filter = cls()
+                    for setter in chosen:
+                        setter(order_filter)
+                    order_filter.newest_first = newest_first
+                    yield order_filter
+
+    def describe(self) -> str:
+        """Краткое описание условий (для логов)"""
+        conditions, params = self.where()
+        return f"{' AND '.join(conditions) or 'все'} {params} {'DESC' if self.newest_first else 'ASC'}"
@@ -1,11 +1,12 @@
 # handlers/__init__.py
-from .common import router as common_router
+from .common import router as common_router, fallback_router
 from .user import router as user_router
 from .payment import router as payment_router
 from .admin import router as admin_router
 
 __all__ = [
     'common_router',
+    'fallback_router',
     'user_router',
     'payment_router',
     'admin_router'
@@ -6,8 +6,8 @@ import tempfile
 import os
 from datetime import datetime, timedelta
 from io import StringIO, BytesIO
-from html import escape as html_escape
 import logging
+import time
 
 from aiogram import Router, types, F, Bot
 from aiogram.filters import Command
@@ -23,18 +23,48 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from handlers.states import AdminState
+from handlers.filters import replied_to
 from database import db
+from database.database import SNIPPET_START, SNIPPET_END
+from database.filters import OrderFilter
 from utils.keyboards import (
     create_admin_menu,
     create_admin_order_actions_keyboard,
-    create_admin_template_keyboard
+    create_admin_template_keyboard,
+    create_admin_filter_keyboard,
+    create_confirmation_keyboard,
+    create_admin_services_keyboard,
+    create_admin_service_actions_keyboard,
+    get_keyboard_cache_stats,
+    create_search_pages_keyboard
 )
-from models.enums import OrderStatus, DiscountType
+from models.enums import (
+    OrderStatus, PaymentStatus, DiscountType, MessagePriority, MessageLinkKind, UserRole, OPEN_ORDER_STATUSES
+)
+from utils.sender import message_sender
+from utils.broadcast import broadcast_manager
+from utils.notifier import admin_notifier
+from utils.bot_identity import bot_identity
+from utils.metrics import metrics
+from utils.config import config
+from utils.catalog import get_catalog, rebuild_catalog
+from utils.templates import check_markup, html_escape
+from utils.sla import sla_queue
+from utils.operators import operator_registry
+from utils.outbox import outbox_dispatcher
+from utils.invoices import invoice_validator
+from utils.sweeper import sweeper
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Результатов поиска на одной странице
+SEARCH_PAGE_SIZE = 10
+
+# Сообщений переписки по заказу за один просмотр
+CLARIFICATIONS_PAGE_SIZE = 20
+
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
@@ -68,10 +98,13 @@ def get_status_emoji(status: str) -> str:
 # ========== ПРОВЕРКА ДОСТУПА ==========
 
 def is_admin(user_id: int) -> bool:
-    """Проверка, является ли пользователь администратором"""
-    # Временно возвращаем True для отладки
-    # В production нужно импортировать config и проверять config.ADMIN_ID
-    return True
+    """Проверка, является ли пользователь администратором (ADMIN_ID или оператор с ролью admin)"""
+    return user_id == config.ADMIN_ID or operator_registry.role_of(user_id) == UserRole.ADMIN.value
+
+
+def is_operator(user_id: int) -> bool:
+    """Проверка, может ли пользователь работать с заказами (администратор или оператор)"""
+    return operator_registry.is_operator(user_id)
 
 
 # ========== СТАТИСТИКА ==========
@@ -177,56 +210,110 @@ async def handle_statistics(message: Message):
 
 # ========== ВСЕ ЗАКАЗЫ ==========
 
+# Фильтры списка заказов: callback filter_<name> -> (заголовок, построитель фильтра)
+ORDER_FILTERS = {
+    'all': ("📋 ПОСЛЕДНИЕ ЗАКАЗЫ", lambda: OrderFilter()),
+    'pending': ("⏳ ОЖИДАЮЩИЕ", lambda: OrderFilter().status(*OPEN_ORDER_STATUSES)),
+    'completed': ("✅ ЗАВЕРШЕННЫЕ", lambda: OrderFilter().status(OrderStatus.COMPLETED)),
+    'paid': ("💰 ОПЛАЧЕННЫЕ", lambda: OrderFilter().payment(PaymentStatus.SUCCESS)),
+    'cancelled': ("❌ ОТМЕНЕННЫЕ", lambda: OrderFilter().status(OrderStatus.CANCELLED)),
+    'clarification': ("❓ ЖДУТ УТОЧНЕНИЯ", lambda: OrderFilter().status(OrderStatus.AWAITING_CLARIFICATION)),
+    'new_docs': ("📎 НУЖНЫ НОВЫЕ ДОКУМЕНТЫ", lambda: OrderFilter().status(OrderStatus.NEEDS_NEW_DOCS)),
+    # created_at хранится в UTC (CURRENT_TIMESTAMP)
+    'today': ("🗓️ ЗА СЕГОДНЯ", lambda: OrderFilter().created_between(
+        datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))),
+}
+
+# Заказов на одной странице списка
+ORDERS_PAGE_SIZE = 10
+
+
+def format_orders_page(filter_name: str, after_id: int = None) -> tuple:
+    """Текст и клавиатура страницы списка заказов по фильтру"""
+    title, build_filter = ORDER_FILTERS[filter_name]
+    order_filter = build_filter()
+    orders = db.find_orders(order_filter, after_id=after_id, limit=ORDERS_PAGE_SIZE)
+
+    if not orders:
+        text = f"<b>{title}</b>\n\n📭 {'Больше заказов нет' if after_id else 'Нет заказов'}"
+        return text, create_admin_filter_keyboard()
+
+    text_lines = []
+    text_lines.append(f"<b>{title} ({db.count_orders(order_filter)})</b>\n")
+    text_lines.append("<i>Новые заказы вверху ↓</i>\n")
+
+    for order in orders:
+        order_id = order[0]
+        user_id = order[1]
+        username = order[2]
+        service_type = order[8] if len(order) > 8 else "Не указано"
+        status = order[9] if len(order) > 9 else "pending"
+        created_at = order[10] if len(order) > 10 else None
+        price = order[14] if len(order) > 14 else 0
+        original_price = order[15] if len(order) > 15 else price
+
+        status_emoji = get_status_emoji(status)
+        datetime_str = format_date(created_at)
+
+        short_service = service_type[:25] + "..." if len(service_type) > 25 else service_type
+        short_username = username[:15] if username else "без username"
+        discount = original_price - price if original_price and price else 0
+
+        text_lines.append(f"<b>{status_emoji} #{order_id} • {datetime_str}</b>")
+        text_lines.append(f"👤 @{html_escape(short_username)} (ID: {user_id})")
+        text_lines.append(f"📋 {html_escape(short_service)}")
+        text_lines.append(f"💰 {price}₽ (скидка: {discount}₽)")
+        text_lines.append(f"📊 Статус: <b>{status}</b>")
+        text_lines.append(f"🔧 /order_{order_id}")
+        text_lines.append("─" * 40)
+        text_lines.append("")
+
+    # Следующая страница - по id последнего показанного заказа
+    next_callback = f"filterpage_{filter_name}_{orders[-1][0]}" if len(orders) == ORDERS_PAGE_SIZE else None
+    return "\n".join(text_lines), create_admin_filter_keyboard(next_callback)
+
+
 @router.message(F.text == "📋 Все заказы")
 async def handle_all_orders(message: Message):
-    """Показать все заказы (последние сверху)"""
+    """Показать все заказы (последние сверху) с фильтрами"""
     if not is_admin(message.from_user.id):
         await message.answer("⛔️ Доступ запрещен")
         return
 
     try:
-        orders = db.get_all_orders(limit=20)
-
-        if not orders:
-            await message.answer("📭 Нет заказов", reply_markup=create_admin_menu())
-            return
-
-        text_lines = []
-        text_lines.append(f"<b>📋 ПОСЛЕДНИЕ ЗАКАЗЫ ({len(orders)})</b>\n")
-        text_lines.append("<i>Новые заказы вверху ↓</i>\n")
+        text, keyboard = format_orders_page('all')
+        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
 
-        for order in orders:
-            order_id = order[0]
-            user_id = order[1]
-            username = order[2]
-            service_type = order[8] if len(order) > 8 else "Не указано"
-            status = order[9] if len(order) > 9 else "pending"
-            created_at = order[10] if len(order) > 10 else None
-            price = order[14] if len(order) > 14 else 0
-            original_price = order[15] if len(order) > 15 else price
+    except Exception as e:
+        logger.error(f"Ошибка отображения всех заказов: {e}")
+        await message.answer(f"❌ Ошибка: {str(e)[:200]}", reply_markup=create_admin_menu())
 
-            status_emoji = get_status_emoji(status)
-            datetime_str = format_date(created_at)
 
-            short_service = service_type[:25] + "..." if len(service_type) > 25 else service_type
-            short_username = username[:15] if username else "без username"
-            discount = original_price - price if original_price and price else 0
+@router.callback_query(F.data.startswith("filter_") | F.data.startswith("filterpage_"))
+async def handle_orders_filter(callback: types.CallbackQuery):
+    """Фильтр списка заказов и листание страниц"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
 
-            text_lines.append(f"<b>{status_emoji} #{order_id} • {datetime_str}</b>")
-            text_lines.append(f"👤 @{short_username} (ID: {user_id})")
-            text_lines.append(f"📋 {short_service}")
-            text_lines.append(f"💰 {price}₽ (скидка: {discount}₽)")
-            text_lines.append(f"📊 Статус: <b>{status}</b>")
-            text_lines.append(f"🔧 /order_{order_id}")
-            text_lines.append("─" * 40)
-            text_lines.append("")
+    after_id = None
+    if callback.data.startswith("filterpage_"):
+        filter_name, after_id = callback.data.replace("filterpage_", "").rsplit("_", 1)
+        after_id = int(after_id)
+    else:
+        filter_name = callback.data.replace("filter_", "")
 
-        text = "\n".join(text_lines)
-        await message.answer(text, parse_mode="HTML")
+    if filter_name not in ORDER_FILTERS:
+        await callback.answer("❌ Неизвестный фильтр", show_alert=True)
+        return
 
+    try:
+        text, keyboard = format_orders_page(filter_name, after_id)
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
     except Exception as e:
-        logger.error(f"Ошибка отображения всех заказов: {e}")
-        await message.answer(f"❌ Ошибка: {str(e)[:200]}", reply_markup=create_admin_menu())
+        # Повторное нажатие того же фильтра - текст не изменился
+        logger.debug("Список заказов не обновлен: %s", e)
+    await callback.answer()
 
 
 # ========== ОЖИДАЮЩИЕ ЗАКАЗЫ ==========
@@ -294,6 +381,153 @@ async def handle_pending_orders(message: Message):
         await message.answer(f"❌ Ошибка: {str(e)[:200]}", reply_markup=create_admin_menu())
 
 
+# ========== ОЧЕРЕДЬ SLA ==========
+
+def format_sla_left(deadline: float) -> str:
+    """Сколько осталось до срока ответа (или на сколько он просрочен)"""
+    seconds = int(deadline - time.time())
+    hours, minutes = divmod(abs(seconds) // 60, 60)
+    left = f"{hours} ч {minutes} мин" if hours else f"{minutes} мин"
+    return f"осталось {left}" if seconds >= 0 else f"🚨 просрочен на {left}"
+
+
+@router.message(F.text == "🔥 Следующий заказ")
+async def handle_next_order(message: Message):
+    """Взять в работу самый срочный свободный заказ"""
+    if not is_operator(message.from_user.id):
+        await message.answer("⛔️ Брать заказы могут только операторы")
+        return
+
+    claimed = operator_registry.claim_next(message.from_user.id)
+    if claimed is None:
+        await message.answer("✅ Свободных заказов нет", reply_markup=create_admin_menu())
+        return
+    order_id, status, deadline = claimed
+    order = db.get_order_by_id(order_id)
+
+    questions = order[5] or "нет вопроса"
+    short_question = questions[:300] + "..." if len(questions) > 300 else questions
+    text = (
+        f"<b>{get_status_emoji(status)} ЗАКАЗ #{order_id}</b> • {status}\n"
+        f"⏰ {format_sla_left(deadline)}\n\n"
+        f"👤 @{html_escape(order[2] or 'без username')} (ID: {order[1]})\n"
+        f"📋 {html_escape(order[8])}\n"
+        f"💰 {order[14]}₽\n"
+        f"❓ {html_escape(short_question)}\n\n"
+        f"🔧 <code>/order {order_id}</code>\n"
+        f"<i>Заказ закреплен за вами на {operator_registry.lease_minutes} мин. "
+        f"В очереди еще: {len(sla_queue)}</i>"
+    )
+    sent = await message.answer(text, parse_mode="HTML", reply_markup=create_admin_order_actions_keyboard(order_id))
+    db.link_message(sent.chat.id, sent.message_id, order_id, MessageLinkKind.ORDER)
+
+
+@router.callback_query(F.data.startswith("admin_release_"))
+async def handle_order_release(callback: types.CallbackQuery):
+    """Вернуть взятый заказ в очередь"""
+    user_id = callback.from_user.id
+    if not is_operator(user_id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    order_id = int(callback.data.replace("admin_release_", ""))
+    # Администратор может снять заказ с любого оператора
+    operator_id = None if is_admin(user_id) else user_id
+    if operator_registry.release(order_id, operator_id):
+        await callback.answer(f"↩️ Заказ #{order_id} возвращен в очередь")
+    else:
+        await callback.answer("Заказ не закреплен за вами", show_alert=True)
+
+
+@router.message(Command("sla"))
+async def cmd_sla(message: Message):
+    """Состояние очереди SLA и нарушения сроков"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    stats = sla_queue.get_stats()
+    resolved = stats['resolved_in_time'] + stats['resolved_breached']
+    in_time_percent = stats['resolved_in_time'] / resolved * 100 if resolved else 100
+    lines = [
+        "<b>⏰ ОЧЕРЕДЬ SLA</b>\n",
+        f"В очереди: {stats['queued']}, взято в работу: {stats['taken']}",
+        f"Просрочено сейчас: <b>{stats['overdue']}</b>",
+    ]
+    for status, count in sorted(stats['overdue_by_status'].items()):
+        lines.append(f"  {get_status_emoji(status)} {status}: {count}")
+    if stats['nearest_deadline'] is not None:
+        lines.append(f"Ближайший срок: {format_sla_left(stats['nearest_deadline'])}")
+    lines.append(f"\n<b>Закрыто с запуска:</b> {resolved}, в срок {in_time_percent:.0f}%")
+    for status, count in sorted(stats['breached_by_status'].items()):
+        lines.append(f"  {get_status_emoji(status)} {status}: просрочено {count}")
+    lines.append(f"Взято операторами: {stats['taken_total']}, возвращено по истечении аренды: {stats['take_expired']}")
+
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+# ========== ОПЕРАТОРЫ ==========
+
+@router.message(Command("operators"))
+async def cmd_operators(message: Message):
+    """Операторы и их производительность за неделю"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    names = {user_id: username for user_id, username, _, _, _ in db.get_operators(active_only=False)}
+    lines = ["<b>👷 ОПЕРАТОРЫ</b> (за 7 дней: выполнено / за сутки / среднее время ответа / в работе)\n"]
+    for item in operator_registry.get_stats(days=7):
+        name = f"@{html_escape(names[item['operator_id']])}" if names.get(item['operator_id']) else ""
+        avg_hours = f"{item['avg_answer_hours']:.1f} ч" if item['avg_answer_hours'] is not None else "—"
+        lines.append(
+            f"<code>{item['operator_id']}</code> {name} ({item['role']})\n"
+            f"  {item['completed']} / {item['completed_last_day']} / {avg_hours} / {item['claimed']}"
+        )
+    lines.append(f"\nВыдано заказов: {operator_registry.claims}, конфликтов: {operator_registry.claim_conflicts}, "
+                 f"истекло аренд: {operator_registry.leases_expired}")
+    lines.append("\n<i>/add_operator ID [admin] · /remove_operator ID</i>")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+@router.message(Command("add_operator"))
+async def cmd_add_operator(message: Message):
+    """Добавить оператора: /add_operator <user_id> [admin]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.answer("Формат: <code>/add_operator ID [admin]</code>", parse_mode="HTML")
+        return
+    user_id = int(parts[1])
+    role = UserRole.ADMIN if len(parts) > 2 and parts[2].lower() == UserRole.ADMIN.value else UserRole.OPERATOR
+    if operator_registry.add(user_id, role=role, added_by=message.from_user.id):
+        await message.answer(f"✅ {user_id} добавлен как {role.value}")
+    else:
+        await message.answer("❌ Не удалось добавить оператора")
+
+
+@router.message(Command("remove_operator"))
+async def cmd_remove_operator(message: Message):
+    """Отключить оператора: /remove_operator <user_id>"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.answer("Формат: <code>/remove_operator ID</code>", parse_mode="HTML")
+        return
+
+    removed, released = operator_registry.remove(int(parts[1]))
+    if removed:
+        await message.answer(f"✅ Оператор отключен, заказов возвращено в очередь: {released}")
+    else:
+        await message.answer("❌ Оператор не найден")
+
+
 # ========== БЭКАП БАЗЫ ДАННЫХ ==========
 
 @router.message(F.text == "💾 Бэкап")
@@ -318,6 +552,165 @@ async def handle_backup(message: Message):
         await message.answer(f"❌ Ошибка при создании бэкапа: {str(e)[:200]}", reply_markup=create_admin_menu())
 
 
+# ========== ОЧЕРЕДИ ОБНОВЛЕНИЙ ==========
+
+@router.message(Command("queue_stats"))
+async def cmd_queue_stats(message: Message, update_ordering=None, throttling=None):
+    """Метрики очередей обработки обновлений"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    if update_ordering is None:
+        await message.answer("❌ Планировщик обновлений не подключен")
+        return
+
+    stats = update_ordering.get_stats()
+    text = f"""<b>🚦 ОЧЕРЕДИ ОБНОВЛЕНИЙ</b>
+
+• В обработке: {stats['in_flight']} (лимит {stats['max_concurrency']})
+• Ожидают в очередях: {stats['queued']}
+• Активных пользователей: {stats['active_users']}
+• Обработано: {stats['processed']}
+• Отброшено (переполнение): {stats['dropped']}
+• Макс. глубина очереди: {stats['max_queue_depth']}
+• Среднее ожидание: {stats['avg_wait_ms']:.1f} мс
+• Макс. ожидание: {stats['max_wait_ms']:.1f} мс"""
+
+    send_stats = message_sender.get_stats()
+    text += f"""
+
+<b>📤 ИСХОДЯЩИЕ СООБЩЕНИЯ</b>
+• В очереди: {send_stats['queued']}
+• Отправлено: {send_stats['sent']}
+• Ошибок: {send_stats['failed']}
+• Повторов: {send_stats['retried']} (из них 429: {send_stats['rate_limited']})
+• Средняя задержка: {send_stats['avg_delay_ms']:.1f} мс
+• Макс. задержка: {send_stats['max_delay_ms']:.1f} мс"""
+
+    if throttling is not None:
+        throttle_stats = throttling.get_stats()
+        hot_users = ", ".join(f"{user_id} ({count})" for user_id, count in throttle_stats['hot_users'][:5])
+        text += f"""
+
+<b>🛡 АНТИФЛУД</b>
+• Пропущено: {throttle_stats['allowed']}
+• Отброшено: {throttle_stats['throttled']} (предупреждений: {throttle_stats['warned']})
+• Активных лимитов: {throttle_stats['buckets']}
+• Самые активные: {hot_users or 'нет'}"""
+
+    notify_stats = admin_notifier.get_stats()
+    counters = ", ".join(f"{name}: {count}" for name, count in notify_stats['counters'].items() if count)
+    text += f"""
+
+<b>📬 УВЕДОМЛЕНИЯ АДМИНА</b>
+• Ожидают сводки: {notify_stats['pending']}
+• Сводок отправлено: {notify_stats['digests_sent']}
+• Срочных отправлено: {notify_stats['immediate_sent']}
+• События: {counters or 'нет'}"""
+
+    await message.answer(text, parse_mode="HTML")
+
+
+@router.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    """Время работы обработчиков (p50/p95/p99) и время БД"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    rows = metrics.summary()
+    if not rows:
+        await message.answer("📭 Метрик пока нет")
+        return
+
+    lines = ["<b>⏱ ОБРАБОТЧИКИ</b> (вызовы, ошибки, p50/p95/p99, БД в среднем)\n"]
+    for row in rows[:20]:
+        lines.append(
+            f"<code>{row['handler']}</code>\n"
+            f"  {row['count']} / {row['errors']} ош. · "
+            f"{row['p50_ms']:.1f} / {row['p95_ms']:.1f} / {row['p99_ms']:.1f} мс · "
+            f"БД {row['db_avg_ms']:.1f} мс"
+        )
+    lines.append(f"\n<b>🗄 БД:</b> {metrics.db_calls} запросов, {metrics.db_time_total * 1000:.0f} мс всего")
+    keyboard_stats = get_keyboard_cache_stats()
+    lines.append(f"<b>⌨️ Клавиатуры:</b> {keyboard_stats['hits']} из кэша, "
+                 f"{keyboard_stats['misses']} построено, в кэше {keyboard_stats['size']}")
+    for job in sweeper.get_stats():
+        lines.append(f"<b>🧹 {job['name']}:</b> запусков {job['runs']}, обработано {job['processed']} "
+                     f"(последний раз {job['last_processed']} за {job['last_duration_ms']:.0f} мс), "
+                     f"ошибок {job['errors']}")
+    outbox_stats = outbox_dispatcher.get_stats()
+    lines.append(f"<b>📮 Outbox:</b> доставлено {outbox_stats['delivered']}, повторов {outbox_stats['retried']}, "
+                 f"сбоев {outbox_stats['failed']}, ждут {outbox_stats['by_status'].get('pending', 0)}")
+    invoice_stats = invoice_validator.get_stats()
+    rejected = ", ".join(f"{reason}: {count}" for reason, count in invoice_stats['rejected'].items())
+    lines.append(f"<b>💳 Проверка счетов:</b> {invoice_stats['checked']} "
+                 f"({invoice_stats['p50_ms']:.2f} / {invoice_stats['p95_ms']:.2f} / {invoice_stats['p99_ms']:.2f} мс), "
+                 f"из кэша {invoice_stats['cache_hits']}, из БД {invoice_stats['cache_misses']}, "
+                 f"отказов: {rejected or 'нет'}")
+    lines.append(f"<b>🔁 Повторные платежи:</b> {db.duplicate_payments} отсечено")
+
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+@router.message(Command("sweep"))
+async def cmd_sweep(message: Message):
+    """Запустить фоновые задачи обслуживания БД сейчас"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    results = await sweeper.run_all()
+    lines = ["<b>🧹 ОБСЛУЖИВАНИЕ БД</b>\n"]
+    lines.extend(f"{name}: обработано {processed}" for name, processed in results.items())
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+@router.message(Command("reload_config"))
+async def cmd_reload_config(message: Message):
+    """Перезагрузка настроек из .env / config.json без перезапуска"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    try:
+        changes, restart_required = config.reload()
+    except Exception as e:
+        logger.error(f"Ошибка перезагрузки конфигурации: {e}")
+        await message.answer(f"❌ Конфигурация не изменена: {html_escape(str(e)[:500])}", parse_mode="HTML")
+        return
+
+    if not changes and not restart_required:
+        await message.answer("✅ Конфигурация не изменилась")
+        return
+
+    text = "<b>⚙️ КОНФИГУРАЦИЯ ПЕРЕЗАГРУЖЕНА</b>\n"
+    if changes:
+        text += "\n<b>Применено:</b>\n" + "\n".join(
+            f"• {name}: " + ("***" if "TOKEN" in name else f"{html_escape(str(old))} → {html_escape(str(new))}")
+            for name, (old, new) in changes.items()
+        )
+    if restart_required:
+        text += "\n\n<b>Требуют перезапуска:</b> " + ", ".join(restart_required)
+    await message.answer(text, parse_mode="HTML")
+
+
+@router.message(Command("refresh_bot_info"))
+async def cmd_refresh_bot_info(message: Message, bot: Bot):
+    """Обновление закэшированных данных бота (после смены username)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    try:
+        bot_info = await bot_identity.refresh(bot, force=True)
+        await message.answer(f"✅ Данные бота обновлены: @{bot_info.username} (ID: {bot_info.id})")
+    except Exception as e:
+        logger.error(f"Ошибка обновления данных бота: {e}")
+        await message.answer(f"❌ Ошибка: {str(e)[:200]}")
+
+
 # ========== ПРОМОКОДЫ ==========
 
 @router.message(F.text == "🎫 Промокоды")
@@ -547,6 +940,244 @@ async def cmd_add_template(message: Message):
         await message.answer(f"❌ Ошибка: {str(e)[:200]}")
 
 
+# ========== ПРАЙС-ЛИСТ ==========
+
+def format_services_text() -> str:
+    """Текст прайс-листа для админа"""
+    catalog = get_catalog()
+    return (f"<b>💲 ПРАЙС-ЛИСТ</b> (версия {catalog.version})\n\n"
+            "Выберите услугу, чтобы изменить цену или скрыть ее из меню заказа.\n"
+            "🚫 - услуга скрыта")
+
+
+@router.message(F.text == "💲 Прайс-лист")
+async def handle_services(message: Message):
+    """Прайс-лист услуг"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    try:
+        services = db.get_services()
+        await message.answer(
+            format_services_text(),
+            parse_mode="HTML",
+            reply_markup=create_admin_services_keyboard(services)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отображения прайс-листа: {e}")
+        await message.answer(f"❌ Ошибка: {str(e)[:200]}", reply_markup=create_admin_menu())
+
+
+@router.callback_query(F.data == "service_list")
+async def handle_service_list(callback: types.CallbackQuery):
+    """Возврат к прайс-листу"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    await callback.message.edit_text(
+        format_services_text(),
+        parse_mode="HTML",
+        reply_markup=create_admin_services_keyboard(db.get_services())
+    )
+    await callback.answer()
+
+
+async def show_service(callback: types.CallbackQuery, service_id: int):
+    """Карточка услуги с действиями"""
+    service = db.get_service(service_id)
+    if not service:
+        await callback.answer("❌ Услуга не найдена", show_alert=True)
+        return
+
+    _, name, category, price, needs_demographics, active, _ = service
+    text = f"""<b>🔸 {html_escape(name)}</b>
+
+Категория: {html_escape(category)}
+Цена: {price}₽
+Нужны возраст/пол: {'да' if needs_demographics else 'нет'}
+Статус: {'✅ в меню заказа' if active else '🚫 скрыта'}"""
+
+    await callback.message.edit_text(
+        text,
+        parse_mode="HTML",
+        reply_markup=create_admin_service_actions_keyboard(service_id, bool(active))
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("service_edit_"))
+async def handle_service_edit(callback: types.CallbackQuery):
+    """Выбор услуги в прайс-листе"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    await show_service(callback, int(callback.data.replace("service_edit_", "")))
+
+
+@router.callback_query(F.data.startswith("service_toggle_"))
+async def handle_service_toggle(callback: types.CallbackQuery):
+    """Скрыть услугу из меню заказа или вернуть ее"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    service_id = int(callback.data.replace("service_toggle_", ""))
+    service = db.get_service(service_id)
+    if not service or not db.set_service_active(service_id, not service[5]):
+        await callback.answer("❌ Не удалось изменить услугу", show_alert=True)
+        return
+
+    rebuild_catalog()
+    await show_service(callback, service_id)
+
+
+@router.callback_query(F.data.startswith("service_price_"))
+async def handle_service_price(callback: types.CallbackQuery, state: FSMContext):
+    """Запрос новой цены услуги"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    service_id = int(callback.data.replace("service_price_", ""))
+    service = db.get_service(service_id)
+    if not service:
+        await callback.answer("❌ Услуга не найдена", show_alert=True)
+        return
+
+    await state.set_state(AdminState.waiting_for_price_change)
+    await state.update_data(service_id=service_id)
+    await callback.message.answer(
+        f"💰 Введите новую цену для <b>{html_escape(service[1])}</b> (сейчас {service[3]}₽) "
+        f"целым числом в рублях.\n\n/cancel - отменить",
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+
+@router.message(AdminState.waiting_for_price_change)
+async def handle_new_service_price(message: Message, state: FSMContext):
+    """Сохранение новой цены услуги"""
+    if not is_admin(message.from_user.id):
+        await state.clear()
+        return
+
+    try:
+        new_price = int((message.text or "").strip().replace("₽", ""))
+    except ValueError:
+        await message.answer("❌ Введите цену целым числом, например <code>390</code>", parse_mode="HTML")
+        return
+
+    if not 1 <= new_price <= 100000:
+        await message.answer("❌ Цена должна быть от 1 до 100000₽")
+        return
+
+    data = await state.get_data()
+    await state.clear()
+
+    if not db.update_service_price(data.get('service_id'), new_price):
+        await message.answer("❌ Не удалось изменить цену", reply_markup=create_admin_menu())
+        return
+
+    # Новый снимок прайс-листа - следующие заказы получают новую цену без обращения к БД
+    catalog = rebuild_catalog()
+    await message.answer(
+        f"✅ Цена изменена: {new_price}₽ (прайс-лист, версия {catalog.version})",
+        reply_markup=create_admin_menu()
+    )
+
+
+# ========== ПОИСК ==========
+
+def format_search_page(query: str, page: int) -> tuple:
+    """Текст и клавиатура страницы результатов поиска"""
+    total, rows = db.search_orders(query, limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE)
+    if not total:
+        return f"🔎 По запросу «{html_escape(query)}» ничего не найдено", None
+
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    lines = [f"<b>🔎 «{html_escape(query)}»</b> - найдено заказов: {total}\n"]
+    for order_id, user_id, username, service_type, status, created_at, snippet in rows:
+        lines.append(
+            f"{get_status_emoji(status)} <b>#{order_id}</b> {html_escape(service_type)} · "
+            f"{format_date(created_at)} · @{html_escape(username or str(user_id))}"
+        )
+        if snippet:
+            snippet = html_escape(snippet).replace(SNIPPET_START, "<b>").replace(SNIPPET_END, "</b>")
+            lines.append(f"<i>{snippet}</i>")
+        lines.append(f"<code>/order {order_id}</code>\n")
+    return "\n".join(lines), create_search_pages_keyboard(page, pages)
+
+
+@router.message(Command("search"))
+async def cmd_search(message: Message, state: FSMContext):
+    """Полнотекстовый поиск по заказам и уточнениям"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2 or not args[1].strip():
+        await message.answer(
+            "🔎 Использование: <code>/search [запрос]</code>\n"
+            "Ищет по вопросам, username, услуге и уточнениям.\n"
+            "Пример: <code>/search ферритин</code>",
+            parse_mode="HTML"
+        )
+        return
+
+    query = args[1].strip()[:200]
+    # Запрос хранится в данных FSM - в callback_data помещается только номер страницы
+    await state.update_data(search_query=query)
+    text, keyboard = format_search_page(query, 0)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("search_page_"))
+async def handle_search_page(callback: types.CallbackQuery, state: FSMContext):
+    """Листание результатов поиска"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    query = (await state.get_data()).get('search_query')
+    if not query:
+        await callback.answer("Поиск устарел, повторите /search", show_alert=True)
+        return
+
+    text, keyboard = format_search_page(query, int(callback.data.replace("search_page_", "")))
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except Exception:
+        # Нажата кнопка текущей страницы - текст не изменился
+        pass
+    await callback.answer()
+
+
+@router.message(Command("reindex_search"))
+async def cmd_reindex_search(message: Message):
+    """Переиндексация поиска (одна транзакция: другие записи не попадают в середину)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    if not db.fts_enabled:
+        await message.answer("❌ FTS5 недоступен в этой сборке SQLite, поиск работает без индекса")
+        return
+
+    started_at = datetime.now()
+    await message.answer("🔄 Переиндексация поиска запущена...")
+    counts = db.rebuild_search_index()
+
+    elapsed = (datetime.now() - started_at).total_seconds()
+    await message.answer(
+        f"✅ Поиск переиндексирован за {elapsed:.1f} с: "
+        f"заказов {counts['orders']}, уточнений {counts['clarifications']}"
+    )
+
+
 # ========== КОМАНДА АДМИН ==========
 
 @router.message(Command("admin"))
@@ -564,7 +1195,7 @@ async def cmd_admin(message: Message):
 @router.message(Command("order"))
 async def cmd_order(message: Message, bot: Bot):
     """Просмотр и управление конкретным заказом"""
-    if not is_admin(message.from_user.id):
+    if not is_operator(message.from_user.id):
         await message.answer("⛔️ Доступ запрещен")
         return
 
@@ -656,7 +1287,9 @@ async def cmd_order(message: Message, bot: Bot):
 <b>🔧 ДОСТУПНЫЕ ДЕЙСТВИЯ:</b>"""
 
         keyboard = create_admin_order_actions_keyboard(order_id)
-        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+        sent = await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+        # Ответ (reply) на карточку отправляется клиенту как ответ по заказу
+        db.link_message(sent.chat.id, sent.message_id, order_id, MessageLinkKind.ORDER)
 
     except Exception as e:
         logger.error(f"Ошибка просмотра заказа: {e}")
@@ -665,10 +1298,55 @@ async def cmd_order(message: Message, bot: Bot):
 
 # ========== ОТВЕТ НА ЗАКАЗ ==========
 
+async def submit_answer(message: Message, order_id: int, reply_text: str):
+    """Записать ответ по заказу и поставить его в доставку"""
+    order = db.get_order_by_id(order_id)
+    if not order:
+        await message.answer(f"❌ Заказ #{order_id} не найден")
+        return
+
+    message_text = (f"<b>👨‍⚕️ Ответ по вашему заказу #{order_id}</b>\n\n"
+                    f"{reply_text}\n\n"
+                    f"<i>Если у вас остались вопросы, ответьте на это сообщение в течение 24 часов.</i>")
+    # Ответ уходит с parse_mode="HTML": неверную разметку Telegram отклонит уже после
+    # закрытия заказа, поэтому проверяем ее до транзакции
+    markup_errors = check_markup(message_text)
+    if markup_errors:
+        await message.answer(
+            f"❌ Ответ по заказу #{order_id} не принят: {html_escape('; '.join(markup_errors[:3]))}.\n"
+            f"Исправьте текст и отправьте заново.",
+            parse_mode="HTML"
+        )
+        return
+
+    # Ответ, статус и сообщение пользователю фиксируются одной транзакцией;
+    # доставку выполняет outbox_dispatcher, повторная обработка того же сообщения ничего не дублирует
+    outbox_id, created = db.complete_order_with_answer(
+        order_id=order_id,
+        admin_id=message.from_user.id,
+        answer_text=reply_text,
+        chat_id=order[1],
+        message_text=message_text,
+        idempotency_key=f"send:{message.chat.id}:{message.message_id}",
+        receipt_chat_id=message.chat.id,
+        # Администратор может ответить и на заказ, взятый другим оператором
+        override_claim=is_admin(message.from_user.id)
+    )
+    if outbox_id is None:
+        await message.answer(f"🔒 Заказ #{order_id} сейчас в работе у другого оператора. "
+                             f"Ответ не отправлен.")
+        return
+    outbox_dispatcher.wake()
+
+    if created:
+        await message.answer(f"📝 Ответ по заказу #{order_id} принят и поставлен в отправку "
+                             f"(outbox #{outbox_id}). Пришлю подтверждение доставки.")
+
+
 @router.message(Command("send"))
 async def cmd_send_reply(message: Message, bot: Bot):
     """Отправка ответа клиенту"""
-    if not is_admin(message.from_user.id):
+    if not is_operator(message.from_user.id):
         await message.answer("⛔️ Доступ запрещен")
         return
 
@@ -678,47 +1356,200 @@ async def cmd_send_reply(message: Message, bot: Bot):
             await message.answer("❌ Укажите номер заказа и текст: <code>/send [id] [текст]</code>", parse_mode="HTML")
             return
 
-        order_id = int(args[1])
-        reply_text = args[2]
+        await submit_answer(message, int(args[1]), args[2])
 
-        order = db.get_order_by_id(order_id)
-        if not order:
-            await message.answer(f"❌ Заказ #{order_id} не найден")
-            return
+    except Exception as e:
+        logger.error(f"Ошибка отправки ответа: {e}")
+        await message.answer(f"❌ Ошибка: {str(e)[:200]}")
 
-        user_id = order[1]
 
-        # Отправляем ответ пользователю
-        try:
-            await bot.send_message(
-                user_id,
-                f"<b>👨‍⚕️ Ответ по вашему заказу #{order_id}</b>\n\n"
-                f"{reply_text}\n\n"
-                f"<i>Если у вас остались вопросы, задайте их в течение 24 часов.</i>",
-                parse_mode="HTML"
-            )
+@router.message(F.text, ~F.text.startswith("/"), replied_to(MessageLinkKind.ORDER, MessageLinkKind.QUESTION))
+async def handle_order_reply(message: Message, linked_order: tuple):
+    """Ответ (reply) на карточку заказа или вопрос клиента - ответ клиенту без /send"""
+    if not is_operator(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    try:
+        await submit_answer(message, linked_order[0], message.text)
+    except Exception as e:
+        logger.error(f"Ошибка отправки ответа: {e}")
+        await message.answer(f"❌ Ошибка: {str(e)[:200]}")
+
+
+@router.callback_query(F.data.startswith("admin_clarifications_"))
+async def handle_order_clarifications(callback: types.CallbackQuery, state: FSMContext):
+    """Переписка по заказу: только сообщения, появившиеся после прошлого просмотра"""
+    if not is_operator(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    order_id = int(callback.data.replace("admin_clarifications_", ""))
+    data = await state.get_data()
+    seen = dict(data.get('seen_clarifications', {}))
+    last_seen = seen.get(str(order_id), 0)
 
-            # Обновляем статус заказа
-            db.update_order_status(order_id, OrderStatus.COMPLETED, message.from_user.id)
+    clarifications = db.get_clarifications_since(order_id, last_seen, limit=CLARIFICATIONS_PAGE_SIZE)
+    if not clarifications:
+        await callback.answer("Новых сообщений нет" if last_seen else "Переписки по заказу нет", show_alert=True)
+        return
+
+    lines = [f"<b>💬 ЗАКАЗ #{order_id}: {'новые сообщения' if last_seen else 'переписка'}</b>\n"]
+    for clarification in clarifications:
+        author = "👤 Клиент" if clarification[7] else "👨‍⚕️ Специалист"
+        lines.append(f"<b>{author}</b> • {format_date(clarification[6])}")
+        lines.append(f"{html_escape(clarification[3])}\n")
+    if len(clarifications) == CLARIFICATIONS_PAGE_SIZE:
+        lines.append("<i>Нажмите еще раз, чтобы увидеть следующие сообщения</i>")
+
+    seen[str(order_id)] = clarifications[-1][0]
+    await state.update_data(seen_clarifications=seen)
+    await callback.message.answer("\n".join(lines), parse_mode="HTML")
+    await callback.answer()
+
+
+# ========== РАССЫЛКИ ==========
 
-            # Добавляем запись о ответе
-            db.add_clarification(
-                order_id=order_id,
-                user_id=message.from_user.id,
-                message_text=reply_text,
-                is_from_user=False
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    """Создание рассылки всем пользователям"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    try:
+        args = message.text.split(' ', 1)
+        if len(args) < 2 or not args[1].strip():
+            await message.answer(
+                "❌ <b>Укажите текст рассылки</b>\n\n"
+                "Использование: <code>/broadcast [текст]</code>\n"
+                "Текст поддерживает HTML-разметку.\n\n"
+                "<code>/broadcast_status</code> - прогресс текущей рассылки\n"
+                "<code>/broadcast_cancel</code> - отменить текущую рассылку\n"
+                "<code>/broadcast_resume [id]</code> - продолжить приостановленную",
+                parse_mode="HTML"
             )
+            return
 
-            await message.answer(f"✅ Ответ отправлен пользователю (заказ #{order_id})")
+        if broadcast_manager.is_running:
+            await message.answer(f"⏳ Уже идет рассылка #{broadcast_manager.current_id}. Дождитесь ее завершения.")
+            return
 
-        except Exception as e:
-            await message.answer(f"❌ Не удалось отправить сообщение пользователю: {str(e)[:200]}")
+        broadcast_id = db.create_broadcast(args[1].strip(), message.from_user.id)
+        if not broadcast_id:
+            await message.answer("❌ Не удалось создать рассылку.")
+            return
+
+        broadcast = db.get_broadcast(broadcast_id)
+        await message.answer(
+            f"📣 <b>Рассылка #{broadcast_id}</b>\n\n"
+            f"Получателей: {broadcast['total_recipients']}\n\n"
+            f"<b>Текст:</b>\n{broadcast['text']}\n\n"
+            f"<b>Запустить рассылку?</b>",
+            parse_mode="HTML",
+            reply_markup=create_confirmation_keyboard(
+                yes_callback=f"broadcast_start_{broadcast_id}",
+                no_callback=f"broadcast_drop_{broadcast_id}"
+            )
+        )
 
     except Exception as e:
-        logger.error(f"Ошибка отправки ответа: {e}")
+        logger.error(f"Ошибка создания рассылки: {e}")
         await message.answer(f"❌ Ошибка: {str(e)[:200]}")
 
 
+@router.callback_query(F.data.startswith("broadcast_start_"))
+async def handle_broadcast_start(callback: types.CallbackQuery):
+    """Подтверждение запуска рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    broadcast_id = int(callback.data.replace("broadcast_start_", ""))
+    if broadcast_manager.start(broadcast_id, callback.from_user.id):
+        await callback.message.edit_text(f"🚀 Рассылка #{broadcast_id} запущена")
+        await callback.answer()
+    else:
+        await callback.answer("❌ Рассылку нельзя запустить", show_alert=True)
+
+
+@router.callback_query(F.data.startswith("broadcast_drop_"))
+async def handle_broadcast_drop(callback: types.CallbackQuery):
+    """Отказ от запуска рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("⛔️ Доступ запрещен")
+        return
+
+    broadcast_id = int(callback.data.replace("broadcast_drop_", ""))
+    broadcast = db.get_broadcast(broadcast_id)
+    if not broadcast or broadcast['status'] != 'draft':
+        await callback.answer("❌ Рассылка уже запущена или завершена", show_alert=True)
+        return
+
+    db.finish_broadcast(broadcast_id, 'cancelled')
+    await callback.message.edit_text(f"❌ Рассылка #{broadcast_id} отменена")
+    await callback.answer()
+
+
+@router.message(Command("broadcast_status"))
+async def cmd_broadcast_status(message: Message):
+    """Прогресс текущей рассылки"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    if not broadcast_manager.is_running:
+        await message.answer("📭 Сейчас рассылок нет")
+        return
+
+    broadcast = db.get_broadcast(broadcast_manager.current_id)
+    done = broadcast['sent_count'] + broadcast['failed_count'] + broadcast['blocked_count']
+    await message.answer(
+        f"📣 <b>Рассылка #{broadcast['id']}</b>\n\n"
+        f"• Обработано: {done}/{broadcast['total_recipients']}\n"
+        f"• Доставлено: {broadcast['sent_count']}\n"
+        f"• Заблокировали бота: {broadcast['blocked_count']}\n"
+        f"• Ошибок: {broadcast['failed_count']}",
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("broadcast_cancel"))
+async def cmd_broadcast_cancel(message: Message):
+    """Отмена текущей рассылки"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    if broadcast_manager.cancel():
+        await message.answer(f"🛑 Рассылка #{broadcast_manager.current_id} будет остановлена после текущей пачки")
+    else:
+        await message.answer("📭 Сейчас рассылок нет")
+
+
+@router.message(Command("broadcast_resume"))
+async def cmd_broadcast_resume(message: Message):
+    """Продолжение приостановленной рассылки"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔️ Доступ запрещен")
+        return
+
+    try:
+        args = message.text.split()
+        if len(args) < 2:
+            await message.answer("❌ Укажите номер рассылки: <code>/broadcast_resume [id]</code>", parse_mode="HTML")
+            return
+
+        broadcast_id = int(args[1])
+        if broadcast_manager.start(broadcast_id, message.from_user.id):
+            await message.answer(f"▶️ Рассылка #{broadcast_id} продолжена")
+        else:
+            await message.answer("❌ Рассылку нельзя продолжить (уже идет другая или она завершена)")
+
+    except ValueError:
+        await message.answer("❌ Неверный номер рассылки")
+
+
 # ========== ГЛАВНОЕ МЕНЮ ==========
 
 @router.message(F.text == "🏠 Главное меню")
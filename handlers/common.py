@@ -3,6 +3,7 @@ import logging
 from datetime import datetime
 
 from aiogram import Router, types, F
+from aiogram.enums import ChatMemberStatus
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
@@ -18,6 +19,8 @@ from handlers.admin import is_admin
 logger = logging.getLogger(__name__)
 
 router = Router()
+# Обработчики "всего подряд" (неизвестные команды, любой текст) - регистрируются последними
+fallback_router = Router()
 
 
 # ========== КОМАНДА HELP ==========
@@ -81,7 +84,7 @@ async def cmd_cancel(message: Message, state: FSMContext):
 
 
 # ========== КОМАНДА MY_ORDERS ==========
-@router.message(Command("my_orders"))
+@router.message(Command("my_orders"), flags={"throttling_key": "orders_lookup"})
 async def cmd_my_orders(message: Message):
     """Показать заказы пользователя через команду"""
     try:
@@ -146,7 +149,7 @@ async def cmd_my_orders(message: Message):
 
 
 # ========== КОМАНДА STATUS ==========
-@router.message(Command("status"))
+@router.message(Command("status"), flags={"throttling_key": "orders_lookup"})
 async def cmd_status(message: Message, command: CommandObject):
     """Проверить статус конкретного заказа"""
     try:
@@ -342,8 +345,24 @@ async def cmd_feedback(message: Message, command: CommandObject):
     logger.info(f"Получен отзыв от {message.from_user.id}: {feedback_text}")
 
 
+# ========== БЛОКИРОВКА БОТА ==========
+@router.my_chat_member(F.chat.type == "private")
+async def handle_bot_blocked_status(event: types.ChatMemberUpdated):
+    """
+    Пользователь заблокировал или разблокировал бота. Написать боту, не
+    разблокировав его, нельзя, поэтому разблокировка - первое действие
+    вернувшегося пользователя: с этого момента он снова получает рассылки
+    """
+    status = event.new_chat_member.status
+    if status == ChatMemberStatus.KICKED:
+        db.mark_users_blocked([event.from_user.id])
+    elif status == ChatMemberStatus.MEMBER:
+        if db.unblock_user(event.from_user.id):
+            logger.info(f"Пользователь {event.from_user.id} разблокировал бота")
+
+
 # ========== ОБРАБОТКА НЕИЗВЕСТНЫХ КОМАНД ==========
-@router.message(F.text.startswith('/'))
+@fallback_router.message(F.text.startswith('/'))
 async def handle_unknown_command(message: Message):
     """Обработка неизвестных команд"""
     unknown_cmd = message.text.split()[0]
@@ -356,7 +375,7 @@ async def handle_unknown_command(message: Message):
 
 
 # ========== ОБРАБОТКА ЛЮБЫХ ТЕКСТОВЫХ СООБЩЕНИЙ ==========
-@router.message(F.text)
+@fallback_router.message(F.text, flags={"throttling_key": "text"})
 async def handle_any_text(message: Message, state: FSMContext):
     """Обработка любых текстовых сообщений (не команд)"""
     current_state = await state.get_state()
@@ -0,0 +1,27 @@
+# handlers/filters.py
+from typing import Any, Callable, Dict, Union
+
+from aiogram.types import Message
+
+from database import db
+from models.enums import MessageLinkKind
+
+
+def replied_to(*kinds: MessageLinkKind) -> Callable[[Message], Union[bool, Dict[str, Any]]]:
+    """
+    Фильтр: сообщение - ответ (reply) на сообщение бота, привязанное к
+    заказу через message_links. Обработчик получает linked_order =
+    (order_id, clarification_id, kind).
+    """
+    allowed = {kind.value for kind in kinds}
+
+    def check(message: Message) -> Union[bool, Dict[str, Any]]:
+        reply = message.reply_to_message
+        if reply is None or reply.from_user is None or not reply.from_user.is_bot:
+            return False
+        link = db.resolve_message_link(message.chat.id, reply.message_id)
+        if link is None or link[2] not in allowed:
+            return False
+        return {'linked_order': link}
+
+    return check
@@ -15,7 +15,11 @@ from aiogram.types import (
 from utils.config import config
 from utils.keyboards import create_docs_questions_keyboard
 from database import db
-from models.enums import OrderStatus
+from models.enums import OrderStatus, MessagePriority, AdminEventType
+from utils.sender import message_sender
+from utils.notifier import admin_notifier
+from utils.templates import html_escape
+from utils.invoices import invoice_validator, INVOICE_CURRENCY
 # Уберите определение OrderState из этого файла и импортируйте из states.py
 from handlers.states import OrderState
 # Измененный импорт
@@ -27,23 +31,13 @@ logger = logging.getLogger(__name__)
 router = Router()
 
 
-def html_escape(text: str) -> str:
-    """Экранирование HTML-символов"""
-    if not text:
-        return ""
-    return (text.replace('&', '&amp;')
-            .replace('<', '&lt;')
-            .replace('>', '&gt;')
-            .replace('"', '&quot;'))
-
-
 async def send_invoice_to_user(user_id: int, order_id: int, price: int = 490,
                                service_type: str = "", bot: Bot = None):
     """Отправка счета на оплату с поддержкой тестового режима"""
 
     # Тестовый режим платежей
     if getattr(config, 'PAYMENT_TEST_MODE', False):
-        logger.info(f"📱 ТЕСТОВЫЙ РЕЖИМ: Заказ #{order_id}, услуга: {service_type}, цена: {price}₽")
+        logger.info("📱 ТЕСТОВЫЙ РЕЖИМ: Заказ #%s, услуга: %s, цена: %s₽", order_id, service_type, price)
 
         # Создаем invoice_payload для теста
         invoice_payload = f"test_order_{order_id}"
@@ -54,7 +48,7 @@ async def send_invoice_to_user(user_id: int, order_id: int, price: int = 490,
         # Имитируем успешный платеж
         await asyncio.sleep(1)
 
-        success, processed_order_id = db.process_payment(
+        success, processed_order_id, _ = db.process_payment(
             invoice_payload=invoice_payload,
             provider_payment_id=f"test_payment_{order_id}",
             amount=getattr(config, 'TEST_PAYMENT_PRICE', 1) * 100
@@ -75,16 +69,19 @@ async def send_invoice_to_user(user_id: int, order_id: int, price: int = 490,
 
         # Сохраняем invoice_payload в БД
         db.set_invoice_payload(order_id, invoice_payload)
+        invoice_validator.remember(invoice_payload, order_id, user_id, price)
 
         prices = [LabeledPrice(label=f"Расшифровка: {service_type}", amount=price * 100)]
 
-        await bot.send_invoice(
-            chat_id=user_id,
+        await message_sender.call(
+            'send_invoice',
+            user_id,
+            priority=MessagePriority.PAYMENT,
             title=f"Оплата заказа #{order_id}",
             description=f"Расшифровка медицинских документов: {service_type}",
             payload=invoice_payload,
             provider_token=provider_token,
-            currency="RUB",
+            currency=INVOICE_CURRENCY,
             prices=prices,
             start_parameter="razmed_order",
             need_name=False,
@@ -96,7 +93,7 @@ async def send_invoice_to_user(user_id: int, order_id: int, price: int = 490,
             protect_content=False
         )
 
-        logger.info(f"Счет отправлен для заказа #{order_id} (услуга: {service_type}, цена: {price}₽)")
+        logger.info("Счет отправлен для заказа #%s (услуга: %s, цена: %s₽)", order_id, service_type, price)
         return True, order_id
 
     except Exception as e:
@@ -108,16 +105,23 @@ async def send_invoice_to_user(user_id: int, order_id: int, price: int = 490,
 @router.pre_checkout_query()
 async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery, bot: Bot):
     """Обработка предварительного запроса на оплату"""
-    # Можно добавить дополнительную проверку здесь
-    # Например, проверить существует ли заказ, корректна ли сумма и т.д.
-
+    # Telegram ждет ответа не дольше 10 секунд, поэтому ответ уходит напрямую,
+    # минуя очередь message_sender, а заказ проверяется по кэшу счетов или индексу
     try:
-        # Простая проверка - всегда подтверждаем
+        error_message = invoice_validator.check(
+            pre_checkout_query.invoice_payload,
+            pre_checkout_query.from_user.id,
+            pre_checkout_query.total_amount,
+            pre_checkout_query.currency
+        )
         await bot.answer_pre_checkout_query(
             pre_checkout_query_id=pre_checkout_query.id,
-            ok=True
+            ok=error_message is None,
+            error_message=error_message
         )
-        logger.info(f"Предварительный запрос на оплату подтвержден: {pre_checkout_query.id}")
+        if error_message is None:
+            logger.info("Предварительный запрос на оплату подтвержден: %s", pre_checkout_query.id,
+                        extra={'sampled': True})
     except Exception as e:
         logger.error(f"Ошибка обработки предварительного запроса: {e}")
         await bot.answer_pre_checkout_query(
@@ -128,7 +132,7 @@ async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery, bot:
 
 
 # ========== ОБРАБОТКА УСПЕШНОЙ ОПЛАТЫ ==========
-@router.message(F.content_type == "successful_payment")
+@router.message(F.content_type == "successful_payment", flags={"throttling": False})
 async def process_successful_payment(message: Message, state: FSMContext, bot: Bot):
     """Обработка успешного платежа"""
     # В тестовом режиме этот обработчик не должен срабатывать
@@ -138,14 +142,18 @@ async def process_successful_payment(message: Message, state: FSMContext, bot: B
 
     payment = message.successful_payment
 
-    logger.info(f"Получен успешный платеж: {payment.invoice_payload}, сумма: {payment.total_amount}")
+    logger.info("Получен успешный платеж: %s, сумма: %s", payment.invoice_payload, payment.total_amount)
 
-    success, order_id = db.process_payment(
+    success, order_id, duplicate = db.process_payment(
         invoice_payload=payment.invoice_payload,
         provider_payment_id=payment.provider_payment_charge_id,
         amount=payment.total_amount
     )
 
+    if duplicate:
+        # Повторная доставка уже зачтенного платежа: оформление заказа уже продолжено
+        return
+
     if success and order_id:
         # Получаем данные о заказе
         order = db.get_order_by_id(order_id)
@@ -230,25 +238,29 @@ async def process_successful_payment(message: Message, state: FSMContext, bot: B
                 reply_markup=create_docs_questions_keyboard()
             )
 
-        # Уведомляем админа
-        try:
-            admin_id = getattr(config, 'ADMIN_ID', None)
-            if admin_id:
-                await bot.send_message(
-                    admin_id,
-                    f"💰 <b>ПЛАТЕЖ ПРИНЯТ!</b>\n\n"
-                    f"<b>Заказ:</b> #{order_id}\n"
-                    f"<b>От:</b> @{message.from_user.username or 'без username'}\n"
-                    f"<b>Услуга:</b> {service_type}\n"
-                    f"<b>Сумма:</b> {price}₽\n"
-                    f"<b>Статус:</b> ожидает деталей\n"
-                    f"<b>Время:</b> {datetime.now().strftime('%H:%M:%S')}",
-                    parse_mode="HTML"
-                )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления админа: {e}")
-
-        logger.info(f"Платеж успешно обработан для заказа #{order_id}")
+        # Уведомляем админа (попадет в ближайшую сводку)
+        admin_notifier.notify(
+            AdminEventType.PAYMENT,
+            f"#{order_id} {html_escape(service_type)} - {price}₽ "
+            f"от @{html_escape(message.from_user.username or 'без username')}"
+        )
+
+        logger.info("Платеж успешно обработан для заказа #%s", order_id)
+    elif order_id:
+        # Заказ успел отмениться по истечении срока счета - платеж записан к возврату
+        support = html_escape(getattr(config, 'SUPPORT_CHANNEL', '@support'))
+        await message.answer(
+            f"⚠️ <b>Заказ #{order_id} был отменен до оплаты</b>\n"
+            f"Срок счета истек, поэтому платеж будет возвращен. "
+            f"Оформите заказ заново или свяжитесь с поддержкой: {support}",
+            parse_mode="HTML"
+        )
+        admin_notifier.notify(
+            AdminEventType.ERROR,
+            f"Оплачен отмененный заказ #{order_id}: платеж {html_escape(payment.provider_payment_charge_id)} "
+            f"от пользователя {message.from_user.id} на сумму {payment.total_amount / 100}₽ требует возврата",
+            critical=True
+        )
     else:
         await message.answer(
             f"⚠️ <b>Ошибка обработки платежа</b>\n"
@@ -256,10 +268,16 @@ async def process_successful_payment(message: Message, state: FSMContext, bot: B
             parse_mode="HTML"
         )
         logger.error(f"Не удалось обработать платеж: {payment.invoice_payload}")
+        admin_notifier.notify(
+            AdminEventType.ERROR,
+            f"Не удалось обработать платеж {html_escape(payment.invoice_payload)} "
+            f"от пользователя {message.from_user.id} на сумму {payment.total_amount / 100}₽",
+            critical=True
+        )
 
 
 # ========== ОБРАБОТКА ОШИБОК ОПЛАТЫ ==========
-@router.message(F.content_type == "unsuccessful_payment")
+@router.message(F.content_type == "unsuccessful_payment", flags={"throttling": False})
 async def process_unsuccessful_payment(message: Message):
     """Обработка неуспешного платежа"""
     await message.answer(
@@ -268,7 +286,7 @@ async def process_unsuccessful_payment(message: Message):
         f"{html_escape(getattr(config, 'SUPPORT_CHANNEL', '@support'))}",
         parse_mode="HTML"
     )
-    logger.warning(f"Неуспешный платеж от пользователя {message.from_user.id}")
+    logger.warning("Неуспешный платеж от пользователя %s", message.from_user.id)
 
 
 # ========== ПРОВЕРКА СТАТУСА ПЛАТЕЖА ==========
@@ -23,15 +23,20 @@ from utils.keyboards import (
     create_service_keyboard,
     create_promo_keyboard,
     create_demographics_keyboard,
-    create_docs_questions_keyboard,
-    get_service_prices
+    create_docs_questions_keyboard
 )
 from utils.agreement import AgreementHandler
 from utils.validators import DocumentValidator
-from models.enums import OrderStatus, DocumentType, DiscountType
+from utils.bot_identity import bot_identity
+from utils.catalog import get_catalog
+from utils.templates import templates, html_escape, Safe
+from models.enums import OrderStatus, DocumentType, DiscountType, MessageLinkKind, MessagePriority
+from utils.sender import message_sender
+from utils.operators import operator_registry
 from handlers.payment import send_invoice_to_user
 # Уберите определение OrderState из этого файла и импортируйте из states.py
 from handlers.states import OrderState
+from handlers.filters import replied_to
 
 import logging
 
@@ -44,16 +49,6 @@ router = Router()
 
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
-def html_escape(text: str) -> str:
-    """Экранирование HTML-символов"""
-    if not text:
-        return ""
-    return (text.replace('&', '&amp;')
-            .replace('<', '&lt;')
-            .replace('>', '&gt;')
-            .replace('"', '&quot;'))
-
-
 def get_progress_bar(step: int, total_steps: int = 5) -> str:
     """Создает визуальный прогресс-бар"""
     filled = '█' * step
@@ -66,6 +61,103 @@ def bold(text: str) -> str:
     return f"<b>{html_escape(text)}</b>"
 
 
+# ========== ШАБЛОНЫ СООБЩЕНИЙ ==========
+# Компилируются при импорте, статические тексты рендерятся один раз
+
+WELCOME_TEMPLATE = templates.register("welcome", """👨‍⚕️ <b>Добро пожаловать в медицинский сервис расшифровки анализов RazMedBot</b>
+
+🏥 <b>Профессиональная помощь в понимании ваших медицинских документов</b>
+
+✨ <b>Наш подход к расшифровке:</b>
+
+🤖 <b>Искусственный интеллект</b>
+• Мгновенный анализ медицинских данных
+• Сравнение с возрастными и половными нормами
+• Выявление ключевых показателей
+
+👨‍⚕️ <b>Проверка медицинским специалистом</b>
+• Экспертная оценка результатов
+• Учет индивидуальных особенностей
+• Рекомендации по дальнейшим действиям
+
+<b>Выберите действие из меню ниже ⤵️</b>""")
+
+HELP_TEMPLATE = templates.register("help", """<b>🆘 СПРАВКА ПО КОМАНДАМ</b>
+
+<b>Основные команды:</b>
+/start - Начать работу с ботом
+/help - Показать эту справку
+/cancel - Отменить текущее действие
+
+<b>Действия:</b>
+• 🩺 Создать заказ - Оформить новый заказ
+• 📋 Мои заказы - Посмотреть историю заказов
+• 👨‍⚕️ О сервисе - Информация о сервисе
+• 👨‍💻 Связаться - Связаться с поддержкой
+• 👥 Пригласить друга - Реферальная программа
+
+<b>Для администраторов:</b>
+• 📊 Статистика - Статистика сервиса
+• 📋 Все заказы - Все заказы системы
+• ⏳ Ожидающие - Ожидающие обработки заказы
+• 🎫 Промокоды - Управление промокодами
+• 👥 Рефералы - Статистика по рефералам
+• 📝 Шаблоны - Быстрые шаблоны ответов""")
+
+ABOUT_TEMPLATE = templates.register("about", """<b>👨‍⚕️ О СЕРВИСЕ RAZMEDBOT</b>
+
+🏥 <b>Миссия:</b> Сделать медицинскую информацию доступной и понятной для каждого.
+
+✨ <b>Что мы делаем:</b>
+• Расшифровываем медицинские анализы и исследования
+• Объясняем врачебные заключения простым языком
+• Помогаем понять диагнозы и назначения
+• Консультируем по медицинским документам
+
+🔬 <b>Наша методология:</b>
+1. <b>AI-анализ:</b> Искусственный интеллект обрабатывает ваши документы
+2. <b>Экспертная проверка:</b> Медицинский специалист проверяет результаты
+3. <b>Детальная расшифровка:</b> Вы получаете понятное объяснение
+
+⏱️ <b>Сроки:</b> До 24 часов
+💎 <b>Стоимость:</b> От 190₽ за расшифровку
+✅ <b>Гарантии:</b> Конфиденциальность и точность
+
+<b>📞 Контакты:</b>
+Поддержка: @razmed_support
+Для сотрудничества: @razmed_admin
+
+<b>Мы делаем медицину понятной!</b>""")
+
+# Категории и диапазоны цен - из снимка прайс-листа, как и кнопки услуг
+ORDER_STEP_SERVICE_TEMPLATE = templates.register("order_step_service", """<b>🩺 ШАГ 1 из 5: ВЫБОР УСЛУГИ</b>
+
+{progress}
+
+<b>Выберите тип медицинских документов для расшифровки:</b>
+
+{category_info}
+
+<b>Выберите услугу из списка ниже:</b>""", progress=get_progress_bar(1))
+
+ORDER_STEP_PROMO_TEMPLATE = templates.register("order_step_promo", """<b>💎 ШАГ 2 из 5: ПРОМОКОД</b>
+
+{progress}
+
+✅ <b>Услуга выбрана:</b> {service}
+💰 <b>Стоимость:</b> {original_price}₽
+{discount_text}
+💰 <b>Итоговая цена:</b> <code>{final_price}₽</code>
+
+──────────────────────────────
+<b>Есть промокод?</b>
+
+Если у вас есть промокод на скидку, введите его сейчас.
+Или нажмите "⏭️ Пропустить" для продолжения.
+
+<b>Введите промокод:</b>""", progress=get_progress_bar(2))
+
+
 # В handlers/user.py добавьте обработчики:
 @router.callback_query(F.data == "agreement_accept")
 async def handle_agreement_accept(callback: types.CallbackQuery, state: FSMContext):
@@ -195,23 +287,7 @@ async def cmd_start(message: Message, state: FSMContext):
         except (ValueError, IndexError):
             pass
 
-    welcome_text = f"""👨‍⚕️ <b>Добро пожаловать в медицинский сервис расшифровки анализов RazMedBot</b>
-
-🏥 <b>Профессиональная помощь в понимании ваших медицинских документов</b>
-
-✨ <b>Наш подход к расшифровке:</b>
-
-🤖 <b>Искусственный интеллект</b>
-• Мгновенный анализ медицинских данных
-• Сравнение с возрастными и половными нормами
-• Выявление ключевых показателей
-
-👨‍⚕️ <b>Проверка медицинским специалистом</b>
-• Экспертная оценка результатов
-• Учет индивидуальных особенностей
-• Рекомендации по дальнейшим действиям
-
-<b>Выберите действие из меню ниже ⤵️</b>"""
+    welcome_text = WELCOME_TEMPLATE.render()
 
     if message.from_user.id == config.ADMIN_ID:
         # Импорт внутри функции, чтобы избежать циклической зависимости
@@ -227,27 +303,7 @@ async def cmd_start(message: Message, state: FSMContext):
 @router.message(Command("help"))
 async def cmd_help(message: Message):
     """Показать справку по командам"""
-    help_text = """<b>🆘 СПРАВКА ПО КОМАНДАМ</b>
-
-<b>Основные команды:</b>
-/start - Начать работу с ботом
-/help - Показать эту справку
-/cancel - Отменить текущее действие
-
-<b>Действия:</b>
-• 🩺 Создать заказ - Оформить новый заказ
-• 📋 Мои заказы - Посмотреть историю заказов
-• 👨‍⚕️ О сервисе - Информация о сервисе
-• 👨‍💻 Связаться - Связаться с поддержкой
-• 👥 Пригласить друга - Реферальная программа
-
-<b>Для администраторов:</b>
-• 📊 Статистика - Статистика сервиса
-• 📋 Все заказы - Все заказы системы
-• ⏳ Ожидающие - Ожидающие обработки заказы
-• 🎫 Промокоды - Управление промокодами
-• 👥 Рефералы - Статистика по рефералам
-• 📝 Шаблоны - Быстрые шаблоны ответов"""
+    help_text = HELP_TEMPLATE.render()
 
     await message.answer(help_text, parse_mode="HTML")
 
@@ -279,7 +335,7 @@ async def cmd_cancel(message: Message, state: FSMContext):
 
 
 # ========== СОЗДАНИЕ ЗАКАЗА ==========
-@router.message(F.text == "🩺 Создать заказ")
+@router.message(F.text == "🩺 Создать заказ", flags={"throttling_key": "order"})
 async def start_order_new_flow(message: Message, state: FSMContext):
     """Начало создания заказа"""
     # Проверяем, принимал ли пользователь уже соглашение
@@ -295,38 +351,9 @@ async def start_order_new_flow(message: Message, state: FSMContext):
     await state.clear()
     await state.set_state(OrderState.waiting_for_service)
 
-    instruction_text = f"""<b>🩺 ШАГ 1 из 5: ВЫБОР УСЛУГИ</b>
-
-{get_progress_bar(1)}
-
-<b>Выберите тип медицинских документов для расшифровки:</b>
+    keyboard, category_info = create_service_keyboard()
+    instruction_text = ORDER_STEP_SERVICE_TEMPLATE.render(category_info=Safe(category_info))
 
-<code>──────────────────────────────</code>
-<b>📋 АНАЛИЗЫ (нужен возраст/пол)</b>
-<code>──────────────────────────────</code>
-• Анализы крови и мочи
-• Биохимия, гормоны
-• Коагулограммы
-<code>💎 190-290₽</code>
-
-<code>──────────────────────────────</code>
-<b>🏥 ИССЛЕДОВАНИЯ</b>
-<code>──────────────────────────────</code>
-• УЗИ, МРТ, КТ, рентген
-• ЭКГ, Холтер
-<code>💎 190-390₽</code>
-
-<code>──────────────────────────────</code>
-<b>📄 ДОКУМЕНТАЦИЯ</b>
-<code>──────────────────────────────</code>
-• Врачебные заключения
-• Выписки, назначения
-• Протоколы операций
-<code>💎 190₽</code>
-
-<b>Выберите услугу из списка ниже:</b>"""
-
-    keyboard, _ = create_service_keyboard()
     await message.answer(
         instruction_text,
         parse_mode="HTML",
@@ -363,18 +390,16 @@ async def cancel_order(message: Message, state: FSMContext):
 @router.message(F.text == "👥 Пригласить друга")
 async def show_referral_info(message: Message, bot: Bot):
     """Показать информацию о реферальной программе"""
+    # Один снимок настроек на весь ответ: проценты не разойдутся при перезагрузке конфигурации
+    cfg = config.snapshot()
     try:
         # Получаем статистику
         stats = db.get_referrer_stats(message.from_user.id)
 
-        # Получаем username бота для ссылки
+        # Ссылка собирается из закэшированных данных бота
         try:
-            bot_info = await bot.get_me()
-            bot_username = bot_info.username
-            if not bot_username:
-                referral_link = f"https://t.me/{bot_info.id}?start=ref_{message.from_user.id}"
-            else:
-                referral_link = f"https://t.me/{bot_username}?start=ref_{message.from_user.id}"
+            await bot_identity.ensure_loaded(bot)
+            referral_link = bot_identity.referral_link(message.from_user.id)
         except Exception as e:
             logger.error(f"Ошибка получения username бота: {e}")
             referral_link = f"t.me/ваш_бот?start=ref_{message.from_user.id}"
@@ -385,8 +410,8 @@ async def show_referral_info(message: Message, bot: Bot):
 
 <b>Как это работает:</b>
 1. Вы приглашаете друга по своей ссылке
-2. Друг получает <b>скидку {config.REFERRED_DISCOUNT_PERCENT}%</b> на первый заказ
-3. Когда друг оплатит заказ, вы получаете <b>{config.REFERRER_BONUS_PERCENT}%</b> от суммы его заказа
+2. Друг получает <b>скидку {cfg.REFERRED_DISCOUNT_PERCENT}%</b> на первый заказ
+3. Когда друг оплатит заказ, вы получаете <b>{cfg.REFERRER_BONUS_PERCENT}%</b> от суммы его заказа
 
 <b>Ваша реферальная ссылка:</b>
 <code>{referral_link}</code>
@@ -407,8 +432,8 @@ async def show_referral_info(message: Message, bot: Bot):
             f"👥 <b>Пригласить друга</b>\n\n"
             f"Ваша реферальная ссылка:\n"
             f"<code>t.me/ваш_бот?start=ref_{message.from_user.id}</code>\n\n"
-            f"Приглашайте друзей и получайте {config.REFERRER_BONUS_PERCENT}% от их заказов!\n"
-            f"Друзья получают скидку {config.REFERRED_DISCOUNT_PERCENT}% на первый заказ.",
+            f"Приглашайте друзей и получайте {cfg.REFERRER_BONUS_PERCENT}% от их заказов!\n"
+            f"Друзья получают скидку {cfg.REFERRED_DISCOUNT_PERCENT}% на первый заказ.",
             parse_mode="HTML"
         )
 
@@ -421,20 +446,10 @@ async def handle_service_selection(message: Message, state: FSMContext):
         await cancel_order(message, state)
         return
 
-    services = get_service_prices()
-    selected_service = None
-    service_info = None
-
-    # Ищем выбранную услугу (убираем цену из текста)
-    input_text = message.text
-    for service_name in services.keys():
-        # Проверяем, начинается ли текст с названия услуги
-        if input_text.startswith(service_name):
-            selected_service = service_name
-            service_info = services[service_name]
-            break
+    # Поиск услуги по тексту кнопки - O(1) по индексу прайс-листа
+    service = get_catalog().lookup(message.text)
 
-    if not selected_service:
+    if service is None:
         # Если не нашли услугу, показываем меню снова
         await message.answer(
             "❌ <b>Пожалуйста, выберите услугу с помощью кнопок ниже</b>\n\n"
@@ -445,21 +460,14 @@ async def handle_service_selection(message: Message, state: FSMContext):
         # Показываем инструкцию и клавиатуру
         keyboard, category_info = create_service_keyboard()
 
-        instruction_text = f"""<b>🩺 ШАГ 1 из 5: ВЫБОР УСЛУГИ</b>
-
-{get_progress_bar(1)}
-
-<b>Выберите тип медицинских документов для расшифровки:</b>
-
-{category_info}
-
-<b>Выберите услугу из списка ниже:</b>"""
+        instruction_text = ORDER_STEP_SERVICE_TEMPLATE.render(category_info=Safe(category_info))
 
         await message.answer(instruction_text, parse_mode="HTML", reply_markup=keyboard)
         return
 
-    original_price = service_info["price"]
-    needs_demographics = service_info["needs_demographics"]
+    selected_service = service.name
+    original_price = service.price
+    needs_demographics = service.needs_demographics
 
     # Проверяем реферальную скидку
     has_referral_discount, discount_percent = db.check_referral_discount(message.from_user.id)
@@ -483,22 +491,12 @@ async def handle_service_selection(message: Message, state: FSMContext):
 
     await state.set_state(OrderState.waiting_for_promo)
 
-    instruction_text = f"""<b>💎 ШАГ 2 из 5: ПРОМОКОД</b>
-
-{get_progress_bar(2)}
-
-✅ <b>Услуга выбрана:</b> {selected_service}
-💰 <b>Стоимость:</b> {original_price}₽
-{discount_text}
-💰 <b>Итоговая цена:</b> <code>{int(final_price)}₽</code>
-
-──────────────────────────────
-<b>Есть промокод?</b>
-
-Если у вас есть промокод на скидку, введите его сейчас.
-Или нажмите "⏭️ Пропустить" для продолжения.
-
-<b>Введите промокод:</b>"""
+    instruction_text = ORDER_STEP_PROMO_TEMPLATE.render(
+        service=selected_service,
+        original_price=original_price,
+        discount_text=Safe(discount_text),
+        final_price=int(final_price)
+    )
 
     await message.answer(
         instruction_text,
@@ -507,7 +505,7 @@ async def handle_service_selection(message: Message, state: FSMContext):
     )
 
 
-@router.message(OrderState.waiting_for_docs_and_questions, F.photo)
+@router.message(OrderState.waiting_for_docs_and_questions, F.photo, flags={"throttling": False})
 async def handle_document_photo(message: Message, state: FSMContext):
     """Обработка фото документов с валидацией"""
     # Валидация
@@ -524,36 +522,48 @@ async def handle_document_photo(message: Message, state: FSMContext):
 @router.message(F.text == "👨‍⚕️ О сервисе")
 async def about_service(message: Message):
     """Информация о сервисе"""
-    about_text = """<b>👨‍⚕️ О СЕРВИСЕ RAZMEDBOT</b>
-
-🏥 <b>Миссия:</b> Сделать медицинскую информацию доступной и понятной для каждого.
+    about_text = ABOUT_TEMPLATE.render()
 
-✨ <b>Что мы делаем:</b>
-• Расшифровываем медицинские анализы и исследования
-• Объясняем врачебные заключения простым языком
-• Помогаем понять диагнозы и назначения
-• Консультируем по медицинским документам
+    await message.answer(about_text, parse_mode="HTML")
 
-🔬 <b>Наша методология:</b>
-1. <b>AI-анализ:</b> Искусственный интеллект обрабатывает ваши документы
-2. <b>Экспертная проверка:</b> Медицинский специалист проверяет результаты
-3. <b>Детальная расшифровка:</b> Вы получаете понятное объяснение
 
-⏱️ <b>Сроки:</b> До 24 часов
-💎 <b>Стоимость:</b> От 190₽ за расшифровку
-✅ <b>Гарантии:</b> Конфиденциальность и точность
+# ========== УТОЧНЕНИЯ ПО ОТВЕТУ ==========
+@router.message(F.text, ~F.text.startswith("/"), replied_to(MessageLinkKind.ANSWER))
+async def handle_answer_reply(message: Message, linked_order: tuple):
+    """Ответ (reply) на ответ специалиста - уточняющий вопрос по заказу"""
+    order_id = linked_order[0]
+    allowed, reason = db.can_user_clarify(order_id, message.from_user.id)
+    if not allowed:
+        await message.answer(f"⚠️ {html_escape(reason)}", parse_mode="HTML")
+        return
 
-<b>📞 Контакты:</b>
-Поддержка: @razmed_support
-Для сотрудничества: @razmed_admin
+    clarification_id = db.add_clarification(order_id, message.from_user.id, message.text)
+    await message.answer(f"✅ Вопрос по заказу #{order_id} передан специалисту")
 
-<b>Мы делаем медицину понятной!</b>"""
+    # Вопрос - тому, кто держит заказ сейчас, иначе ответившему специалисту;
+    # если никого из них уже нет среди операторов - главному администратору
+    claimed_by, answered_by = db.get_order_operators(order_id)
+    recipient = next((operator_id for operator_id in (claimed_by, answered_by)
+                      if operator_id is not None and operator_registry.is_operator(operator_id)),
+                     config.ADMIN_ID)
 
-    await message.answer(about_text, parse_mode="HTML")
+    try:
+        sent = await message_sender.send_message(
+            recipient,
+            f"<b>❓ Уточнение по заказу #{order_id}</b> "
+            f"от @{html_escape(message.from_user.username or 'без username')}\n\n"
+            f"{html_escape(message.text)}\n\n"
+            f"<i>Ответьте на это сообщение, чтобы отправить ответ клиенту</i>",
+            priority=MessagePriority.ANSWER,
+            parse_mode="HTML"
+        )
+        db.link_message(sent.chat.id, sent.message_id, order_id, MessageLinkKind.QUESTION, clarification_id)
+    except Exception as e:
+        logger.error(f"Не удалось переслать уточнение по заказу #{order_id}: {e}")
 
 
 # ========== МОИ ЗАКАЗЫ ==========
-@router.message(F.text == "📋 Мои заказы")
+@router.message(F.text == "📋 Мои заказы", flags={"throttling_key": "orders_lookup"})
 async def show_my_orders(message: Message):
     """Показать заказы пользователя"""
     try:
@@ -0,0 +1,10 @@
+# middlewares/__init__.py
+from .ordering import UserOrderingMiddleware
+from .metrics import HandlerMetricsMiddleware
+from .throttling import ThrottlingMiddleware
+
+__all__ = [
+    'UserOrderingMiddleware',
+    'HandlerMetricsMiddleware',
+    'ThrottlingMiddleware'
+]
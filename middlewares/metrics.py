@@ -0,0 +1,50 @@
+# middlewares/metrics.py
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from utils.metrics import MetricsRegistry, start_db_timer, stop_db_timer
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Учет времени работы обработчиков.
+
+    Регистрируется как inner-middleware (обработчик уже выбран), поэтому
+    метрики собираются по конкретному обработчику: модуль.функция.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._names: Dict[Any, str] = {}
+
+    def _handler_name(self, data: Dict[str, Any]) -> str:
+        handler = data.get('handler')
+        callback = getattr(handler, 'callback', None)
+        name = self._names.get(callback)
+        if name is None:
+            module = getattr(callback, '__module__', '') or ''
+            name = f"{module.rsplit('.', 1)[-1]}.{getattr(callback, '__name__', 'unknown')}"
+            self._names[callback] = name
+        return name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        db_time, token = start_db_timer()
+        started_at = time.perf_counter()
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started_at
+            stop_db_timer(token)
+            self.registry.observe_handler(self._handler_name(data), elapsed, db_time[0], error)
@@ -0,0 +1,138 @@
+# middlewares/ordering.py
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+logger = logging.getLogger(__name__)
+
+
+class _UserSlot:
+    """Очередь обновлений одного пользователя"""
+
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class UserOrderingMiddleware(BaseMiddleware):
+    """
+    Последовательная обработка обновлений одного пользователя
+    и параллельная обработка разных пользователей.
+
+    Регистрируется как outer-middleware на dp.update: обновления одного
+    from_user.id выполняются строго по очереди (FSM-шаги зависят от порядка),
+    разные пользователи работают параллельно под общим лимитом конкурентности.
+    """
+
+    def __init__(self, max_concurrency: int = 32, max_queue_per_user: int = 10):
+        self.max_concurrency = max_concurrency
+        self.max_queue_per_user = max_queue_per_user
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._slots: Dict[int, _UserSlot] = {}
+
+        # Метрики
+        self.in_flight = 0
+        self.queued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_queue_depth = 0
+        self.wait_samples = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.rejected = 0
+
+        # False - бот останавливается, новые обновления не принимаются
+        self.accepting = True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.accepting:
+            self.rejected += 1
+            return None
+
+        user: Optional[User] = data.get('event_from_user')
+        if user is None:
+            # Обновления без пользователя (например, изменения каналов) - только общий лимит
+            async with self._semaphore:
+                return await self._run(handler, event, data)
+
+        slot = self._slots.get(user.id)
+        if slot is None:
+            slot = self._slots[user.id] = _UserSlot()
+
+        if slot.pending >= self.max_queue_per_user:
+            self.dropped += 1
+            logger.warning("Очередь пользователя %s переполнена (%s), обновление отброшено", user.id, slot.pending)
+            return None
+
+        slot.pending += 1
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, slot.pending)
+        enqueued_at = time.monotonic()
+        started = False
+
+        try:
+            async with slot.lock:
+                async with self._semaphore:
+                    started = True
+                    waited = time.monotonic() - enqueued_at
+                    self.queued -= 1
+                    self.wait_samples += 1
+                    self.wait_time_total += waited
+                    self.wait_time_max = max(self.wait_time_max, waited)
+                    return await self._run(handler, event, data)
+        finally:
+            if not started:
+                # Отменено до начала обработки (например, при остановке)
+                self.queued -= 1
+            slot.pending -= 1
+            if slot.pending == 0 and self._slots.get(user.id) is slot:
+                del self._slots[user.id]
+
+    async def _run(self, handler, event, data) -> Any:
+        self.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+
+    def stop_accepting(self):
+        """Прекратить прием новых обновлений (при остановке бота)"""
+        self.accepting = False
+
+    @property
+    def busy(self) -> int:
+        """Обновления в обработке и в очередях"""
+        return self.in_flight + self.queued
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Дождаться завершения обработки (не дольше timeout). True - все завершено"""
+        deadline = time.monotonic() + timeout
+        while self.busy and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not self.busy
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики очередей: глубина и время ожидания"""
+        return {
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'active_users': len(self._slots),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'max_queue_depth': self.max_queue_depth,
+            'avg_wait_ms': (self.wait_time_total / self.wait_samples * 1000) if self.wait_samples else 0.0,
+            'max_wait_ms': self.wait_time_max * 1000,
+            'max_concurrency': self.max_concurrency,
+        }
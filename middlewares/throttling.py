@@ -0,0 +1,154 @@
+# middlewares/throttling.py
+import heapq
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+from utils.rate_limit import TokenBucket
+from utils.sender import message_sender
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Антифлуд: ограничение частоты запросов пользователя к обработчику.
+
+    Регистрируется как inner-middleware, бакет выбирается по паре
+    (пользователь, класс обработчика). Класс задается флагом обработчика
+    throttling_key (по умолчанию - имя функции), флаг throttling=False
+    отключает ограничение (платежи, загрузка документов).
+    Сверх лимита обновление отбрасывается: первый раз с ответом
+    "слишком часто" (если включено), дальше молча до восстановления лимита.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: float = 5,
+                 admin_rate: float = 10.0, admin_burst: float = 30,
+                 is_admin: Optional[Callable[[int], bool]] = None, warn: bool = True,
+                 max_buckets: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.admin_rate = admin_rate
+        self.admin_burst = admin_burst
+        # Проверка на каждый новый бакет: список операторов меняется на ходу
+        self.is_admin = is_admin or (lambda user_id: False)
+        self.warn = warn
+        self.max_buckets = max_buckets
+
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._warned: Set[Tuple[int, str]] = set()
+
+        # Метрики
+        self.allowed = 0
+        self.throttled = 0
+        self.warned = 0
+        self.throttled_by_user: Counter = Counter()
+        self.throttled_by_key: Counter = Counter()
+
+    def configure(self, rate: float = None, burst: float = None,
+                  admin_rate: float = None, admin_burst: float = None, warn: bool = None):
+        """
+        Изменить лимиты на ходу. Бакеты не пересоздаются: при смене лимитов
+        существующие получают новую скорость и объем с сохранением
+        накопленного (запуск без изменений ничего не трогает)
+        """
+        if warn is not None:
+            self.warn = warn
+        limits = (self.rate, self.burst, self.admin_rate, self.admin_burst)
+        if rate is not None:
+            self.rate = rate
+        if burst is not None:
+            self.burst = burst
+        if admin_rate is not None:
+            self.admin_rate = admin_rate
+        if admin_burst is not None:
+            self.admin_burst = admin_burst
+        if limits == (self.rate, self.burst, self.admin_rate, self.admin_burst):
+            return
+
+        for (user_id, _), bucket in self._buckets.items():
+            if self.is_admin(user_id):
+                bucket.set_rate(self.admin_rate, capacity=self.admin_burst)
+            else:
+                bucket.set_rate(self.rate, capacity=self.burst)
+
+    def _bucket(self, user_id: int, key: str) -> TokenBucket:
+        bucket = self._buckets.get((user_id, key))
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._sweep_idle_buckets()
+            if self.is_admin(user_id):
+                bucket = TokenBucket(self.admin_rate, capacity=self.admin_burst)
+            else:
+                bucket = TokenBucket(self.rate, capacity=self.burst)
+            self._buckets[(user_id, key)] = bucket
+        return bucket
+
+    def _sweep_idle_buckets(self):
+        """Удаляем бакеты, восстановившиеся до полного объема"""
+        for bucket_key in [bucket_key for bucket_key, bucket in self._buckets.items() if bucket.is_full]:
+            del self._buckets[bucket_key]
+            self._warned.discard(bucket_key)
+        if len(self.throttled_by_user) > self.max_buckets:
+            self.throttled_by_user = Counter(dict(self.throttled_by_user.most_common(self.max_buckets // 10)))
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user: Optional[User] = data.get('event_from_user')
+        if user is None or get_flag(data, 'throttling', default=True) is False:
+            return await handler(event, data)
+
+        key = get_flag(data, 'throttling_key')
+        if key is None:
+            key = getattr(getattr(data.get('handler'), 'callback', None), '__name__', 'default')
+
+        bucket_key = (user.id, key)
+        if self._bucket(user.id, key).try_acquire():
+            self.allowed += 1
+            self._warned.discard(bucket_key)
+            return await handler(event, data)
+
+        self.throttled += 1
+        self.throttled_by_user[user.id] += 1
+        self.throttled_by_key[key] += 1
+
+        if self.warn and bucket_key not in self._warned:
+            self._warned.add(bucket_key)
+            self.warned += 1
+            await self._warn(event)
+        return None
+
+    @staticmethod
+    async def _warn(event: TelegramObject):
+        text = "⏳ Слишком часто. Пожалуйста, подождите несколько секунд."
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif isinstance(event, Message):
+                # Через общий планировщик: предупреждения не расходуют лимит отправки сверх нормы
+                message_sender.send_message_nowait(event.chat.id, text)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить предупреждение о флуде: {e}")
+
+    def hot_users(self, limit: int = 10) -> List[Tuple[int, int]]:
+        """Пользователи с наибольшим числом отброшенных запросов"""
+        return heapq.nlargest(limit, self.throttled_by_user.items(), key=lambda item: item[1])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики ограничения частоты"""
+        return {
+            'allowed': self.allowed,
+            'throttled': self.throttled,
+            'warned': self.warned,
+            'buckets': len(self._buckets),
+            'hot_users': self.hot_users(),
+            'hot_keys': self.throttled_by_key.most_common(5),
+        }
@@ -9,5 +9,11 @@ __all__ = [
     'ServiceType',
     'UserRole',
     'ClarificationType',
-    'TaxStatus'
+    'TaxStatus',
+    'MessagePriority',
+    'AdminEventType',
+    'MessageLinkKind',
+    'ShutdownStage',
+    'OPEN_ORDER_STATUSES',
+    'WORK_ORDER_STATUSES'
 ]
\ No newline at end of file
@@ -1,5 +1,5 @@
 # models/enums.py
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class OrderStatus(str, Enum):
@@ -31,7 +31,9 @@ class PaymentStatus(str, Enum):
     SUCCESS = "success"
     FAILED = "failed"
     REFUNDED = "refunded"
+    REFUND_REQUIRED = "refund_required"  # оплачен уже отмененный заказ - деньги нужно вернуть
     CANCELLED = "cancelled"
+    DUPLICATE = "duplicate"  # повторная запись того же платежа провайдера (см. duplicate_of)
 
 
 class DiscountType(str, Enum):
@@ -71,6 +73,7 @@ class UserRole(str, Enum):
     USER = "user"
     ADMIN = "admin"
     MODERATOR = "moderator"
+    OPERATOR = "operator"
 
 
 class ClarificationType(str, Enum):
@@ -88,6 +91,15 @@ class TaxStatus(str, Enum):
     PENDING_REPORT = "pending_report"
 
 
+class MessagePriority(IntEnum):
+    """Приоритеты исходящих сообщений (меньше - раньше)"""
+    PAYMENT = 0
+    ANSWER = 1
+    NORMAL = 2
+    NOTIFICATION = 3
+    MARKETING = 4
+
+
 # Константы для удобства использования
 DEFAULT_PRICE = 490
 MAX_DOCUMENTS = 10
@@ -95,4 +107,36 @@ MAX_FILE_SIZE = 20 * 1024 * 1024  # 20 MB
 CLARIFICATION_TIME_LIMIT_HOURS = 24
 REFERRER_BONUS_PERCENT = 10
 REFERRED_DISCOUNT_PERCENT = 5
-AGREEMENT_VERSION = "2.1"
\ No newline at end of file
+AGREEMENT_VERSION = "2.1"
+
+# Заказы, которые еще ждут действий администратора
+OPEN_ORDER_STATUSES = (
+    OrderStatus.PENDING.value,
+    OrderStatus.PROCESSING.value,
+    OrderStatus.AWAITING_CLARIFICATION.value,
+    OrderStatus.NEEDS_NEW_DOCS.value,
+)
+
+# Заказы, которые оператор может взять в работу (оплаченные и открытые)
+WORK_ORDER_STATUSES = (OrderStatus.PAID.value,) + OPEN_ORDER_STATUSES
+
+class MessageLinkKind(str, Enum):
+    """Сообщения бота, привязанные к заказу (ответ на них адресуется заказу)"""
+    ANSWER = "answer"  # ответ специалиста у пользователя
+    ORDER = "order"  # карточка заказа у оператора
+    QUESTION = "question"  # уточняющий вопрос пользователя у оператора
+
+
+class AdminEventType(str, Enum):
+    """Типы событий для уведомлений администратора"""
+    PAYMENT = "payment"
+    ERROR = "error"
+    SYSTEM = "system"
+
+
+class ShutdownStage(IntEnum):
+    """Этапы остановки бота (выполняются по возрастанию)"""
+    STOP_INTAKE = 0   # прекратить прием новой работы
+    DRAIN = 1         # дождаться текущей обработки
+    FLUSH = 2         # отправить/сохранить накопленное
+    CLOSE = 3         # закрыть хранилища и соединения
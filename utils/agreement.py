@@ -2,18 +2,14 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import logging
 
-logger = logging.getLogger(__name__)
+from utils.templates import templates
 
+logger = logging.getLogger(__name__)
 
-class AgreementHandler:
-    """Класс для работы с пользовательским соглашением"""
+AGREEMENT_VERSION = "2.1"
 
-    AGREEMENT_VERSION = "2.1"
 
-    @staticmethod
-    def get_short_agreement() -> str:
-        """Получить краткую версию соглашения"""
-        return f"""<b>📜 ПОЛЬЗОВАТЕЛЬСКОЕ СОГЛАШЕНИЕ (версия {AgreementHandler.AGREEMENT_VERSION})</b>
+AGREEMENT_SHORT_TEMPLATE = templates.register("agreement_short", """<b>📜 ПОЛЬЗОВАТЕЛЬСКОЕ СОГЛАШЕНИЕ (версия {version})</b>
 
 <b>Перед началом использования сервиса прочтите соглашение:</b>
 
@@ -41,12 +37,10 @@ class AgreementHandler:
 
 <b>Полный текст соглашения доступен по ссылке: example.com/agreement</b>
 
-<b>Вы принимаете условия пользовательского соглашения?</b>"""
+<b>Вы принимаете условия пользовательского соглашения?</b>""", version=AGREEMENT_VERSION)
 
-    @staticmethod
-    def get_full_agreement() -> str:
-        """Получить полную версию соглашения"""
-        return f"""<b>📜 ПОЛНЫЙ ТЕКСТ ПОЛЬЗОВАТЕЛЬСКОГО СОГЛАШЕНИЯ (версия {AgreementHandler.AGREEMENT_VERSION})</b>
+
+AGREEMENT_FULL_TEMPLATE = templates.register("agreement_full", """<b>📜 ПОЛНЫЙ ТЕКСТ ПОЛЬЗОВАТЕЛЬСКОГО СОГЛАШЕНИЯ (версия {version})</b>
 
 <u>1. ОБЩИЕ ПОЛОЖЕНИЯ</u>
 1.1. Настоящее Пользовательское соглашение (далее – Соглашение) регулирует отношения между владельцем сервиса RazMedBot (далее – Сервис) и пользователем (далее – Пользователь) в связи с использованием Сервиса.
@@ -96,7 +90,23 @@ class AgreementHandler:
 
 <b>Контакты для вопросов:</b>
 Email: legal@razmed.ru
-Телеграм: @razmed_support"""
+Телеграм: @razmed_support""", version=AGREEMENT_VERSION)
+
+
+class AgreementHandler:
+    """Класс для работы с пользовательским соглашением"""
+
+    AGREEMENT_VERSION = AGREEMENT_VERSION
+
+    @staticmethod
+    def get_short_agreement() -> str:
+        """Получить краткую версию соглашения"""
+        return AGREEMENT_SHORT_TEMPLATE.render()
+
+    @staticmethod
+    def get_full_agreement() -> str:
+        """Получить полную версию соглашения"""
+        return AGREEMENT_FULL_TEMPLATE.render()
 
     @staticmethod
     def create_agreement_keyboard(include_full: bool = True) -> InlineKeyboardMarkup:
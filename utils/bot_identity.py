@@ -0,0 +1,54 @@
+# utils/bot_identity.py
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import User
+
+logger = logging.getLogger(__name__)
+
+
+class BotIdentity:
+    """
+    Данные бота (id, username), загружаемые один раз при запуске.
+
+    Username бота не меняется во время работы, поэтому ссылки на бота
+    собираются из памяти без запросов к Telegram.
+    """
+
+    def __init__(self):
+        self.id: Optional[int] = None
+        self.username: Optional[str] = None
+        self._link_base: Optional[str] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._link_base is not None
+
+    async def refresh(self, bot: Bot, force: bool = False) -> User:
+        """Загрузка данных бота (force - принудительный запрос getMe)"""
+        user = await bot.get_me() if force else await bot.me()
+        self.id = user.id
+        self.username = user.username
+        self._link_base = f"https://t.me/{user.username or user.id}?start="
+        logger.info(f"Данные бота закэшированы: @{user.username} (ID: {user.id})")
+        return user
+
+    async def ensure_loaded(self, bot: Bot):
+        """Загрузка данных бота, если они еще не загружены"""
+        if not self.is_loaded:
+            await self.refresh(bot)
+
+    def deep_link(self, payload: str) -> str:
+        """Ссылка на бота с параметром /start"""
+        if not self.is_loaded:
+            raise RuntimeError("Данные бота еще не загружены")
+        return f"{self._link_base}{payload}"
+
+    def referral_link(self, user_id: int) -> str:
+        """Реферальная ссылка пользователя"""
+        return self.deep_link(f"ref_{user_id}")
+
+
+# Создаем глобальный экземпляр для удобства использования
+bot_identity = BotIdentity()
@@ -0,0 +1,218 @@
+# utils/broadcast.py
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from aiogram.exceptions import TelegramForbiddenError
+
+from database import db
+from models.enums import MessagePriority
+from utils.rate_limit import TokenBucket
+from utils.sender import message_sender
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastManager:
+    """
+    Массовые рассылки администратора.
+
+    Получатели читаются из БД пачками по возрастанию user_id, сообщения идут через
+    общий планировщик отправки с низким приоритетом и собственным лимитом скорости.
+    После каждой пачки прогресс сохраняется, поэтому прерванная рассылка
+    продолжается с места остановки.
+    """
+
+    def __init__(self, rate: float = 20, batch_size: int = 100, progress_interval: float = 15):
+        self.rate = rate
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+
+        self.current_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._cancel_requested = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, broadcast_id: int, report_chat_id: int) -> bool:
+        """Запуск (или продолжение) рассылки в фоне"""
+        if self.is_running:
+            return False
+        if not db.start_broadcast(broadcast_id):
+            return False
+
+        self.current_id = broadcast_id
+        self._cancel_requested = False
+        self._task = asyncio.create_task(self._run(broadcast_id, report_chat_id))
+        return True
+
+    def resume_unfinished(self) -> Optional[int]:
+        """Продолжить рассылку, прерванную остановкой бота"""
+        for broadcast_id in db.get_unfinished_broadcasts():
+            broadcast = db.get_broadcast(broadcast_id)
+            if broadcast and self.start(broadcast_id, broadcast['created_by']):
+                logger.info(f"Рассылка #{broadcast_id} продолжена с user_id > {broadcast['last_user_id']}")
+                return broadcast_id
+        return None
+
+    def cancel(self) -> bool:
+        """Отмена текущей рассылки (завершится после текущей пачки)"""
+        if not self.is_running:
+            return False
+        self._cancel_requested = True
+        return True
+
+    async def stop(self):
+        """Остановка при выключении бота: статус остается 'running' для продолжения"""
+        if not self.is_running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        logger.info(f"Рассылка #{self.current_id} приостановлена до следующего запуска")
+
+    async def _run(self, broadcast_id: int, report_chat_id: int):
+        broadcast = db.get_broadcast(broadcast_id)
+        bucket = TokenBucket(self.rate)
+        started_at = time.monotonic()
+        last_report_at = started_at
+        processed_now = 0
+        done_before = broadcast['sent_count'] + broadcast['failed_count'] + broadcast['blocked_count']
+        totals = {'sent': broadcast['sent_count'], 'failed': broadcast['failed_count'],
+                  'blocked': broadcast['blocked_count']}
+
+        progress_message_id = None
+        try:
+            progress = await message_sender.send_message(
+                report_chat_id, self._format_progress(broadcast, totals, 0.0, None),
+                priority=MessagePriority.NOTIFICATION, parse_mode="HTML"
+            )
+            progress_message_id = progress.message_id
+        except Exception as e:
+            logger.warning(f"Не удалось отправить отчет о рассылке #{broadcast_id}: {e}")
+
+        batch: List[int] = []
+        try:
+            for batch in db.iter_broadcast_recipients(broadcast['last_user_id'], self.batch_size):
+                if self._cancel_requested:
+                    break
+
+                futures = self._batch_futures = []
+                for user_id in batch:
+                    await bucket.acquire()
+                    futures.append(message_sender.send_message_nowait(
+                        user_id, broadcast['text'],
+                        priority=MessagePriority.MARKETING, parse_mode="HTML"
+                    ))
+                results = await asyncio.gather(*futures, return_exceptions=True)
+                self._batch_futures = []
+
+                self._record_batch(broadcast_id, batch, results, totals)
+                processed_now += len(batch)
+
+                now = time.monotonic()
+                if progress_message_id and now - last_report_at >= self.progress_interval:
+                    last_report_at = now
+                    throughput = processed_now / (now - started_at)
+                    remaining = max(0, broadcast['total_recipients'] - done_before - processed_now)
+                    eta = remaining / throughput if throughput > 0 else None
+                    message_sender.enqueue(
+                        'edit_message_text', report_chat_id,
+                        priority=MessagePriority.NOTIFICATION,
+                        message_id=progress_message_id,
+                        text=self._format_progress(broadcast, totals, throughput, eta),
+                        parse_mode="HTML"
+                    )
+
+            status = 'cancelled' if self._cancel_requested else 'completed'
+            db.finish_broadcast(broadcast_id, status)
+
+            elapsed = time.monotonic() - started_at
+            throughput = processed_now / elapsed if elapsed > 0 else 0.0
+            await message_sender.send_message(
+                report_chat_id,
+                f"{'🛑' if status == 'cancelled' else '✅'} <b>Рассылка #{broadcast_id} "
+                f"{'отменена' if status == 'cancelled' else 'завершена'}</b>\n\n"
+                f"• Доставлено: {totals['sent']}\n"
+                f"• Заблокировали бота: {totals['blocked']}\n"
+                f"• Ошибок: {totals['failed']}\n"
+                f"• Время: {elapsed:.0f} с ({throughput:.1f} сообщ./с)",
+                priority=MessagePriority.NOTIFICATION,
+                parse_mode="HTML"
+            )
+            logger.info(f"Рассылка #{broadcast_id} {status}: отправлено {totals['sent']}, "
+                        f"заблокировали {totals['blocked']}, ошибок {totals['failed']}")
+
+        except asyncio.CancelledError:
+            self._abandon_batch(broadcast_id, batch, totals)
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка рассылки #{broadcast_id}: {e}")
+            db.finish_broadcast(broadcast_id, 'paused')
+        finally:
+            self._cancel_requested = False
+
+    @staticmethod
+    def _record_batch(broadcast_id: int, batch: List[int], results: list, totals: dict):
+        """Учесть результаты отправки пачки и сохранить прогресс"""
+        sent = failed = 0
+        blocked_ids = []
+        for user_id, result in zip(batch, results):
+            if isinstance(result, TelegramForbiddenError):
+                blocked_ids.append(user_id)
+            elif isinstance(result, BaseException):
+                failed += 1
+            else:
+                sent += 1
+
+        db.mark_users_blocked(blocked_ids)
+        db.update_broadcast_progress(broadcast_id, batch[-1], sent, failed, len(blocked_ids))
+        totals['sent'] += sent
+        totals['failed'] += failed
+        totals['blocked'] += len(blocked_ids)
+
+    def _abandon_batch(self, broadcast_id: int, batch: List[int], totals: dict):
+        """
+        Остановка посреди пачки: еще не отправленные сообщения снимаются с
+        очереди (планировщик пропускает отмененные задания), а прогресс
+        сохраняется по начальной части пачки, отправка которой завершилась.
+        Продолжение начнется с первого неотправленного получателя; повторно
+        могут прийти только сообщения, которые были в отправке в момент остановки
+        """
+        futures, self._batch_futures = self._batch_futures, []
+        done = 0
+        for future in futures:
+            if future.done() and not future.cancelled():
+                done += 1
+            else:
+                break
+        for future in futures[done:]:
+            future.cancel()
+        if done:
+            self._record_batch(broadcast_id, batch[:done],
+                               [future.exception() or future.result() for future in futures[:done]], totals)
+        if len(futures) > done:
+            logger.info(f"Рассылка #{broadcast_id}: снято с очереди {len(futures) - done} сообщений")
+
+    @staticmethod
+    def _format_progress(broadcast: dict, totals: dict, throughput: float, eta: Optional[float]) -> str:
+        done = totals['sent'] + totals['failed'] + totals['blocked']
+        total = broadcast['total_recipients'] or done
+        percent = done / total * 100 if total else 100.0
+        eta_text = f"{eta / 60:.1f} мин" if eta is not None else "оценивается..."
+        return (f"📣 <b>Рассылка #{broadcast['id']}</b>\n\n"
+                f"• Прогресс: {done}/{total} ({percent:.0f}%)\n"
+                f"• Доставлено: {totals['sent']}\n"
+                f"• Заблокировали бота: {totals['blocked']}\n"
+                f"• Ошибок: {totals['failed']}\n"
+                f"• Скорость: {throughput:.1f} сообщ./с\n"
+                f"• Осталось: {eta_text}")
+
+
+# Создаем глобальный экземпляр для удобства использования
+broadcast_manager = BroadcastManager()
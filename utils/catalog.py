@@ -0,0 +1,179 @@
+# utils/catalog.py
+import logging
+import threading
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Optional, Tuple
+
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Прайс-лист по умолчанию: услуга -> (цена, нужна демография, категория)
+DEFAULT_SERVICES: Tuple[Tuple[str, int, bool, str], ...] = (
+    # Анализы крови и мочи (нужна демография)
+    ("Анализы крови/мочи", 290, True, "Анализы"),
+    ("Биохимия крови", 290, True, "Анализы"),
+    ("Гормоны", 290, True, "Анализы"),
+    ("Общий анализ крови", 290, True, "Анализы"),
+    ("Общий анализ мочи", 190, True, "Анализы"),
+    ("Липидограмма", 290, True, "Анализы"),
+    ("Печеночные пробы", 290, True, "Анализы"),
+    ("Коагулограмма", 290, True, "Анализы"),
+
+    # Инструментальные исследования (не нужна демография)
+    ("УЗИ", 390, False, "Исследования"),
+    ("Рентген", 290, False, "Исследования"),
+    ("МРТ", 390, False, "Исследования"),
+    ("КТ", 390, False, "Исследования"),
+    ("ЭКГ", 390, False, "Исследования"),
+    ("Холтер", 390, False, "Исследования"),
+    ("Флюорография", 190, False, "Исследования"),
+
+    # Медицинская документация (не нужна демография)
+    ("Врачебное заключение", 190, False, "Документы"),
+    ("Выписка из стационара", 190, False, "Документы"),
+    ("Назначения лечения", 190, False, "Документы"),
+    ("Протокол операции", 190, False, "Документы"),
+    ("Результаты консультации", 190, False, "Документы"),
+)
+
+# Описание категорий для шага выбора услуги: заголовок и примеры
+CATEGORY_DESCRIPTIONS: Dict[str, Tuple[str, str]] = {
+    "Анализы": ("📋 АНАЛИЗЫ (нужен возраст/пол)", "Анализы крови/мочи, Биохимия, Гормоны"),
+    "Исследования": ("🏥 ИССЛЕДОВАНИЯ", "УЗИ, МРТ, КТ, ЭКГ, Холтер"),
+    "Документы": ("📄 ДОКУМЕНТАЦИЯ", "Врачебные заключения, Выписки"),
+}
+
+CANCEL_ORDER_BUTTON = "❌ Отменить заказ"
+
+
+class Service(NamedTuple):
+    """Услуга из прайс-листа"""
+    name: str
+    price: int
+    needs_demographics: bool
+    category: str
+
+    @property
+    def button_text(self) -> str:
+        return f"{self.name} - {self.price}₽"
+
+
+class ServiceCatalog:
+    """
+    Неизменяемый снимок прайс-листа.
+
+    Все производные данные (индекс по тексту кнопки, клавиатура, описание
+    категорий, словарь цен) строятся один раз при создании снимка.
+    Изменение цен - это сборка нового снимка со следующей версией.
+    """
+
+    __slots__ = ('version', 'services', 'prices', 'keyboard', 'category_info', '_index')
+
+    def __init__(self, services: Tuple[Service, ...], version: int = 1):
+        self.version = version
+        self.services: Mapping[str, Service] = MappingProxyType({service.name: service for service in services})
+
+        # Формат get_service_prices(): услуга -> {"price", "needs_demographics", "category"}
+        self.prices: Mapping[str, Dict] = MappingProxyType({
+            service.name: {
+                "price": service.price,
+                "needs_demographics": service.needs_demographics,
+                "category": service.category,
+            }
+            for service in services
+        })
+
+        # Поиск услуги по тексту кнопки или по названию
+        index = {}
+        for service in services:
+            index[service.name] = service
+            index[service.button_text] = service
+        self._index = index
+
+        self.keyboard = self._build_keyboard(services)
+        self.category_info = self._build_category_info(services)
+
+    def lookup(self, text: Optional[str]) -> Optional[Service]:
+        """Услуга по тексту кнопки (в том числе со старой ценой) или по названию"""
+        if not text:
+            return None
+        service = self._index.get(text)
+        if service is None and " - " in text:
+            # Кнопка из клавиатуры, показанной до изменения цены
+            service = self.services.get(text.rsplit(" - ", 1)[0])
+        return service
+
+    @staticmethod
+    def _build_keyboard(services: Tuple[Service, ...]) -> ReplyKeyboardMarkup:
+        # Группируем по 2 услуги в ряд
+        buttons = [
+            [KeyboardButton(text=service.button_text) for service in services[i:i + 2]]
+            for i in range(0, len(services), 2)
+        ]
+        buttons.append([KeyboardButton(text=CANCEL_ORDER_BUTTON)])
+        return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+
+    @staticmethod
+    def _build_category_info(services: Tuple[Service, ...]) -> str:
+        # Категории показываются как текст (не кнопки) с актуальным диапазоном цен
+        blocks = []
+        for category, (title, examples) in CATEGORY_DESCRIPTIONS.items():
+            prices = [service.price for service in services if service.category == category]
+            if not prices:
+                continue
+            low, high = min(prices), max(prices)
+            price_range = f"{low}₽" if low == high else f"{low}-{high}₽"
+            blocks.append(f"<b>{title}</b>\n• {examples}\n• {price_range}")
+        return "\n\n".join(blocks)
+
+
+_lock = threading.Lock()
+_current: Optional[ServiceCatalog] = None
+
+
+def _load_services() -> Tuple[Service, ...]:
+    """Активные услуги из БД (или прайс-лист по умолчанию)"""
+    rows: Tuple[Tuple[str, int, bool, str], ...] = DEFAULT_SERVICES
+    try:
+        # Импорт здесь: database сам импортирует этот модуль ради DEFAULT_SERVICES
+        from database import db
+        rows = tuple(
+            (name, price, bool(needs_demographics), category)
+            for _, name, category, price, needs_demographics, _, _ in db.get_services(active_only=True)
+        )
+    except Exception as e:
+        logger.error("Не удалось загрузить прайс-лист из БД, используются цены по умолчанию: %s", e)
+
+    return tuple(
+        Service(name, price, needs_demographics, category)
+        for name, price, needs_demographics, category in rows
+    )
+
+
+def rebuild_catalog() -> ServiceCatalog:
+    """
+    Собрать новый снимок прайс-листа и атомарно подменить текущий.
+
+    Вызывается при старте и после изменения услуг администратором;
+    обработчики заказов читают только снимок. Цены задаются только в
+    таблице services.
+    """
+    global _current
+    with _lock:
+        services = _load_services()
+        if _current is not None and tuple(_current.services.values()) == services:
+            return _current
+        version = _current.version + 1 if _current is not None else 1
+        catalog = ServiceCatalog(services, version)
+        _current = catalog
+    logger.info("Прайс-лист собран: версия %s, услуг: %s", catalog.version, len(catalog.services))
+    return catalog
+
+
+def get_catalog() -> ServiceCatalog:
+    """Текущий снимок прайс-листа"""
+    catalog = _current
+    if catalog is None:
+        catalog = rebuild_catalog()
+    return catalog
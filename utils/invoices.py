@@ -0,0 +1,164 @@
+# utils/invoices.py
+import logging
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from config import config
+from database import db
+from models.enums import MessagePriority, OrderStatus, PaymentStatus
+from utils.metrics import Histogram
+from utils.sender import message_sender
+
+logger = logging.getLogger(__name__)
+
+# Валюта счетов (см. send_invoice_to_user)
+INVOICE_CURRENCY = "RUB"
+
+
+class InvoiceValidator:
+    """
+    Проверка pre_checkout_query перед списанием денег.
+
+    Telegram ждет ответа на pre_checkout_query не дольше 10 секунд, иначе
+    платеж отменяется. Выставленные счета запоминаются в памяти на ttl
+    секунд (payload -> заказ, пользователь, сумма в копейках), поэтому
+    обычная оплата сразу после счета проверяется без запроса к БД. При
+    промахе заказ ищется по индексу invoice_payload. Любое изменение
+    статуса заказа убирает его счет из кэша: оплаченный или отмененный
+    заказ перепроверяется по БД.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+
+        # payload -> (order_id, user_id, сумма в копейках, истекает)
+        self._cache: Dict[str, Tuple[int, int, int, float]] = {}
+        self._by_order: Dict[int, str] = {}
+        self._database = None
+
+        # Метрики
+        self.latency = Histogram()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.accepted = 0
+        self.rejected: Counter = Counter()
+
+    def attach(self, database):
+        """Подписаться на изменения статусов заказов"""
+        self._database = database
+        database.subscribe_order_changes(self.on_order_change)
+
+    def remember(self, invoice_payload: str, order_id: int, user_id: int, price: int):
+        """Счет выставлен: запомнить его (новый счет заказа заменяет прежний)"""
+        previous = self._by_order.get(order_id)
+        if previous is not None:
+            self._cache.pop(previous, None)
+        self._cache[invoice_payload] = (order_id, user_id, price * 100, time.monotonic() + self.ttl)
+        self._by_order[order_id] = invoice_payload
+        if len(self._cache) > 1000:
+            self._evict_expired()
+
+    def on_order_change(self, order_id: int, status: str):
+        """Обработчик события Database: статус заказа изменился - счет больше не кэшируем"""
+        invoice_payload = self._by_order.pop(order_id, None)
+        if invoice_payload is not None:
+            self._cache.pop(invoice_payload, None)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for invoice_payload, (order_id, _, _, expires_at) in list(self._cache.items()):
+            if expires_at <= now:
+                del self._cache[invoice_payload]
+                self._by_order.pop(order_id, None)
+
+    def _lookup(self, invoice_payload: str) -> Optional[Tuple[int, int, int, bool]]:
+        """(order_id, user_id, сумма в копейках, можно оплатить) или None"""
+        cached = self._cache.get(invoice_payload)
+        if cached is not None and cached[3] > time.monotonic():
+            self.cache_hits += 1
+            return cached[0], cached[1], cached[2], True
+
+        self.cache_misses += 1
+        row = self._database.get_invoice_order(invoice_payload) if self._database is not None else None
+        if row is None:
+            return None
+        order_id, user_id, price, status, payment_status = row
+        if payment_status == PaymentStatus.SUCCESS.value or status in (
+                OrderStatus.PAID.value, OrderStatus.CANCELLED.value):
+            return order_id, user_id, price * 100, False
+        self.remember(invoice_payload, order_id, user_id, price)
+        return order_id, user_id, price * 100, True
+
+    def check(self, invoice_payload: str, user_id: int, total_amount: int,
+              currency: str) -> Optional[str]:
+        """Проверить запрос на оплату. Возвращает текст отказа для пользователя или None"""
+        started_at = time.perf_counter()
+        try:
+            reason, error_message = self._check(invoice_payload, user_id, total_amount, currency)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.latency.observe(elapsed)
+
+        if reason is None:
+            self.accepted += 1
+            logger.info("Счет %s проверен за %.2f мс", invoice_payload, elapsed * 1000,
+                        extra={'sampled': True})
+        else:
+            self.rejected[reason] += 1
+            logger.warning("Оплата по счету %s отклонена (%s) за %.2f мс",
+                           invoice_payload, reason, elapsed * 1000)
+        return error_message
+
+    def _check(self, invoice_payload: str, user_id: int, total_amount: int,
+               currency: str) -> Tuple[Optional[str], Optional[str]]:
+        order = self._lookup(invoice_payload)
+        if order is None:
+            return 'not_found', "Счет не найден. Оформите заказ заново."
+        order_id, owner_id, expected_amount, payable = order
+        if owner_id != user_id:
+            return 'wrong_user', "Этот счет выставлен другому пользователю."
+        if not payable:
+            return 'not_payable', f"Заказ #{order_id} уже оплачен или отменен."
+        if currency != INVOICE_CURRENCY or abs(total_amount - expected_amount) > 1:
+            return 'amount', "Сумма счета изменилась. Оформите заказ заново."
+        return None, None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Время проверки (p50/p95/p99), попадания в кэш и отказы по причинам"""
+        return {
+            'checked': self.latency.count,
+            'accepted': self.accepted,
+            'rejected': dict(self.rejected),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cached': len(self._cache),
+            'p50_ms': self.latency.percentile(0.50) * 1000,
+            'p95_ms': self.latency.percentile(0.95) * 1000,
+            'p99_ms': self.latency.percentile(0.99) * 1000,
+        }
+
+
+def expire_stale_invoices(batch_size: int) -> int:
+    """
+    Задача sweeper: отменить пачку заказов, не оплаченных за
+    PAYMENT_TIMEOUT_MINUTES, и сообщить пользователям через очередь отправки
+    """
+    expired = db.expire_stale_invoices(config.PAYMENT_TIMEOUT_MINUTES * 60, batch_size)
+    if expired and config.NOTIFY_EXPIRED_INVOICES:
+        try:
+            for order_id, user_id in expired:
+                message_sender.send_message_nowait(
+                    user_id,
+                    f"⌛️ Счет по заказу #{order_id} не был оплачен за {config.PAYMENT_TIMEOUT_MINUTES} мин. "
+                    f"и отменен. Чтобы получить расшифровку, оформите заказ заново.",
+                    priority=MessagePriority.NOTIFICATION
+                )
+        except Exception as e:
+            # Заказы уже отменены в БД - пачка засчитывается, теряются только уведомления
+            logger.error(f"Не удалось поставить уведомления об отмене счетов: {e}")
+    return len(expired)
+
+
+# Создаем глобальный экземпляр для удобства использования
+invoice_validator = InvoiceValidator(ttl=config.INVOICE_CACHE_SECONDS)
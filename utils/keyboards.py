@@ -1,4 +1,7 @@
 # utils/keyboards.py
+from functools import lru_cache, wraps
+from typing import Any, Callable, Dict, List, Optional
+
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -6,9 +9,72 @@ from aiogram.types import (
     InlineKeyboardButton
 )
 
+from utils.catalog import get_catalog
+
+# Максимум закэшированных клавиатур на одну параметризованную фабрику (по order_id и т.п.)
+KEYBOARD_CACHE_SIZE = 1024
+
+_cached_factories: List[Callable] = []
+
+
+def copy_markup(markup):
+    """
+    Копия клавиатуры для одного ответа: свои списки рядов и свои кнопки.
+    Модели aiogram изменяемы (MutableTelegramObject), поэтому общий
+    объект из кэша наружу не отдается. Поля кнопок здесь - строки и
+    числа, так что поверхностной копии кнопки достаточно.
+    """
+    if markup is None:
+        return None
+    field = 'inline_keyboard' if isinstance(markup, InlineKeyboardMarkup) else 'keyboard'
+    rows = getattr(markup, field)
+    return markup.copy(update={field: [[button.copy() for button in row] for row in rows]})
+
+
+def cached_keyboard(maxsize: int = None):
+    """
+    Кэширование фабрики клавиатуры.
+
+    Статические клавиатуры (без аргументов) строятся один раз,
+    параметризованные (по order_id и т.п.) хранятся в ограниченном
+    LRU-кэше. Каждый вызов возвращает копию (copy_markup): изменение
+    полученной клавиатуры не затрагивает кэш. Копия в несколько раз
+    дешевле сборки клавиатуры заново.
+    """
+    def decorator(factory: Callable) -> Callable:
+        cached = lru_cache(maxsize=maxsize)(factory)
+        _cached_factories.append(cached)
+
+        @wraps(factory)
+        def wrapper(*args, **kwargs):
+            return copy_markup(cached(*args, **kwargs))
+
+        wrapper.cache_info = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
+
+
+def get_keyboard_cache_stats() -> Dict[str, Any]:
+    """Попадания и промахи кэша клавиатур"""
+    infos = [factory.cache_info() for factory in _cached_factories]
+    return {
+        'factories': len(infos),
+        'hits': sum(info.hits for info in infos),
+        'misses': sum(info.misses for info in infos),
+        'size': sum(info.currsize for info in infos),
+    }
+
+
+def clear_keyboard_cache():
+    """Сброс кэша клавиатур"""
+    for factory in _cached_factories:
+        factory.cache_clear()
+
 
 # ========== ФУНКЦИИ ДЛЯ СОЗДАНИЯ КЛАВИАТУР ==========
 
+@cached_keyboard()
 def create_main_menu() -> ReplyKeyboardMarkup:
     """Создание главного меню"""
     buttons = [
@@ -21,76 +87,17 @@ def create_main_menu() -> ReplyKeyboardMarkup:
 
 
 def get_service_prices():
-    """Возвращает прайс-лист услуг с дополнительной информацией"""
-    return {
-        # Анализы крови и мочи (нужна демография)
-        "Анализы крови/мочи": {"price": 290, "needs_demographics": True, "category": "Анализы"},
-        "Биохимия крови": {"price": 290, "needs_demographics": True, "category": "Анализы"},
-        "Гормоны": {"price": 290, "needs_demographics": True, "category": "Анализы"},
-        "Общий анализ крови": {"price": 290, "needs_demographics": True, "category": "Анализы"},
-        "Общий анализ мочи": {"price": 190, "needs_demographics": True, "category": "Анализы"},
-        "Липидограмма": {"price": 290, "needs_demographics": True, "category": "Анализы"},
-        "Печеночные пробы": {"price": 290, "needs_demographics": True, "category": "Анализы"},
-        "Коагулограмма": {"price": 290, "needs_demographics": True, "category": "Анализы"},
-
-        # Инструментальные исследования (не нужна демография)
-        "УЗИ": {"price": 390, "needs_demographics": False, "category": "Исследования"},
-        "Рентген": {"price": 290, "needs_demographics": False, "category": "Исследования"},
-        "МРТ": {"price": 390, "needs_demographics": False, "category": "Исследования"},
-        "КТ": {"price": 390, "needs_demographics": False, "category": "Исследования"},
-        "ЭКГ": {"price": 390, "needs_demographics": False, "category": "Исследования"},
-        "Холтер": {"price": 390, "needs_demographics": False, "category": "Исследования"},
-        "Флюорография": {"price": 190, "needs_demographics": False, "category": "Исследования"},
-
-        # Медицинская документация (не нужна демография)
-        "Врачебное заключение": {"price": 190, "needs_demographics": False, "category": "Документы"},
-        "Выписка из стационара": {"price": 190, "needs_demographics": False, "category": "Документы"},
-        "Назначения лечения": {"price": 190, "needs_demographics": False, "category": "Документы"},
-        "Протокол операции": {"price": 190, "needs_demographics": False, "category": "Документы"},
-        "Результаты консультации": {"price": 190, "needs_demographics": False, "category": "Документы"},
-    }
+    """Возвращает прайс-лист услуг с дополнительной информацией (только для чтения)"""
+    return get_catalog().prices
 
 
 def create_service_keyboard():
     """Клавиатура для выбора услуги (только услуги, без кликабельных категорий)"""
-    services = get_service_prices()
-    buttons = []
-
-    # Создаем кнопки для всех услуг сразу
-    service_rows = []
-
-    for service_name, info in services.items():
-        price = info["price"]
-        service_rows.append(f"{service_name} - {price}₽")
-
-    # Группируем по 2 услуги в ряд
-    for i in range(0, len(service_rows), 2):
-        row = []
-        if i < len(service_rows):
-            row.append(KeyboardButton(text=service_rows[i]))
-        if i + 1 < len(service_rows):
-            row.append(KeyboardButton(text=service_rows[i + 1]))
-        if row:
-            buttons.append(row)
-
-    # Добавляем категории как НЕкнопки (просто текст)
-    category_info = """<b>📋 АНАЛИЗЫ (нужен возраст/пол)</b>
-• Анализы крови/мочи, Биохимия, Гормоны
-• 190-290₽
-
-<b>🏥 ИССЛЕДОВАНИЯ</b>
-• УЗИ, МРТ, КТ, ЭКГ, Холтер
-• 190-390₽
-
-<b>📄 ДОКУМЕНТАЦИЯ</b>
-• Врачебные заключения, Выписки
-• 190₽"""
-
-    buttons.append([KeyboardButton(text="❌ Отменить заказ")])
-
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True), category_info
+    catalog = get_catalog()
+    return copy_markup(catalog.keyboard), catalog.category_info
 
 
+@cached_keyboard()
 def create_promo_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для ввода промокода"""
     skip_button = KeyboardButton(text="⏭️ Пропустить")
@@ -103,6 +110,7 @@ def create_promo_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+@cached_keyboard()
 def create_demographics_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для ввода пола"""
     male_button = KeyboardButton(text="👨 Мужской")
@@ -122,6 +130,7 @@ def create_demographics_keyboard() -> ReplyKeyboardMarkup:
     return keyboard
 
 
+@cached_keyboard()
 def create_docs_questions_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для загрузки документов и вопросов"""
     ready_button = KeyboardButton(text="✅ Отправить на обработку")
@@ -134,6 +143,7 @@ def create_docs_questions_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+@cached_keyboard()
 def create_new_docs_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для загрузки новых документов"""
     done_button = KeyboardButton(text="✅ Документы загружены")
@@ -146,6 +156,7 @@ def create_new_docs_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+@cached_keyboard()
 def create_clarification_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для уточняющих вопросов"""
     cancel_button = KeyboardButton(text="❌ Отменить уточнение")
@@ -157,6 +168,7 @@ def create_clarification_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+@cached_keyboard()
 def create_contact_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для связи с админом"""
     cancel_button = KeyboardButton(text="❌ Отменить отправку")
@@ -170,6 +182,7 @@ def create_contact_keyboard() -> ReplyKeyboardMarkup:
 
 # ========== ИНЛАЙН-КЛАВИАТУРЫ ==========
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_rating_keyboard(order_id: int) -> InlineKeyboardMarkup:
     """Создать клавиатуру с оценкой 1-5 звёзд"""
     buttons = []
@@ -187,6 +200,7 @@ def create_rating_keyboard(order_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_clarification_actions_keyboard(order_id: int) -> InlineKeyboardMarkup:
     """Создать клавиатуру для действий после ответа"""
     buttons = [
@@ -204,6 +218,7 @@ def create_clarification_actions_keyboard(order_id: int) -> InlineKeyboardMarkup
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_simple_rating_keyboard(order_id: int) -> InlineKeyboardMarkup:
     """Простая клавиатура только с оценкой"""
     buttons = [
@@ -215,17 +230,21 @@ def create_simple_rating_keyboard(order_id: int) -> InlineKeyboardMarkup:
 
 # ========== КЛАВИАТУРЫ ДЛЯ АДМИНА ==========
 
+@cached_keyboard()
 def create_admin_menu() -> ReplyKeyboardMarkup:
     """Создание меню администратора"""
     buttons = [
         [KeyboardButton(text="📊 Статистика"), KeyboardButton(text="📋 Все заказы")],
+        [KeyboardButton(text="🔥 Следующий заказ")],
         [KeyboardButton(text="⏳ Ожидающие"), KeyboardButton(text="💾 Бэкап")],
         [KeyboardButton(text="🎫 Промокоды"), KeyboardButton(text="👥 Рефералы")],
-        [KeyboardButton(text="📝 Шаблоны"), KeyboardButton(text="🏠 Главное меню")]
+        [KeyboardButton(text="📝 Шаблоны"), KeyboardButton(text="💲 Прайс-лист")],
+        [KeyboardButton(text="🏠 Главное меню")]
     ]
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_admin_order_actions_keyboard(order_id: int) -> InlineKeyboardMarkup:
     """Клавиатура с действиями админа для заказа"""
     buttons = [
@@ -240,11 +259,13 @@ def create_admin_order_actions_keyboard(order_id: int) -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(text="💬 Уточнения", callback_data=f"admin_clarifications_{order_id}"),
             InlineKeyboardButton(text="💰 Изменить цену", callback_data=f"admin_price_{order_id}")
-        ]
+        ],
+        [InlineKeyboardButton(text="↩️ Вернуть в очередь", callback_data=f"admin_release_{order_id}")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@cached_keyboard()
 def create_admin_template_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора шаблона"""
     buttons = []
@@ -263,8 +284,34 @@ def create_admin_template_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def create_admin_services_keyboard(services: List[tuple]) -> InlineKeyboardMarkup:
+    """Клавиатура прайс-листа для админа: одна кнопка на услугу"""
+    buttons = []
+    for service_id, name, category, price, needs_demographics, active, sort_order in services:
+        mark = "" if active else "🚫 "
+        buttons.append([InlineKeyboardButton(text=f"{mark}{name} - {price}₽", callback_data=f"service_edit_{service_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
+def create_admin_service_actions_keyboard(service_id: int, active: bool) -> InlineKeyboardMarkup:
+    """Действия админа с услугой"""
+    buttons = [
+        [
+            InlineKeyboardButton(text="💰 Изменить цену", callback_data=f"service_price_{service_id}"),
+            InlineKeyboardButton(
+                text="🚫 Скрыть" if active else "✅ Показать",
+                callback_data=f"service_toggle_{service_id}"
+            )
+        ],
+        [InlineKeyboardButton(text="↩️ К прайс-листу", callback_data="service_list")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
 # ========== КЛАВИАТУРЫ ДЛЯ СОГЛАШЕНИЯ ==========
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_agreement_keyboard(include_full: bool = True) -> InlineKeyboardMarkup:
     """Клавиатура для соглашения"""
     buttons = []
@@ -277,6 +324,7 @@ def create_agreement_keyboard(include_full: bool = True) -> InlineKeyboardMarkup
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@cached_keyboard()
 def create_full_agreement_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для полного соглашения"""
     buttons = [
@@ -329,6 +377,7 @@ def create_category_keyboard():
 
 # ========== КЛАВИАТУРЫ ДЛЯ РЕФЕРАЛЬНОЙ СИСТЕМЫ ==========
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_referral_share_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для поделиться реферальной ссылкой"""
     buttons = [
@@ -344,6 +393,7 @@ def create_referral_share_keyboard(user_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_share_options_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура с вариантами поделиться"""
     buttons = [
@@ -365,6 +415,7 @@ def create_share_options_keyboard(user_id: int) -> InlineKeyboardMarkup:
 
 # ========== КЛАВИАТУРЫ ДЛЯ СТАТУСОВ ЗАКАЗОВ ==========
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
 def create_order_status_keyboard(order_id: int, status: str) -> InlineKeyboardMarkup:
     """Клавиатура в зависимости от статуса заказа"""
     buttons = []
@@ -397,6 +448,7 @@ def create_order_status_keyboard(order_id: int, status: str) -> InlineKeyboardMa
 
 # ========== ПРОСТЫЕ КНОПКИ ==========
 
+@cached_keyboard()
 def create_cancel_only_keyboard() -> ReplyKeyboardMarkup:
     """Просто кнопка отмены"""
     return ReplyKeyboardMarkup(
@@ -406,6 +458,7 @@ def create_cancel_only_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+@cached_keyboard()
 def create_yes_no_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура Да/Нет"""
     return ReplyKeyboardMarkup(
@@ -418,6 +471,7 @@ def create_yes_no_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+@cached_keyboard()
 def create_skip_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура с кнопкой пропустить"""
     return ReplyKeyboardMarkup(
@@ -432,8 +486,9 @@ def create_skip_keyboard() -> ReplyKeyboardMarkup:
 
 # ========== КЛАВИАТУРЫ ДЛЯ ФИЛЬТРОВ АДМИНА ==========
 
-def create_admin_filter_keyboard() -> InlineKeyboardMarkup:
-    """Клавиатура фильтров для админа"""
+# Без кэша: ключом были бы произвольные строки callback_data
+def create_admin_filter_keyboard(next_callback: str = None) -> InlineKeyboardMarkup:
+    """Клавиатура фильтров для админа (с кнопкой следующей страницы, если она есть)"""
     buttons = [
         [
             InlineKeyboardButton(text="⏳ Ожидающие", callback_data="filter_pending"),
@@ -452,11 +507,28 @@ def create_admin_filter_keyboard() -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="📊 Все", callback_data="filter_all")
         ]
     ]
+    if next_callback:
+        buttons.append([InlineKeyboardButton(text="Далее ▶️", callback_data=next_callback)])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@cached_keyboard(KEYBOARD_CACHE_SIZE)
+def create_search_pages_keyboard(page: int, pages: int) -> Optional[InlineKeyboardMarkup]:
+    """Листание результатов поиска (None, если страница одна)"""
+    if pages <= 1:
+        return None
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"search_page_{page - 1}"))
+    row.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"search_page_{page}"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"search_page_{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+
 # ========== КЛАВИАТУРЫ ДЛЯ УПРАВЛЕНИЯ ПРОМОКОДАМИ ==========
 
+@cached_keyboard()
 def create_promo_management_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура управления промокодами"""
     buttons = [
@@ -477,6 +549,7 @@ def create_promo_management_keyboard() -> InlineKeyboardMarkup:
 
 # ========== КЛАВИАТУРЫ ДЛЯ ШАБЛОНОВ ==========
 
+@cached_keyboard()
 def create_template_management_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура управления шаблонами"""
     buttons = [
@@ -497,6 +570,7 @@ def create_template_management_keyboard() -> InlineKeyboardMarkup:
 
 # ========== УНИВЕРСАЛЬНЫЕ КЛАВИАТУРЫ ==========
 
+# Без кэша: ключом были бы произвольные строки callback_data
 def create_navigation_keyboard(back_callback: str = "back",
                                cancel_callback: str = "cancel") -> InlineKeyboardMarkup:
     """Универсальная клавиатура навигации"""
@@ -509,6 +583,7 @@ def create_navigation_keyboard(back_callback: str = "back",
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+# Без кэша: ключом были бы произвольные строки callback_data
 def create_confirmation_keyboard(yes_callback: str, no_callback: str) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения"""
     buttons = [
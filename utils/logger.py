@@ -1,45 +1,104 @@
 # utils/logger.py
+import atexit
+import gzip
 import logging
 import os
+import queue
+import shutil
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-from datetime import datetime
+from typing import Optional
 
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
-def setup_logger():
-    """Настройка логгера для всего проекта"""
+_listener: Optional[QueueListener] = None
 
-    # Создаем директорию для логов рядом с проектом
-    project_root = Path(__file__).parent.parent
-    log_dir = project_root / "logs"
-    log_dir.mkdir(exist_ok=True)
 
-    # Имя файла с датой
-    log_file = log_dir / f"bot_{datetime.now().strftime('%Y%m%d')}.log"
+class SamplingFilter(logging.Filter):
+    """
+    Прореживание массовых INFO-сообщений.
 
-    # Настройка основного логгера
-    logger = logging.getLogger("medical_bot")
-    logger.setLevel(logging.INFO)
+    Проходит каждое N-е сообщение из помеченных extra={'sampled': True};
+    предупреждения и ошибки, а также непомеченные сообщения не прореживаются.
+    """
 
-    # Форматтер
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    def __init__(self, every: int = 1):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = 0
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or record.levelno > logging.INFO or not getattr(record, 'sampled', False):
+            return True
+        self._counter += 1
+        if self._counter % self.every == 0:
+            return True
+        self.dropped += 1
+        return False
+
+
+class _LazyQueueHandler(QueueHandler):
+    """Передает запись в очередь без форматирования - оно выполняется в потоке записи"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _gzip_namer(name: str) -> str:
+    return f"{name}.gz"
 
-    # File handler
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+
+def _gzip_rotator(source: str, dest: str):
+    """Сжатие файла лога при ротации"""
+    with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+
+def setup_logging(log_dir: Path, level: str = "INFO", max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 10, sample_every: int = 1) -> QueueListener:
+    """
+    Настройка логирования для всего проекта.
+
+    Корневой логгер только кладет записи в очередь; форматирование, запись
+    в файл (с ротацией по размеру и сжатием старых файлов) и вывод в консоль
+    выполняются в фоновом потоке и не блокируют цикл событий.
+    """
+    global _listener
+    log_dir.mkdir(exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = RotatingFileHandler(
+        log_dir / "bot.log", maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
     file_handler.setFormatter(formatter)
 
-    # Console handler
-    console_handler = logging.StreamHandler()
+    console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
 
-    # Добавляем обработчики
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_every))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
 
-    return logger
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
 
 
-# Глобальный логгер
-logger = setup_logger()
\ No newline at end of file
+def stop_logging():
+    """Дописать оставшиеся записи и остановить фоновый поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,192 @@
+# utils/metrics.py
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, в секундах
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# Время запросов к БД в рамках текущего обновления (список из одного числа)
+_db_time: ContextVar[Optional[List[float]]] = ContextVar('db_time', default=None)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и оценкой перцентилей"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'total')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля (линейная интерполяция внутри корзины)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index >= len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Накопленные значения корзин в формате Prometheus (le, count)"""
+        result, running = [], 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            running += bucket_count
+            result.append((f"{bound:g}", running))
+        result.append(("+Inf", self.count))
+        return result
+
+
+class HandlerStats:
+    """Метрики одного обработчика"""
+
+    __slots__ = ('count', 'errors', 'latency', 'db_latency')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.db_latency = Histogram()
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик бота.
+
+    Хранит по каждому обработчику число вызовов, ошибок и гистограммы
+    полного времени обработки и времени запросов к БД.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, HandlerStats] = {}
+        self.db_calls = 0
+        self.db_time_total = 0.0
+        self.started_at = time.time()
+
+    def observe_handler(self, name: str, elapsed: float, db_elapsed: float, error: bool = False):
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        stats.count += 1
+        if error:
+            stats.errors += 1
+        stats.latency.observe(elapsed)
+        stats.db_latency.observe(db_elapsed)
+
+    def observe_db(self, elapsed: float, call: bool = True):
+        """Учет времени БД (call=False - выборка результата уже выполненного запроса)"""
+        if call:
+            self.db_calls += 1
+        self.db_time_total += elapsed
+        holder = _db_time.get()
+        if holder is not None:
+            holder[0] += elapsed
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Сводка по обработчикам, отсортированная по числу вызовов"""
+        rows = []
+        for name, stats in self.handlers.items():
+            rows.append({
+                'handler': name,
+                'count': stats.count,
+                'errors': stats.errors,
+                'p50_ms': stats.latency.percentile(0.50) * 1000,
+                'p95_ms': stats.latency.percentile(0.95) * 1000,
+                'p99_ms': stats.latency.percentile(0.99) * 1000,
+                'db_avg_ms': stats.db_latency.total / stats.count * 1000 if stats.count else 0.0,
+            })
+        rows.sort(key=lambda row: row['count'], reverse=True)
+        return rows
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = [
+            "# HELP bot_handler_calls_total Handler invocations",
+            "# TYPE bot_handler_calls_total counter",
+        ]
+        for name, stats in self.handlers.items():
+            lines.append(f'bot_handler_calls_total{{handler="{name}"}} {stats.count}')
+
+        lines += [
+            "# HELP bot_handler_errors_total Handler invocations that raised",
+            "# TYPE bot_handler_errors_total counter",
+        ]
+        for name, stats in self.handlers.items():
+            lines.append(f'bot_handler_errors_total{{handler="{name}"}} {stats.errors}')
+
+        for metric, attr, help_text in (
+            ("bot_handler_duration_seconds", "latency", "Handler latency"),
+            ("bot_handler_db_duration_seconds", "db_latency", "Database time per handler call"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+            for name, stats in self.handlers.items():
+                histogram = getattr(stats, attr)
+                for le, value in histogram.cumulative():
+                    lines.append(f'{metric}_bucket{{handler="{name}",le="{le}"}} {value}')
+                lines.append(f'{metric}_sum{{handler="{name}"}} {histogram.total}')
+                lines.append(f'{metric}_count{{handler="{name}"}} {histogram.count}')
+
+        lines += [
+            "# HELP bot_db_queries_total Database calls",
+            "# TYPE bot_db_queries_total counter",
+            f"bot_db_queries_total {self.db_calls}",
+            "# HELP bot_db_seconds_total Time spent in database calls",
+            "# TYPE bot_db_seconds_total counter",
+            f"bot_db_seconds_total {self.db_time_total}",
+            "# HELP bot_uptime_seconds Seconds since start",
+            "# TYPE bot_uptime_seconds gauge",
+            f"bot_uptime_seconds {time.time() - self.started_at:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def start_db_timer() -> Tuple[List[float], Any]:
+    """Начать учет времени БД для текущего обновления"""
+    holder = [0.0]
+    return holder, _db_time.set(holder)
+
+
+def stop_db_timer(token: Any):
+    _db_time.reset(token)
+
+
+async def start_metrics_server(host: str, port: int):
+    """HTTP-эндпоинт /metrics для Prometheus (только локальный интерфейс)"""
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
+
+
+# Создаем глобальный экземпляр для удобства использования
+metrics = MetricsRegistry()
@@ -0,0 +1,176 @@
+# utils/notifier.py
+import asyncio
+import html
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.enums import AdminEventType, MessagePriority
+from utils.sender import message_sender
+from utils.templates import html_escape
+
+logger = logging.getLogger(__name__)
+
+# Заголовки разделов сводки в порядке вывода
+EVENT_TITLES = {
+    AdminEventType.ERROR: "🚨 Ошибки",
+    AdminEventType.PAYMENT: "💰 Платежи",
+    AdminEventType.SYSTEM: "⚙️ Система",
+}
+
+# Лимит длины сообщения Telegram с запасом на заголовок
+MAX_MESSAGE_LENGTH = 4000
+
+
+class AdminNotifier:
+    """
+    Шина уведомлений администратора.
+
+    Обычные события копятся в течение окна и уходят одной сводкой,
+    критические отправляются сразу. Накопленное отправляется и при остановке бота.
+    """
+
+    def __init__(self, window: float = 60, max_lines_per_type: int = 10):
+        self.window = window
+        self.max_lines_per_type = max_lines_per_type
+        self.chat_id: Optional[int] = None
+
+        self._pending: Dict[AdminEventType, List[Tuple[datetime, str]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.counters: Dict[str, int] = {event_type.value: 0 for event_type in AdminEventType}
+        self.digests_sent = 0
+        self.immediate_sent = 0
+
+    def configure(self, chat_id: int, window: float = None):
+        """Чат администратора и окно накопления событий"""
+        self.chat_id = chat_id
+        if window is not None:
+            self.window = window
+
+    @property
+    def pending(self) -> int:
+        return sum(len(events) for events in self._pending.values())
+
+    def notify(self, event_type: AdminEventType, text: str, critical: bool = False):
+        """Зарегистрировать событие: критическое - сразу, остальные - в сводку"""
+        self.counters[event_type.value] = self.counters.get(event_type.value, 0) + 1
+
+        if critical:
+            self._send(f"{EVENT_TITLES[event_type]}\n\n{text}", MessagePriority.PAYMENT)
+            self.immediate_sent += 1
+            return
+
+        self._pending.setdefault(event_type, []).append((datetime.now(), text))
+        if self._flush_task is None or self._flush_task.done():
+            # Окно отсчитывается от первого события, а не от последнего
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        self.flush()
+
+    def flush(self) -> int:
+        """Отправить накопленные события одной сводкой. Возвращает число событий"""
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        total = sum(len(events) for events in pending.values())
+
+        sections = []
+        for event_type in EVENT_TITLES:
+            events = pending.get(event_type)
+            if not events:
+                continue
+            lines = [f"<b>{EVENT_TITLES[event_type]} ({len(events)})</b>"]
+            for created_at, text in events[:self.max_lines_per_type]:
+                lines.append(f"• {created_at.strftime('%H:%M:%S')} {text}")
+            if len(events) > self.max_lines_per_type:
+                lines.append(f"<i>...и еще {len(events) - self.max_lines_per_type}</i>")
+            sections.append("\n".join(lines))
+
+        header = f"📬 <b>Сводка событий ({total})</b>"
+        for chunk in _split_sections(sections, MAX_MESSAGE_LENGTH - len(header)):
+            self._send(f"{header}\n\n{chunk}", MessagePriority.NOTIFICATION)
+        self.digests_sent += 1
+        return total
+
+    async def close(self):
+        """Остановка: отправить все накопленное без ожидания окна"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        flushed = self.flush()
+        if flushed:
+            logger.info(f"Отправлена итоговая сводка админу: {flushed} событий")
+
+    def _send(self, text: str, priority: MessagePriority):
+        if not self.chat_id:
+            return
+        try:
+            message_sender.send_message_nowait(self.chat_id, text, priority=priority, parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить админа: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счетчики событий по типам и отправленных уведомлений"""
+        return {
+            'pending': self.pending,
+            'digests_sent': self.digests_sent,
+            'immediate_sent': self.immediate_sent,
+            'counters': dict(self.counters),
+        }
+
+
+def _split_sections(sections: List[str], limit: int) -> List[str]:
+    """Разбивка сводки на сообщения не длиннее limit"""
+    pieces = []
+    for section in sections:
+        pieces.extend(_split_lines(section, limit) if len(section) > limit else [section])
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split_lines(section: str, limit: int) -> List[str]:
+    """
+    Раздел длиннее limit режется по границам строк, чтобы не разорвать
+    тег. Строка, которая сама длиннее limit, обрезается как простой текст
+    """
+    parts, current = [], ""
+    for line in section.split("\n"):
+        if len(line) > limit:
+            line = _truncate_plain(line, limit)
+        if current and len(current) + len(line) + 1 > limit:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _truncate_plain(line: str, limit: int) -> str:
+    """Строка без тегов, обрезанная до limit символов вместе с экранированием"""
+    plain = html.unescape(re.sub(r"<[^>]*>", "", line))
+    size = limit - 3
+    text = html_escape(plain[:size])
+    while len(text) > limit - 3:
+        size -= len(text) - (limit - 3)
+        text = html_escape(plain[:size])
+    return text + "..."
+
+
+# Создаем глобальный экземпляр для удобства использования
+admin_notifier = AdminNotifier()
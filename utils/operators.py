@@ -0,0 +1,168 @@
+# utils/operators.py
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import config
+from database import db
+from models.enums import UserRole
+from utils.sla import sla_queue
+
+logger = logging.getLogger(__name__)
+
+
+class OperatorRegistry:
+    """
+    Операторы, разбирающие заказы, и аренда взятых заказов.
+
+    Заказ закрепляется за оператором одним условным UPDATE в БД
+    (claimed_by, claimed_until), поэтому двое операторов не получат
+    один заказ. Порядок выдачи задает очередь SLA. Фоновая задача раз в
+    sweep_interval секунд снимает истекшие аренды и возвращает заказы
+    в очередь. ADMIN_ID из конфигурации - оператор всегда.
+    """
+
+    def __init__(self, lease_minutes: int = 30, sweep_interval: float = 60):
+        self.lease_minutes = lease_minutes
+        self.sweep_interval = sweep_interval
+
+        self._operators: Dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.claims = 0
+        self.claim_conflicts = 0
+        self.leases_expired = 0
+
+    def configure(self, lease_minutes: int = None, sweep_interval: float = None):
+        """Изменить длительность аренды и период проверки на ходу"""
+        if lease_minutes is not None:
+            self.lease_minutes = lease_minutes
+        if sweep_interval is not None:
+            self.sweep_interval = sweep_interval
+
+    def reload(self):
+        """Перечитать список активных операторов из БД"""
+        self._operators = {user_id: role for user_id, _, role, _, _ in db.get_operators()}
+
+    def is_operator(self, user_id: int) -> bool:
+        return user_id == config.ADMIN_ID or user_id in self._operators
+
+    def role_of(self, user_id: int) -> Optional[str]:
+        if user_id == config.ADMIN_ID:
+            return UserRole.ADMIN.value
+        return self._operators.get(user_id)
+
+    def add(self, user_id: int, username: str = None, role: str = UserRole.OPERATOR,
+            added_by: int = None) -> bool:
+        """Добавить оператора"""
+        if not db.add_operator(user_id, username, role, added_by):
+            return False
+        self.reload()
+        return True
+
+    def remove(self, user_id: int) -> Tuple[bool, int]:
+        """Отключить оператора и вернуть его заказы в очередь: (успех, возвращено заказов)"""
+        if not db.set_operator_active(user_id, False):
+            return False, 0
+        released = db.release_operator_claims(user_id)
+        for order_id, status in released:
+            sla_queue.release(order_id, status)
+        self.reload()
+        logger.info("Оператор %s отключен, возвращено заказов: %s", user_id, len(released))
+        return True, len(released)
+
+    @property
+    def lease_seconds(self) -> int:
+        return self.lease_minutes * 60
+
+    def claim_next(self, operator_id: int) -> Optional[Tuple[int, str, float]]:
+        """
+        Взять самый срочный свободный заказ: (order_id, status, срок) или None.
+        Кандидаты идут из очереди SLA; заказ, который уже занят или закрыт
+        (другой оператор успел раньше), пропускается.
+        """
+        while True:
+            candidate = sla_queue.pop_next()
+            if candidate is None:
+                break
+            order_id, status, deadline = candidate
+            if db.claim_order(order_id, operator_id, self.lease_seconds):
+                sla_queue.mark_taken(order_id, operator_id, status, deadline)
+                self.claims += 1
+                return candidate
+            self.claim_conflicts += 1
+
+        # Очередь пуста - на случай заказов, которых в ней нет, берем прямо из БД
+        claimed = db.claim_next_order(operator_id, self.lease_seconds)
+        if claimed is None:
+            return None
+        order_id, _ = claimed
+        status_deadline = sla_queue.deadline_of(order_id)
+        if status_deadline is None:
+            db.release_order_claim(order_id, operator_id)
+            return None
+        status, deadline = status_deadline
+        sla_queue.mark_taken(order_id, operator_id, status, deadline)
+        self.claims += 1
+        return order_id, status, deadline
+
+    def release(self, order_id: int, operator_id: int = None) -> bool:
+        """Вернуть заказ в очередь (operator_id=None - снять с любого оператора)"""
+        status = db.release_order_claim(order_id, operator_id)
+        if status is None:
+            return False
+        sla_queue.release(order_id, status)
+        return True
+
+    def release_expired(self) -> int:
+        """Снять истекшие аренды и вернуть заказы в очередь"""
+        released = db.release_expired_claims()
+        for order_id, status in released:
+            sla_queue.release(order_id, status, expired=True)
+        if released:
+            self.leases_expired += len(released)
+            logger.info("Аренда истекла, возвращены в очередь заказы: %s",
+                        ", ".join(f"#{order_id}" for order_id, _ in released))
+        return len(released)
+
+    def start(self):
+        """Запуск фоновой проверки истекших аренд"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None or self._task.done():
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.release_expired()
+            except Exception as e:
+                logger.error(f"Ошибка проверки аренды заказов: {e}")
+
+    def get_stats(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Производительность операторов за период (включая тех, у кого пока нет заказов)"""
+        stats = {item['operator_id']: item for item in db.get_operator_stats(days)}
+        for operator_id in [config.ADMIN_ID, *self._operators]:
+            stats.setdefault(operator_id, {
+                'operator_id': operator_id, 'completed': 0, 'completed_last_day': 0,
+                'avg_answer_hours': None, 'claimed': 0,
+            })
+        for operator_id, item in stats.items():
+            item['role'] = self.role_of(operator_id) or 'бывший оператор'
+        return sorted(stats.values(), key=lambda item: item['completed'], reverse=True)
+
+
+# Создаем глобальный экземпляр для удобства использования
+operator_registry = OperatorRegistry(
+    lease_minutes=config.ORDER_CLAIM_MINUTES,
+    sweep_interval=config.ORDER_CLAIM_SWEEP_SECONDS
+)
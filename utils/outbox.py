@@ -0,0 +1,141 @@
+# utils/outbox.py
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from database import db
+from models.enums import MessagePriority
+from utils.sender import message_sender
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxDispatcher:
+    """
+    Доставка сообщений из таблицы outbox.
+
+    Сообщение записывается в outbox в той же транзакции, что и изменение
+    заказа, поэтому БД и пользователь не расходятся: если бот упал до
+    отправки, сообщение уйдет после перезапуска. Фоновая задача забирает
+    созревшие записи, отправляет их через общий планировщик и повторяет
+    временные ошибки с растущей паузой. Ошибки, которые повтор не
+    исправит (бот заблокирован, неверный текст), фиксируются сразу.
+    Отправителю (receipt_chat_id) приходит квитанция о доставке или сбое.
+    """
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 10,
+                 max_delay: float = 600, poll_interval: float = 60, batch_size: int = 20):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+        # Метрики
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    def wake(self):
+        """Есть новые записи - не ждать следующего опроса"""
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        restored = db.reset_outbox_inflight()
+        if restored:
+            logger.warning("Outbox: %s сообщений с прерванной отправкой возвращены в очередь", restored)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Дождаться текущей пачки (не дольше timeout); остальное уйдет после перезапуска"""
+        if self._task is None or self._task.done():
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                rows = db.get_due_outbox(self.batch_size)
+                if rows:
+                    await asyncio.gather(*(self._deliver(*row) for row in rows))
+                    continue
+                delay = db.get_next_outbox_delay()
+            except Exception as e:
+                logger.error(f"Ошибка обработки outbox: {e}")
+                delay = self.poll_interval
+
+            timeout = self.poll_interval if delay is None else min(delay, self.poll_interval)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0.1))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, outbox_id: int, chat_id: int, text: str, priority: int,
+                       order_id: Optional[int], receipt_chat_id: Optional[int], attempts: int):
+        try:
+            sent = await message_sender.send_message(chat_id, text, priority=priority, parse_mode="HTML")
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            self._fail(outbox_id, order_id, receipt_chat_id, str(e))
+            return
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                self._fail(outbox_id, order_id, receipt_chat_id, str(e))
+                return
+            delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+            db.retry_outbox_later(outbox_id, delay, str(e))
+            self.retried += 1
+            logger.warning("Outbox #%s: ошибка отправки (попытка %s), повтор через %.0f с: %s",
+                           outbox_id, attempts, delay, e)
+            return
+
+        db.mark_outbox_sent(outbox_id, getattr(sent, 'message_id', None))
+        self.delivered += 1
+        if receipt_chat_id:
+            subject = f"Ответ по заказу #{order_id}" if order_id else f"Сообщение #{outbox_id}"
+            message_sender.send_message_nowait(
+                receipt_chat_id, f"📬 {subject} доставлен пользователю",
+                priority=MessagePriority.NOTIFICATION
+            )
+
+    def _fail(self, outbox_id: int, order_id: Optional[int], receipt_chat_id: Optional[int], error: str):
+        db.mark_outbox_failed(outbox_id, error)
+        self.failed += 1
+        logger.error("Outbox #%s (заказ #%s) не доставлено: %s", outbox_id, order_id, error)
+        # Пользователь ответа не получил - заказ не должен числиться выполненным
+        reopened = order_id is not None and db.reopen_undelivered_answer(order_id)
+        if receipt_chat_id:
+            subject = f"Ответ по заказу #{order_id}" if order_id else f"Сообщение #{outbox_id}"
+            suffix = "\nЗаказ возвращен в работу." if reopened else ""
+            message_sender.send_message_nowait(
+                receipt_chat_id, f"❌ {subject} не доставлен: {error[:200]}{suffix}",
+                priority=MessagePriority.NOTIFICATION
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики доставки и количество записей по статусам"""
+        return {
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+            'by_status': db.get_outbox_stats(),
+        }
+
+
+# Создаем глобальный экземпляр для удобства использования
+outbox_dispatcher = OutboxDispatcher()
@@ -0,0 +1,65 @@
+# utils/rate_limit.py
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не более capacity накоплено"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления токена (0 - токен доступен)"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        """Забрать токен без ожидания"""
+        if self.delay() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        """Дождаться и забрать токен"""
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def set_rate(self, rate: float, capacity: Optional[float] = None):
+        """Изменить скорость на ходу: накопленное по старой скорости и пауза сохраняются"""
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def pause(self, seconds: float):
+        """Заблокировать бакет (например, после 429 от Telegram)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    @property
+    def is_full(self) -> bool:
+        return self.delay() == 0 and self.tokens >= self.capacity
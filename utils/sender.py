@@ -0,0 +1,299 @@
+# utils/sender.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError
+)
+
+from models.enums import MessagePriority
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class _SendJob:
+    """Задание на отправку: метод Bot API + аргументы"""
+
+    __slots__ = ('method', 'chat_id', 'kwargs', 'priority', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, method: str, chat_id: int, kwargs: Dict[str, Any],
+                 priority: int, future: asyncio.Future):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class MessageSender:
+    """
+    Планировщик исходящих сообщений.
+
+    Все отправки идут через приоритетную очередь и токен-бакеты:
+    общий (~30 сообщений/с на бота) и по каждому чату (~1 сообщение/с).
+    Ответы на RetryAfter (429) обрабатываются автоматически.
+    """
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1,
+                 workers: int = 8, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.workers_count = workers
+        self.max_retries = max_retries
+
+        self.bot: Optional[Bot] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._workers = []
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # Чаты, которые сейчас обслуживает воркер, и их отложенные задания
+        self._chat_backlog: Dict[int, list] = {}
+
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.delay_samples = 0
+        self.delay_total = 0.0
+        self.delay_max = 0.0
+        self.delay_by_priority: Dict[str, float] = {}
+
+    def configure(self, global_rate: float = None, per_chat_rate: float = None,
+                  workers: int = None, max_retries: int = None):
+        """
+        Изменить лимиты. Можно вызывать на ходу (перезагрузка конфигурации):
+        бакеты меняют скорость на месте, паузы после 429 сохраняются, а
+        воркеры, ждущие токен, пересчитывают ожидание по новой скорости.
+        Число воркеров применяется при следующем start.
+        """
+        if global_rate is not None:
+            self.global_rate = global_rate
+            self._global_bucket.set_rate(global_rate)
+        if per_chat_rate is not None:
+            self.per_chat_rate = per_chat_rate
+            for bucket in self._chat_buckets.values():
+                bucket.set_rate(per_chat_rate, capacity=1)
+        if workers is not None:
+            self.workers_count = workers
+        if max_retries is not None:
+            self.max_retries = max_retries
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self, bot: Bot):
+        """Запуск воркеров отправки"""
+        if self.is_running:
+            return
+        self.bot = bot
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.workers_count)]
+        logger.info(f"Планировщик отправки запущен: {self.workers_count} воркеров, "
+                    f"{self.global_rate} сообщ./с всего, {self.per_chat_rate} сообщ./с на чат")
+
+    async def close(self, timeout: float = 10.0) -> int:
+        """Дождаться отправки очереди (не дольше timeout) и остановить воркеров.
+
+        Возвращает количество неотправленных сообщений.
+        """
+        if not self.is_running:
+            return self.pending
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не все сообщения отправлены до остановки: осталось {self.pending}")
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        abandoned = 0
+        while not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            self._queue.task_done()
+            if not job.future.done():
+                job.future.cancel()
+            abandoned += 1
+        for backlog in self._chat_backlog.values():
+            for _, _, job in backlog:
+                if not job.future.done():
+                    job.future.cancel()
+                abandoned += 1
+        self._chat_backlog.clear()
+        return abandoned
+
+    @property
+    def pending(self) -> int:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + sum(len(backlog) for backlog in self._chat_backlog.values())
+
+    def enqueue(self, method: str, chat_id: int,
+                priority: int = MessagePriority.NORMAL, **kwargs) -> asyncio.Future:
+        """Поставить вызов Bot API в очередь, не дожидаясь отправки"""
+        if not self.is_running:
+            raise RuntimeError("Планировщик отправки не запущен")
+
+        future = asyncio.get_running_loop().create_future()
+        # Исключение fire-and-forget отправок не должно теряться с предупреждением asyncio
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        job = _SendJob(method, chat_id, kwargs, int(priority), future)
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+        return future
+
+    async def call(self, method: str, chat_id: int,
+                   priority: int = MessagePriority.NORMAL, **kwargs) -> Any:
+        """Вызов Bot API через очередь с ожиданием результата"""
+        return await self.enqueue(method, chat_id, priority=priority, **kwargs)
+
+    async def send_message(self, chat_id: int, text: str,
+                           priority: int = MessagePriority.NORMAL, **kwargs) -> Any:
+        """Отправка сообщения через очередь с ожиданием результата"""
+        return await self.call('send_message', chat_id, priority=priority, text=text, **kwargs)
+
+    def send_message_nowait(self, chat_id: int, text: str,
+                            priority: int = MessagePriority.NORMAL, **kwargs) -> asyncio.Future:
+        """Отправка сообщения через очередь без ожидания"""
+        return self.enqueue('send_message', chat_id, priority=priority, text=text, **kwargs)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._sweep_idle_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        return bucket
+
+    def _sweep_idle_buckets(self):
+        """Удаляем бакеты чатов, по которым давно ничего не отправлялось"""
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if bucket.is_full and chat_id not in self._chat_backlog]:
+            del self._chat_buckets[chat_id]
+
+    async def _worker(self, worker_id: int):
+        while True:
+            _, seq, job = await self._queue.get()
+
+            backlog = self._chat_backlog.get(job.chat_id)
+            if backlog is not None:
+                # Чат уже обслуживается другим воркером: ждем там, не занимая этот воркер
+                heapq.heappush(backlog, (job.priority, seq, job))
+                continue
+
+            chat_id = job.chat_id
+            backlog = self._chat_backlog[chat_id] = []
+            try:
+                while True:
+                    # Повтор (429, сетевая ошибка) выполняется сразу, впереди остальных сообщений чата
+                    while await self._run_job(job, worker_id):
+                        pass
+                    self._queue.task_done()
+                    if not backlog:
+                        break
+                    _, seq, job = heapq.heappop(backlog)
+            finally:
+                if self._chat_backlog.get(chat_id) is backlog and not backlog:
+                    del self._chat_backlog[chat_id]
+
+    async def _run_job(self, job: _SendJob, worker_id: int) -> bool:
+        """Выполнить задание. True - задание нужно повторить"""
+        if job.future.done():
+            return False
+        try:
+            return await self._process(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка воркера отправки #{worker_id}: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+            return False
+
+    async def _process(self, job: _SendJob) -> bool:
+        await self._chat_bucket(job.chat_id).acquire()
+        await self._global_bucket.acquire()
+
+        if job.attempts == 0:
+            delay = time.monotonic() - job.enqueued_at
+            self.delay_samples += 1
+            self.delay_total += delay
+            self.delay_max = max(self.delay_max, delay)
+            name = _priority_name(job.priority)
+            self.delay_by_priority[name] = max(self.delay_by_priority.get(name, 0.0), delay)
+
+        job.attempts += 1
+        try:
+            result = await getattr(self.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except TelegramRetryAfter as e:
+            self.rate_limited += 1
+            logger.warning("Telegram ограничил отправку в чат %s: повтор через %s с", job.chat_id, e.retry_after)
+            self._chat_bucket(job.chat_id).pause(e.retry_after)
+            self._global_bucket.pause(e.retry_after)
+            return self._retry_or_fail(job, e)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logger.warning("Временная ошибка отправки в чат %s: %s", job.chat_id, e)
+            await asyncio.sleep(min(2 ** job.attempts, 30))
+            return self._retry_or_fail(job, e)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            return False
+
+        self.sent += 1
+        if not job.future.done():
+            job.future.set_result(result)
+        return False
+
+    def _retry_or_fail(self, job: _SendJob, error: Exception) -> bool:
+        """
+        Повторить ли задание. Повтор выполняет тот же воркер, пока чат
+        за ним закреплен, поэтому более поздние сообщения в этот чат
+        не обгоняют повторяемое
+        """
+        if job.attempts > self.max_retries:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+            return False
+        self.retried += 1
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики отправки и задержки в очереди"""
+        return {
+            'queued': self.pending,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rate_limited': self.rate_limited,
+            'avg_delay_ms': (self.delay_total / self.delay_samples * 1000) if self.delay_samples else 0.0,
+            'max_delay_ms': self.delay_max * 1000,
+            'max_delay_by_priority_ms': {k: v * 1000 for k, v in self.delay_by_priority.items()},
+        }
+
+
+def _priority_name(priority: int) -> str:
+    try:
+        return MessagePriority(priority).name
+    except ValueError:
+        return str(priority)
+
+
+# Создаем глобальный экземпляр для удобства использования
+message_sender = MessageSender()
@@ -0,0 +1,75 @@
+# utils/shutdown.py
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from models.enums import ShutdownStage
+
+logger = logging.getLogger(__name__)
+
+# Шаг остановки возвращает (завершено, брошено) или None, если считать нечего
+ShutdownStep = Callable[[float], Awaitable[Optional[Tuple[int, int]]]]
+
+
+class ShutdownCoordinator:
+    """
+    Корректная остановка бота.
+
+    Шаги регистрируются по этапам (прекращение приема, ожидание текущей
+    обработки, сброс очередей, закрытие ресурсов) и выполняются по порядку
+    в пределах общего дедлайна. Каждый шаг получает оставшееся время,
+    ошибка одного шага не мешает остальным. В конце в лог пишется, сколько
+    работы завершено и сколько брошено.
+    """
+
+    def __init__(self, deadline: float = 25.0):
+        self.deadline = deadline
+        self._steps: List[Tuple[ShutdownStage, int, str, ShutdownStep]] = []
+        self._done = False
+        self.results: Dict[str, Tuple[int, int]] = {}
+
+    def add_step(self, name: str, step: ShutdownStep,
+                 stage: ShutdownStage = ShutdownStage.FLUSH):
+        """Зарегистрировать шаг остановки. step(remaining_seconds) -> (завершено, брошено) | None"""
+        self._steps.append((stage, len(self._steps), name, step))
+
+    async def run(self):
+        """Выполнить все шаги остановки (повторный вызов ничего не делает)"""
+        if self._done:
+            return
+        self._done = True
+
+        started_at = time.monotonic()
+        for stage, _, name, step in sorted(self._steps, key=lambda item: (item[0], item[1])):
+            # Закрытие ресурсов выполняется даже после дедлайна
+            remaining = max(self.deadline - (time.monotonic() - started_at), 0.0)
+            if remaining <= 0 and stage < ShutdownStage.CLOSE:
+                logger.warning(f"Дедлайн остановки истек, шаг '{name}' пропущен")
+                continue
+
+            step_started_at = time.monotonic()
+            try:
+                result = await step(remaining)
+            except Exception as e:
+                logger.error(f"Ошибка при остановке на шаге '{name}': {e}")
+                continue
+            if result is not None:
+                self.results[name] = result
+            logger.info(f"Остановка: {name} - {(time.monotonic() - step_started_at) * 1000:.0f} мс")
+
+        self._log_summary(time.monotonic() - started_at)
+
+    def _log_summary(self, elapsed: float):
+        drained = sum(done for done, _ in self.results.values())
+        abandoned = sum(lost for _, lost in self.results.values())
+        details = ", ".join(f"{name}: {done}/{lost}" for name, (done, lost) in self.results.items())
+        message = (f"Бот остановлен за {elapsed:.1f} с: завершено {drained}, брошено {abandoned}"
+                   f"{f' (завершено/брошено: {details})' if details else ''}")
+        if abandoned:
+            logger.warning(message)
+        else:
+            logger.info(message)
+
+
+# Создаем глобальный экземпляр для удобства использования
+shutdown_coordinator = ShutdownCoordinator()
@@ -0,0 +1,265 @@
+# utils/sla.py
+import calendar
+import heapq
+import logging
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import config
+from models import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+# Статус -> (база отсчета срока, вес). При равном сроке меньший вес раньше:
+# вопрос по уже выполненному заказу важнее нового заказа, а заказ,
+# ждущий документов от пользователя, - просто напоминание.
+SLA_RULES: Dict[str, Tuple[str, int]] = {
+    OrderStatus.AWAITING_CLARIFICATION.value: ('clarification', 0),
+    OrderStatus.PAID.value: ('created', 1),
+    OrderStatus.PENDING.value: ('created', 1),
+    OrderStatus.PROCESSING.value: ('created', 1),
+    OrderStatus.NEEDS_NEW_DOCS.value: ('new_docs', 2),
+}
+
+
+def _parse_utc(value: Optional[str]) -> Optional[float]:
+    """Метка времени из CURRENT_TIMESTAMP SQLite (UTC, 'YYYY-MM-DD HH:MM:SS')"""
+    if not value:
+        return None
+    try:
+        return float(calendar.timegm(time.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')))
+    except ValueError:
+        return None
+
+
+class SlaQueue:
+    """
+    Очередь открытых заказов по сроку ответа (SLA).
+
+    Куча [срок, вес, order_id, актуальна] загружается из БД один раз при
+    запуске, дальше обновляется по событиям изменения статуса от Database.
+    Пересчет срока не ищет запись в куче: старая помечается неактуальной и
+    пропускается при извлечении, куча пересобирается, когда таких
+    записей становится больше живых. Заказ, взятый оператором, уходит из
+    кучи; кому он принадлежит и до какого времени, хранится в БД
+    (claimed_by/claimed_until), очередь только возвращает его обратно при
+    снятии аренды (см. utils/operators.py).
+    """
+
+    def __init__(self, order_hours: float = 24, clarification_hours: float = 4,
+                 new_docs_hours: float = 48):
+        self.hours = {'created': order_hours, 'clarification': clarification_hours, 'new_docs': new_docs_hours}
+
+        self._heap: List[list] = []
+        self._entries: Dict[int, list] = {}
+        self._statuses: Dict[int, str] = {}
+        # Заказы в работе у операторов: order_id -> (оператор, срок, статус)
+        self._taken: Dict[int, Tuple[int, float, str]] = {}
+        self._stale = 0
+        self._database = None
+
+        # Метрики
+        self.loaded = 0
+        self.resolved_in_time = 0
+        self.resolved_breached = 0
+        self.taken_total = 0
+        self.take_expired = 0
+        self.breached_by_status: Counter = Counter()
+
+    def configure(self, order_hours: float = None, clarification_hours: float = None,
+                  new_docs_hours: float = None):
+        """Изменить сроки на ходу (очередь пересчитывается из БД)"""
+        if order_hours is not None:
+            self.hours['created'] = order_hours
+        if clarification_hours is not None:
+            self.hours['clarification'] = clarification_hours
+        if new_docs_hours is not None:
+            self.hours['new_docs'] = new_docs_hours
+        if self._database is not None:
+            self.load(self._database.get_sla_orders(tuple(SLA_RULES)))
+
+    def attach(self, database):
+        """Загрузить открытые заказы и подписаться на изменения статусов"""
+        self._database = database
+        self.load(database.get_sla_orders(tuple(SLA_RULES)))
+        database.subscribe_order_changes(self.on_order_change)
+
+    def load(self, rows: List[tuple]):
+        """Собрать очередь из строк get_sla_orders (занятые операторами - сразу в работу)"""
+        self._heap = []
+        self._entries = {}
+        self._statuses = {}
+        self._taken = {}
+        self._stale = 0
+        now = time.time()
+        for row in rows:
+            entry = self._entry(row, now)
+            if entry is None:
+                continue
+            if row[5] is not None:
+                self._taken[row[0]] = (row[5], entry[0], row[1])
+                continue
+            self._heap.append(entry)
+            self._entries[row[0]] = entry
+            self._statuses[row[0]] = row[1]
+        heapq.heapify(self._heap)
+        self.loaded = len(self._entries) + len(self._taken)
+        logger.info("Очередь SLA загружена: в очереди %s, в работе у операторов %s",
+                    len(self._entries), len(self._taken))
+
+    def _deadline(self, status: str, created_at, last_clarification_at, updated_at, now: float) -> Optional[float]:
+        rule = SLA_RULES.get(status)
+        if rule is None:
+            return None
+        anchor_kind, _ = rule
+        if anchor_kind == 'created':
+            anchor = _parse_utc(created_at)
+        elif anchor_kind == 'clarification':
+            anchor = _parse_utc(last_clarification_at) or _parse_utc(updated_at)
+        else:
+            anchor = _parse_utc(updated_at)
+        return (anchor or now) + self.hours[anchor_kind] * 3600
+
+    def _entry(self, row: tuple, now: float) -> Optional[list]:
+        order_id, status, created_at, last_clarification_at, updated_at = row[:5]
+        deadline = self._deadline(status, created_at, last_clarification_at, updated_at, now)
+        if deadline is None:
+            return None
+        return [deadline, SLA_RULES[status][1], order_id, True]
+
+    def _push(self, entry: list, status: str):
+        heapq.heappush(self._heap, entry)
+        self._entries[entry[2]] = entry
+        self._statuses[entry[2]] = status
+
+    def _discard(self, order_id: int) -> Optional[list]:
+        """Пометить запись заказа неактуальной (без поиска в куче)"""
+        entry = self._entries.pop(order_id, None)
+        self._statuses.pop(order_id, None)
+        if entry is not None:
+            entry[3] = False
+            self._stale += 1
+            if self._stale > len(self._entries):
+                self._compact()
+        return entry
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[3]]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    def _resolve(self, deadline: float, status: str):
+        if time.time() > deadline:
+            self.resolved_breached += 1
+            self.breached_by_status[status] += 1
+        else:
+            self.resolved_in_time += 1
+
+    def on_order_change(self, order_id: int, status: str):
+        """Обработчик события Database: пересчитать место заказа в очереди"""
+        taken = self._taken.get(order_id)
+        previous_status = taken[2] if taken is not None else self._statuses.get(order_id)
+        current = self._entries.get(order_id)
+        previous_deadline = taken[1] if taken is not None else (current[0] if current is not None else None)
+
+        if status not in SLA_RULES:
+            # Заказ закрыт (выполнен, отменен) - фиксируем, уложились ли в срок
+            if previous_deadline is not None:
+                self._resolve(previous_deadline, previous_status)
+            self._taken.pop(order_id, None)
+            self._discard(order_id)
+            return
+
+        if previous_status == status:
+            # Повторное событие в том же статусе (например, второй вопрос) не сдвигает срок
+            return
+
+        if self._database is None:
+            return
+        row = self._database.get_sla_order(order_id)
+        entry = self._entry(row, time.time()) if row is not None else None
+        if entry is None:
+            return
+        # Запрос новых документов - это ответ администратора; вопрос пользователя - нет
+        if previous_deadline is not None and status == OrderStatus.NEEDS_NEW_DOCS.value:
+            self._resolve(previous_deadline, previous_status)
+
+        if taken is not None:
+            # Заказ остается у оператора, меняется только срок
+            self._taken[order_id] = (taken[0], entry[0], row[1])
+            return
+        self._discard(order_id)
+        self._push(entry, row[1])
+
+    def pop_next(self) -> Optional[Tuple[int, str, float]]:
+        """Извлечь самый срочный заказ: (order_id, status, срок) или None"""
+        while self._heap:
+            deadline, _, order_id, alive = heapq.heappop(self._heap)
+            if not alive:
+                self._stale -= 1
+                continue
+            del self._entries[order_id]
+            return order_id, self._statuses.pop(order_id), deadline
+        return None
+
+    def deadline_of(self, order_id: int) -> Optional[Tuple[str, float]]:
+        """Статус и срок заказа по данным БД (для заказа, взятого мимо кучи)"""
+        row = self._database.get_sla_order(order_id) if self._database is not None else None
+        entry = self._entry(row, time.time()) if row is not None else None
+        return (row[1], entry[0]) if entry is not None else None
+
+    def mark_taken(self, order_id: int, operator_id: int, status: str, deadline: float):
+        """Заказ взят оператором (аренда уже записана в БД)"""
+        self._discard(order_id)
+        self._taken[order_id] = (operator_id, deadline, status)
+        self.taken_total += 1
+
+    def release(self, order_id: int, status: str, expired: bool = False):
+        """Аренда снята - вернуть заказ в очередь"""
+        if self._taken.pop(order_id, None) is not None and expired:
+            self.take_expired += 1
+        if order_id not in self._entries:
+            self.on_order_change(order_id, status)
+
+    def taken_by(self, operator_id: int) -> List[int]:
+        """Заказы в работе у оператора"""
+        return [order_id for order_id, taken in self._taken.items() if taken[0] == operator_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Размер очереди, просроченные сейчас и итоги по закрытым заказам"""
+        now = time.time()
+        overdue: Counter = Counter()
+        for order_id, entry in self._entries.items():
+            if entry[0] < now:
+                overdue[self._statuses[order_id]] += 1
+        for _, deadline, status in self._taken.values():
+            if deadline < now:
+                overdue[status] += 1
+        while self._heap and not self._heap[0][3]:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+        nearest = self._heap[0][0] if self._heap else None
+        return {
+            'queued': len(self._entries),
+            'taken': len(self._taken),
+            'overdue': sum(overdue.values()),
+            'overdue_by_status': dict(overdue),
+            'nearest_deadline': nearest,
+            'resolved_in_time': self.resolved_in_time,
+            'resolved_breached': self.resolved_breached,
+            'breached_by_status': dict(self.breached_by_status),
+            'taken_total': self.taken_total,
+            'take_expired': self.take_expired,
+        }
+
+
+# Создаем глобальный экземпляр для удобства использования
+sla_queue = SlaQueue(
+    order_hours=config.SLA_ORDER_HOURS,
+    clarification_hours=config.SLA_CLARIFICATION_HOURS,
+    new_docs_hours=config.SLA_NEW_DOCS_HOURS
+)
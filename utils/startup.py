@@ -0,0 +1,88 @@
+# utils/startup.py
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupOrchestrator:
+    """
+    Последовательность запуска бота.
+
+    Критические шаги выполняются фазами (шаги одной фазы - параллельно),
+    некритичные откладываются до начала приема обновлений и выполняются в фоне.
+    По итогам в лог пишется время каждой фазы.
+    """
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.ready_at: Optional[float] = None
+        self.timings: List[Tuple[str, float]] = []
+        self.deferred_timings: List[Tuple[str, float]] = []
+
+        self._phase_started_at = self.started_at
+        self._deferred: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self._deferred_task: Optional[asyncio.Task] = None
+
+    def mark(self, name: str):
+        """Отметить завершение синхронного этапа (импорты, открытие БД и т.п.)"""
+        now = time.perf_counter()
+        self.timings.append((name, now - self._phase_started_at))
+        self._phase_started_at = now
+
+    async def run_phase(self, name: str, *steps: Awaitable[Any]) -> List[Any]:
+        """Параллельное выполнение независимых шагов; ошибка любого шага прерывает запуск"""
+        self._phase_started_at = time.perf_counter()
+        results = await asyncio.gather(*steps)
+        self.mark(name)
+        return list(results)
+
+    def defer(self, name: str, step: Callable[[], Awaitable[Any]]):
+        """Отложить шаг до начала приема обновлений"""
+        self._deferred.append((name, step))
+
+    def mark_ready(self):
+        """Бот принимает обновления: пишем разбивку по фазам"""
+        self.ready_at = time.perf_counter()
+        self.mark("Прочее")
+        breakdown = ", ".join(f"{name} {elapsed * 1000:.0f} мс" for name, elapsed in self.timings)
+        logger.info(f"Бот готов к приему обновлений за {(self.ready_at - self.started_at) * 1000:.0f} мс "
+                    f"({breakdown})")
+
+    def start_deferred(self):
+        """Запуск отложенных шагов в фоне"""
+        if self._deferred and self._deferred_task is None:
+            self._deferred_task = asyncio.create_task(self._run_deferred())
+
+    async def _run_deferred(self):
+        # Уступаем управление, чтобы поллинг успел отправить первый запрос обновлений
+        await asyncio.sleep(0)
+        started_at = time.perf_counter()
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self._deferred))
+
+        breakdown = ", ".join(f"{name} {elapsed * 1000:.0f} мс" for name, elapsed in self.deferred_timings)
+        logger.info(f"Отложенные задачи запуска выполнены за "
+                    f"{(time.perf_counter() - started_at) * 1000:.0f} мс ({breakdown})")
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[Any]]):
+        started_at = time.perf_counter()
+        try:
+            await step()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Отложенная задача запуска '{name}' завершилась с ошибкой: {e}")
+        finally:
+            self.deferred_timings.append((name, time.perf_counter() - started_at))
+
+    async def stop(self):
+        """Отмена незавершенных отложенных шагов при остановке"""
+        if self._deferred_task is None or self._deferred_task.done():
+            return
+        self._deferred_task.cancel()
+        try:
+            await self._deferred_task
+        except asyncio.CancelledError:
+            pass
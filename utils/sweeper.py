@@ -0,0 +1,121 @@
+# utils/sweeper.py
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _SweepJob:
+    """Периодическая очистка: функция обрабатывает одну пачку и возвращает ее размер"""
+
+    __slots__ = ('name', 'func', 'interval', 'batch_size', 'next_run_at',
+                 'runs', 'processed', 'last_processed', 'last_duration', 'errors')
+
+    def __init__(self, name: str, func: Callable[[int], int], interval: float, batch_size: int):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.batch_size = batch_size
+        self.next_run_at = 0.0
+        self.runs = 0
+        self.processed = 0
+        self.last_processed = 0
+        self.last_duration = 0.0
+        self.errors = 0
+
+
+class Sweeper:
+    """
+    Фоновые задачи обслуживания БД (истекшие окна, просроченные счета и т.п.).
+
+    Каждая задача выполняется раз в свой интервал пачками: функция
+    получает размер пачки и возвращает, сколько строк обработала; пока
+    пачка заполнена целиком, вызывается следующая. Между пачками цикл
+    событий освобождается, чтобы большие объемы не задерживали обработчики.
+    """
+
+    def __init__(self, tick: float = 5.0):
+        self.tick = tick
+        self._jobs: List[_SweepJob] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def add_job(self, name: str, func: Callable[[int], int], interval: float, batch_size: int = 500):
+        """Зарегистрировать задачу: func(batch_size) -> обработано строк"""
+        self._jobs.append(_SweepJob(name, func, interval, batch_size))
+
+    def configure(self, name: str, interval: float = None, batch_size: int = None):
+        """Изменить интервал или размер пачки задачи на ходу"""
+        for job in self._jobs:
+            if job.name == name:
+                if interval is not None:
+                    job.interval = interval
+                if batch_size is not None:
+                    job.batch_size = batch_size
+
+    async def run_job(self, job: _SweepJob) -> int:
+        """Выполнить задачу до исчерпания работы. Возвращает число обработанных строк"""
+        started_at = time.perf_counter()
+        total = 0
+        try:
+            while True:
+                processed = job.func(job.batch_size)
+                total += processed
+                if processed < job.batch_size:
+                    break
+                await asyncio.sleep(0)
+        except Exception as e:
+            job.errors += 1
+            logger.error(f"Ошибка фоновой задачи '{job.name}': {e}")
+        job.runs += 1
+        job.processed += total
+        job.last_processed = total
+        job.last_duration = time.perf_counter() - started_at
+        job.next_run_at = time.monotonic() + job.interval
+        if total:
+            logger.info("%s: обработано %s за %.0f мс", job.name, total, job.last_duration * 1000)
+        return total
+
+    async def run_all(self) -> Dict[str, int]:
+        """Выполнить все задачи сразу (например, по команде администратора)"""
+        return {job.name: await self.run_job(job) for job in self._jobs}
+
+    def start(self):
+        if self._jobs and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None or self._task.done():
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            for job in self._jobs:
+                if job.next_run_at <= now:
+                    await self.run_job(job)
+            await asyncio.sleep(self.tick)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Метрики задач: запуски, обработано всего и в последний раз, ошибки"""
+        return [
+            {
+                'name': job.name,
+                'runs': job.runs,
+                'processed': job.processed,
+                'last_processed': job.last_processed,
+                'last_duration_ms': job.last_duration * 1000,
+                'errors': job.errors,
+            }
+            for job in self._jobs
+        ]
+
+
+# Создаем глобальный экземпляр для удобства использования
+sweeper = Sweeper()
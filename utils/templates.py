@@ -0,0 +1,181 @@
+# utils/templates.py
+import logging
+from html.parser import HTMLParser
+from string import Formatter
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста сообщения Telegram (без учета тегов)
+MAX_MESSAGE_LENGTH = 4096
+
+# Теги, которые Telegram принимает в parse_mode="HTML"
+ALLOWED_TAGS = frozenset({
+    'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del',
+    'a', 'code', 'pre', 'span', 'tg-spoiler', 'blockquote',
+})
+
+
+def html_escape(text: Any) -> str:
+    """Экранирование HTML-символов"""
+    if text is None:
+        return ""
+    return (str(text).replace('&', '&amp;')
+            .replace('<', '&lt;')
+            .replace('>', '&gt;')
+            .replace('"', '&quot;'))
+
+
+class Safe(str):
+    """Готовый HTML-фрагмент, который подставляется в шаблон без экранирования"""
+    __slots__ = ()
+
+
+class _TagChecker(HTMLParser):
+    """Проверка, что разметка состоит из поддерживаемых Telegram тегов и они закрыты"""
+
+    def __init__(self):
+        # Сущности (&lt; и т.п.) разбираются отдельно от текста, чтобы отличать их от голых < и >
+        super().__init__(convert_charrefs=False)
+        self.stack: List[str] = []
+        self.errors: List[str] = []
+        self.text_length = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ALLOWED_TAGS:
+            self.errors.append(f"неподдерживаемый тег <{tag}>")
+        self.stack.append(tag)
+
+    def handle_data(self, data):
+        self.text_length += len(data)
+        if '<' in data or '>' in data:
+            self.errors.append("неэкранированный символ < или > (используйте &lt; и &gt;)")
+
+    def handle_entityref(self, name):
+        self.text_length += 1
+
+    def handle_charref(self, name):
+        self.text_length += 1
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            self.errors.append(f"лишний или непарный </{tag}>")
+            return
+        self.stack.pop()
+
+    def close(self):
+        super().close()
+        for tag in self.stack:
+            self.errors.append(f"не закрыт <{tag}>")
+
+
+def check_markup(text: str) -> List[str]:
+    """Проверить HTML-разметку сообщения перед отправкой. Возвращает список ошибок"""
+    checker = _TagChecker()
+    checker.feed(text)
+    checker.close()
+    errors = list(checker.errors)
+    if checker.text_length > MAX_MESSAGE_LENGTH:
+        errors.append(f"длина текста {checker.text_length} больше {MAX_MESSAGE_LENGTH}")
+    return errors
+
+
+class Template:
+    """
+    Скомпилированный шаблон сообщения с плейсхолдерами {name}.
+
+    При создании текст разбивается на статические куски и имена полей;
+    константы подставляются сразу. Шаблон без полей рендерится один раз
+    и дальше отдается готовой строкой. Значения экранируются, кроме Safe.
+    """
+
+    __slots__ = ('name', 'source', 'fields', '_literals', '_static')
+
+    def __init__(self, name: str, source: str, **constants: Any):
+        self.name = name
+        self.source = source
+
+        literals: List[str] = []
+        fields: List[str] = []
+        current = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            current.append(literal)
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Шаблон '{name}': форматирование в {{{field}}} не поддерживается")
+            if field in constants:
+                value = constants[field]
+                current.append(value if isinstance(value, Safe) else html_escape(value))
+                continue
+            literals.append("".join(current))
+            fields.append(field)
+            current = []
+        literals.append("".join(current))
+
+        self.fields: Tuple[str, ...] = tuple(fields)
+        self._literals: Tuple[str, ...] = tuple(literals)
+        self._static = literals[0] if not fields else None
+
+    @property
+    def is_static(self) -> bool:
+        return self._static is not None
+
+    def render(self, **values: Any) -> str:
+        """Подставить значения в шаблон"""
+        if self._static is not None:
+            return self._static
+
+        literals = self._literals
+        parts = [literals[0]]
+        for index, field in enumerate(self.fields):
+            value = values[field]
+            parts.append(value if isinstance(value, Safe) else html_escape(value))
+            parts.append(literals[index + 1])
+        return "".join(parts)
+
+
+class TemplateRegistry:
+    """Реестр шаблонов сообщений с проверкой при запуске"""
+
+    def __init__(self):
+        self._templates: Dict[str, Template] = {}
+
+    def register(self, name: str, source: str, **constants: Any) -> Template:
+        """Скомпилировать и зарегистрировать шаблон"""
+        template = Template(name, source, **constants)
+        self._templates[name] = template
+        return template
+
+    def get(self, name: str) -> Template:
+        return self._templates[name]
+
+    def render(self, name: str, **values: Any) -> str:
+        return self._templates[name].render(**values)
+
+    def check(self) -> List[str]:
+        """
+        Отрендерить каждый шаблон с пробными значениями и проверить
+        разметку и длину. Возвращает список ошибок.
+        """
+        errors = []
+        for name, template in self._templates.items():
+            try:
+                text = template.render(**{field: "0" for field in template.fields})
+            except Exception as e:
+                errors.append(f"{name}: ошибка рендера: {e}")
+                continue
+
+            errors.extend(f"{name}: {error}" for error in check_markup(text))
+
+        for error in errors:
+            logger.error("Шаблон сообщения: %s", error)
+        logger.info("Проверено шаблонов сообщений: %s, ошибок: %s", len(self._templates), len(errors))
+        return errors
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+# Создаем глобальный экземпляр для удобства использования
+templates = TemplateRegistry()